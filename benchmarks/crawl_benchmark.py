@@ -0,0 +1,185 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Benchmark the crawler end to end against a local stand-in server of YouTube, see fake_server.py.
+It crawls insight data of synthetic video ids with a CrawlEngine, and reports throughput, latency percentiles
+per video and per endpoint, retries and peak RSS of the crawler process.
+
+Polite random sleeps between historical data requests are disabled unless --insight-rate is set.
+
+Usage: python benchmarks/crawl_benchmark.py -n 1000 -w 8
+       python benchmarks/crawl_benchmark.py -n 1000 -w 8 --latency 0.05 --jitter 0.05 --error-rate 0.01 -r
+"""
+
+import os, sys, json, time, shutil, argparse, resource, tempfile, multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import youtube_insight
+from youtube_insight import DATA_API, INSIGHT
+from youtube_insight.crawler import Crawler
+from youtube_insight.engine import CrawlEngine
+from youtube_insight.keypool import KeyPool
+from youtube_insight.metrics import Metrics
+from fake_server import add_server_arguments, build_server
+
+PARTS = 'snippet,contentDetails,statistics,topicDetails'
+FIELDS = 'items(id,snippet,contentDetails,statistics,topicDetails)'
+
+
+class TimedCrawler(Crawler):
+    def crawl_timed(self, video_id, relevant=False):
+        """ Crawl insight data of a video, return a tuple of (seconds, insight_json).
+        """
+        start_time = time.perf_counter()
+        insight_json = self.crawl_insight_data(video_id, relevant)
+        return time.perf_counter() - start_time, insight_json
+
+
+def serve(args, port_queue):
+    """ Run a fake server in a child process, so that it does not compete with the crawler for the GIL.
+    """
+    server = build_server(args)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def point_at(base_url, discovery_cache_path):
+    """ Point all YouTube urls of the crawler at base_url.
+    """
+    youtube_insight.WATCH_URL = base_url + '/watch?v='
+    youtube_insight.INSIGHT_URL = base_url + '/insight_ajax?action_get_statistics_and_data=1&v='
+    youtube_insight.DISCOVERY_URL = base_url + '/discovery/v1/apis/youtube/v3/rest'
+    youtube_insight.DISCOVERY_CACHE_PATH = discovery_cache_path
+
+
+def get_percentile(sorted_values, q):
+    """ Get percentile q of sorted values by nearest rank, None if empty.
+    """
+    if len(sorted_values) == 0:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def get_peak_rss_mb():
+    """ Get peak resident set size of current process in MB.
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on linux
+    return peak_rss / 1024 / 1024 if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def run_benchmark(args, base_url):
+    """ Crawl args.num videos through base_url, return a dict of results.
+    """
+    metrics = Metrics()
+    key_pool = None
+    if args.keys > 1:
+        key_pool = KeyPool(['fake-key-{0}'.format(i) for i in range(args.keys)], daily_quota=args.daily_quota)
+
+    def build_crawler():
+        insight_crawler = TimedCrawler()
+        if key_pool is not None:
+            insight_crawler.set_key_pool(key_pool)
+        else:
+            insight_crawler.set_key('fake-key')
+        insight_crawler.set_parts(PARTS)
+        insight_crawler.set_fields(FIELDS)
+        insight_crawler.set_array_series(args.array_series)
+        insight_crawler.set_metrics(metrics)
+        return insight_crawler
+
+    # a huge rate stands for no limit, it replaces the polite random sleeps
+    rate_limits = {INSIGHT: args.insight_rate if args.insight_rate is not None else 1e9}
+    if args.api_rate is not None:
+        rate_limits[DATA_API] = args.api_rate
+    crawl_engine = CrawlEngine(build_crawler, workers=args.workers, rate_limits=rate_limits)
+
+    video_ids = ['{0:011d}'.format(i) for i in range(args.num)]
+    latencies = []
+    num_succeeded = 0
+    num_complete = 0
+    start_time = time.perf_counter()
+    for _, result in crawl_engine.map('crawl_timed', video_ids, args.relevant):
+        if result is None:
+            continue
+        latency, insight_json = result
+        latencies.append(latency)
+        if insight_json is not None:
+            num_succeeded += 1
+            if 'insights' in insight_json:
+                num_complete += 1
+    elapsed = time.perf_counter() - start_time
+
+    latencies.sort()
+    snapshot = metrics.snapshot()
+    endpoints = {}
+    for histogram in snapshot['histograms'].get('request_seconds', []):
+        endpoints[histogram['labels']['endpoint']] = {'requests': histogram['count'],
+                                                      'p50': histogram['p50'], 'p99': histogram['p99']}
+    for name in ('retries_total', 'errors_total', 'failures_total', 'backoff_seconds_total', 'bytes_total'):
+        for counter in snapshot['counters'].get(name, []):
+            stats = endpoints.setdefault(counter['labels']['endpoint'], {})
+            stats[name] = stats.get(name, 0) + counter['value']
+    return {'videos': args.num, 'succeeded': num_succeeded, 'complete': num_complete, 'seconds': elapsed,
+            'videosPerSecond': args.num / elapsed, 'p50': get_percentile(latencies, 0.5),
+            'p99': get_percentile(latencies, 0.99), 'peakRssMB': get_peak_rss_mb(), 'endpoints': endpoints}
+
+
+def print_results(results):
+    print('>>> {0} videos in {1:.2f}s, {2:.1f} videos/s, {3} succeeded, {4} with historical data'.format(
+        results['videos'], results['seconds'], results['videosPerSecond'], results['succeeded'], results['complete']))
+    if results['p50'] is not None:
+        print('>>> latency per video: p50 {0:.1f}ms, p99 {1:.1f}ms'.format(results['p50'] * 1000,
+                                                                           results['p99'] * 1000))
+    print('>>> peak RSS: {0:.1f}MB'.format(results['peakRssMB']))
+    print('{0:<16} {1:>9} {2:>9} {3:>9} {4:>8} {5:>8} {6:>9} {7:>12}'.format(
+        'endpoint', 'requests', 'p50 ms', 'p99 ms', 'retries', 'errors', 'failures', 'backoff s'))
+    for endpoint, stats in sorted(results['endpoints'].items()):
+        print('{0:<16} {1:>9} {2:>9.1f} {3:>9.1f} {4:>8} {5:>8} {6:>9} {7:>12.1f}'.format(
+            endpoint, stats.get('requests', 0), (stats.get('p50') or 0) * 1000, (stats.get('p99') or 0) * 1000,
+            stats.get('retries_total', 0), stats.get('errors_total', 0), stats.get('failures_total', 0),
+            stats.get('backoff_seconds_total', 0)))
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-n', '--num', type=int, default=1000, help='number of videos to crawl')
+    arg_parser.add_argument('-w', '--workers', type=int, default=8, help='number of crawler worker threads')
+    arg_parser.add_argument('-r', '--relevant', dest='relevant', action='store_true', default=False,
+                            help='also search relevant videos')
+    arg_parser.add_argument('-a', '--array-series', dest='array_series', action='store_true', default=False,
+                            help='parse historical data as numpy arrays')
+    arg_parser.add_argument('-k', '--keys', type=int, default=1, help='number of fake developer keys in a key pool')
+    arg_parser.add_argument('--daily-quota', dest='daily_quota', type=int, default=10000,
+                            help='daily quota units of each fake developer key')
+    arg_parser.add_argument('--api-rate', dest='api_rate', type=float, default=None,
+                            help='maximum data api requests per second')
+    arg_parser.add_argument('--insight-rate', dest='insight_rate', type=float, default=None,
+                            help='maximum historical data requests per second')
+    arg_parser.add_argument('--url', default=None, help='base url of a running fake server, one is started if not set')
+    arg_parser.add_argument('-o', '--output', default=None, help='write results as json to this file')
+    add_server_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    server_process = None
+    base_url = args.url
+    if base_url is None:
+        port_queue = multiprocessing.Queue()
+        server_process = multiprocessing.Process(target=serve, args=(args, port_queue), daemon=True)
+        server_process.start()
+        base_url = 'http://127.0.0.1:{0}'.format(port_queue.get(timeout=30))
+    discovery_dir = tempfile.mkdtemp()
+    point_at(base_url, os.path.join(discovery_dir, 'youtube.v3.json'))
+
+    try:
+        results = run_benchmark(args, base_url)
+    finally:
+        shutil.rmtree(discovery_dir)
+        if server_process is not None:
+            server_process.terminate()
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=2)
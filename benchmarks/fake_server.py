@@ -0,0 +1,266 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+A local stand-in server of YouTube for offline benchmarks.
+It serves the discovery document and the videos, channels and search list methods of YouTube Data API,
+the watch page and the insight_ajax historical data, either from recorded responses or synthesized per id.
+Latency, error rate, 429 rate and quota error rate are configurable.
+
+Recorded responses are read from <corpus>/<endpoint>/<id>.<ext> if exist, e.g.,
+videos/<id>.json and channels/<id>.json hold one API resource, search/<id>.json holds a list of video ids
+relevant to a video or uploaded by a channel, insight_ajax/<id>.xml holds one raw historical data response.
+
+Usage: python benchmarks/fake_server.py -p 8000 --latency 0.05 --error-rate 0.01
+"""
+
+import os, sys, json, time, zlib, random, argparse, threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from parse_benchmark import make_response
+
+# number of distinct synthetic historical data responses, picked by a hash of video id
+NUM_INSIGHT_RESPONSES = 64
+
+
+def get_discovery_doc(base_url):
+    """ Get a minimal discovery document of YouTube Data API, whose requests are sent to base_url.
+    """
+    def method(resource, parameters):
+        parameters = dict(parameters, part={'type': 'string', 'location': 'query', 'required': True})
+        # a method without response schema returns raw bytes instead of parsed json
+        return {'list': {'id': 'youtube.{0}.list'.format(resource), 'path': resource, 'httpMethod': 'GET',
+                         'parameters': parameters, 'parameterOrder': ['part'],
+                         'response': {'$ref': 'ListResponse'}}}
+
+    string_param = {'type': 'string', 'location': 'query'}
+    integer_param = {'type': 'integer', 'location': 'query'}
+    return {'kind': 'discovery#restDescription', 'discoveryVersion': 'v1', 'protocol': 'rest',
+            'name': 'youtube', 'version': 'v3', 'rootUrl': base_url + '/', 'servicePath': 'youtube/v3/',
+            'baseUrl': base_url + '/youtube/v3/', 'batchPath': 'batch',
+            'parameters': {'key': string_param, 'fields': string_param},
+            'schemas': {'ListResponse': {'id': 'ListResponse', 'type': 'object'}},
+            'resources': {'videos': {'methods': method('videos', {'id': string_param})},
+                          'channels': {'methods': method('channels', {'id': string_param})},
+                          'search': {'methods': method('search', {'type': string_param, 'maxResults': integer_param,
+                                                                  'pageToken': string_param, 'order': string_param,
+                                                                  'channelId': string_param,
+                                                                  'relatedToVideoId': string_param})}}}
+
+
+class FakeYouTubeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, corpus_dir=None, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+                 quota_rate=0.0, num_days=600, num_search_results=50, seed=0):
+        """ Set up a fake server at address.
+        Each API and historical data request is delayed by latency seconds plus a uniform random jitter, then fails
+        with 500 at error_rate, 429 at throttle_rate, and, for API requests only, 403 quotaExceeded at quota_rate.
+        Synthetic historical data has num_days days, and a synthetic search lists num_search_results videos.
+        """
+        super(FakeYouTubeServer, self).__init__(address, FakeYouTubeHandler)
+        self.corpus_dir = corpus_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.quota_rate = quota_rate
+        self.num_search_results = num_search_results
+        self.base_url = 'http://{0}:{1}'.format(*self.server_address[:2])
+        self.discovery_doc = json.dumps(get_discovery_doc(self.base_url)).encode('utf-8')
+        self.insight_responses = [make_response(num_days, seed + i, escaped=i % 2 == 1).encode('utf-8')
+                                  for i in range(NUM_INSIGHT_RESPONSES)]
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def draw_fault(self, allow_quota):
+        """ Sleep for the configured latency, then draw an injected fault, None for no fault.
+        """
+        with self.lock:
+            delay = self.latency + self.jitter * self.rng.random()
+            draw = self.rng.random()
+        if delay > 0:
+            time.sleep(delay)
+        if draw < self.error_rate:
+            return 500, 'backendError'
+        draw -= self.error_rate
+        if draw < self.throttle_rate:
+            return 429, 'rateLimitExceeded'
+        draw -= self.throttle_rate
+        if allow_quota and draw < self.quota_rate:
+            return 403, 'quotaExceeded'
+        return None
+
+    def load_recorded(self, endpoint, obj_id, ext):
+        """ Load a recorded response of endpoint for obj_id, None if not recorded.
+        """
+        if self.corpus_dir is None:
+            return None
+        path = os.path.join(self.corpus_dir, endpoint, '{0}.{1}'.format(obj_id, ext))
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as fin:
+            return fin.read()
+
+
+class FakeYouTubeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, obj):
+        self._send(status, json.dumps(obj).encode('utf-8'))
+
+    def _send_fault(self, status, reason):
+        self.server.count('fault {0}'.format(status))
+        self._send_json(status, {'error': {'code': status, 'message': reason,
+                                           'errors': [{'domain': 'youtube', 'reason': reason, 'message': reason}]}})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == '/discovery/v1/apis/youtube/v3/rest':
+            self.server.count('discovery')
+            self._send(200, self.server.discovery_doc)
+        elif url.path == '/watch':
+            self.server.count('watch')
+            body = '<html><script>ytcfg.set({\'XSRF_TOKEN\': "QUFFLUhqbkZha2VUb2tlbg==",});</script></html>'
+            self._send(200, body.encode('utf-8'), 'text/html',
+                       [('Set-Cookie', 'YSC=fakeysc; path=/'), ('Set-Cookie', 'PREF=f1=50000000; path=/')])
+        elif url.path.startswith('/youtube/v3/'):
+            resource = url.path[len('/youtube/v3/'):]
+            self.server.count(resource + '.list')
+            fault = self.server.draw_fault(allow_quota=True)
+            if fault is not None:
+                self._send_fault(*fault)
+            elif resource == 'videos':
+                self._send_json(200, {'items': [self._get_video(vid) for vid in query.get('id', '').split(',') if vid]})
+            elif resource == 'channels':
+                self._send_json(200, {'items': [self._get_channel(query['id'])]})
+            elif resource == 'search':
+                self._send_json(200, self._get_search_page(query))
+            else:
+                self._send_fault(404, 'notFound')
+        else:
+            self._send_fault(404, 'notFound')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if url.path != '/insight_ajax':
+            self._send_fault(404, 'notFound')
+            return
+        self.server.count('insight_ajax')
+        fault = self.server.draw_fault(allow_quota=False)
+        if fault is not None:
+            self._send(fault[0], b'', 'text/xml')
+            self.server.count('fault {0}'.format(fault[0]))
+            return
+        video_id = parse_qs(url.query)['v'][0]
+        body = self.server.load_recorded('insight_ajax', video_id, 'xml')
+        if body is None:
+            body = self.server.insight_responses[zlib.crc32(video_id.encode('utf-8')) % NUM_INSIGHT_RESPONSES]
+        self._send(200, body, 'text/xml')
+
+    def _get_video(self, video_id):
+        recorded = self.server.load_recorded('videos', video_id, 'json')
+        if recorded is not None:
+            return json.loads(recorded.decode('utf-8'))
+        rng = random.Random(video_id)
+        return {'id': video_id,
+                'snippet': {'publishedAt': '2016-07-29T15:03:21.000Z',
+                            'channelId': 'UC{0:022d}'.format(rng.randrange(10 ** 6)),
+                            'title': 'Video {0}'.format(video_id), 'description': 'Description ' * rng.randint(1, 50),
+                            'thumbnails': {'default': {'url': 'https://i.ytimg.com/vi/{0}/default.jpg'.format(video_id)}},
+                            'channelTitle': 'Channel', 'categoryId': '10',
+                            'tags': ['tag{0}'.format(i) for i in range(rng.randint(0, 20))]},
+                'contentDetails': {'duration': 'PT{0}M{1}S'.format(rng.randint(0, 59), rng.randint(0, 59)),
+                                   'definition': 'hd', 'caption': 'false', 'licensedContent': True},
+                'statistics': {'viewCount': str(rng.randint(0, 10 ** 7)), 'likeCount': str(rng.randint(0, 10 ** 5)),
+                               'dislikeCount': str(rng.randint(0, 10 ** 4)), 'favoriteCount': '0',
+                               'commentCount': str(rng.randint(0, 10 ** 4))},
+                'topicDetails': {'relevantTopicIds': ['/m/04rlf', '/m/0glt670', '/m/04rlf'],
+                                 'topicCategories': ['https://en.wikipedia.org/wiki/Music']}}
+
+    def _get_channel(self, channel_id):
+        recorded = self.server.load_recorded('channels', channel_id, 'json')
+        if recorded is not None:
+            return json.loads(recorded.decode('utf-8'))
+        rng = random.Random(channel_id)
+        return {'id': channel_id,
+                'snippet': {'publishedAt': '2011-06-01T15:17:18.000Z', 'description': '', 'title': 'Channel',
+                            'thumbnails': {'default': {'url': 'https://yt3.ggpht.com/photo.jpg'}}},
+                'statistics': {'viewCount': str(rng.randint(0, 10 ** 8)), 'commentCount': '0',
+                               'subscriberCount': str(rng.randint(0, 10 ** 6)), 'hiddenSubscriberCount': False,
+                               'videoCount': str(self.server.num_search_results)}}
+
+    def _get_search_page(self, query):
+        obj_id = query.get('relatedToVideoId') or query.get('channelId', '')
+        recorded = self.server.load_recorded('search', obj_id, 'json')
+        if recorded is not None:
+            video_ids = json.loads(recorded.decode('utf-8'))
+        else:
+            rng = random.Random(obj_id)
+            video_ids = ['{0:011d}'.format(rng.randrange(10 ** 11)) for _ in range(self.server.num_search_results)]
+        offset = int(query.get('pageToken') or 0)
+        max_results = int(query.get('maxResults', 5))
+        page = {'items': [{'id': {'kind': 'youtube#video', 'videoId': vid}}
+                          for vid in video_ids[offset: offset + max_results]]}
+        if offset + max_results < len(video_ids):
+            page['nextPageToken'] = str(offset + max_results)
+        return page
+
+
+def add_server_arguments(parser):
+    """ Add fake server options to an argparse parser.
+    """
+    parser.add_argument('--corpus', default=None, help='directory of recorded responses, see module docstring')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of delay per request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum seconds of random extra delay')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0.0, help='rate of 500 responses')
+    parser.add_argument('--throttle-rate', dest='throttle_rate', type=float, default=0.0,
+                        help='rate of 429 responses')
+    parser.add_argument('--quota-rate', dest='quota_rate', type=float, default=0.0,
+                        help='rate of 403 quotaExceeded responses of API requests')
+    parser.add_argument('--days', type=int, default=600, help='number of days in synthetic historical data')
+    parser.add_argument('--search-results', dest='search_results', type=int, default=50,
+                        help='number of videos in a synthetic search')
+
+
+def build_server(args, port=0):
+    """ Build a fake server on localhost from parsed options, port 0 picks a free port.
+    """
+    return FakeYouTubeServer(('127.0.0.1', port), corpus_dir=args.corpus, latency=args.latency, jitter=args.jitter,
+                             error_rate=args.error_rate, throttle_rate=args.throttle_rate, quota_rate=args.quota_rate,
+                             num_days=args.days, num_search_results=args.search_results)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-p', '--port', type=int, default=8000, help='port to listen on')
+    add_server_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    server = build_server(args, args.port)
+    print('>>> Fake YouTube server listening on {0}'.format(server.base_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('>>> Served requests: {0}'.format(server.stats))
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Benchmark the parsers of insight_ajax responses.
+It runs the xml tree parser and the fast-path parser over a corpus of recorded responses, and reports parse throughput.
+
+Usage: python benchmarks/parse_benchmark.py -c path/to/recorded/responses
+       python benchmarks/parse_benchmark.py -n 1000
+"""
+
+import os, sys, glob, json, time, random, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from youtube_insight import BaseCrawler, json_loads
+
+
+def make_response(num_days, seed, escaped=False):
+    """ Make a synthetic insight_ajax response with num_days days of data.
+    The graph data is wrapped in a CDATA section, or escaped as xml text if escaped is True.
+    """
+    rng = random.Random(seed)
+    days = sorted(rng.sample(range(num_days + num_days // 5), num_days))
+    start_timestamp = 1469750400000
+    graph_data = {'day': {'data': [start_timestamp + d * 86400000 for d in days]},
+                  'views': {'daily': {'data': [rng.randint(0, 5000) for _ in days]}},
+                  'shares': {'daily': {'data': [rng.randint(0, 20) for _ in days]}},
+                  'watch-time': {'daily': {'data': [rng.random() * 1000 for _ in days]}},
+                  'subscribers': {'daily': {'data': [rng.randint(0, 10) for _ in days]}}}
+    text = json.dumps(graph_data)
+    if escaped:
+        text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+    else:
+        text = '<![CDATA[' + text + ']]>'
+    return '<?xml version="1.0" encoding="utf-8"?><html_content><graph_data>' + text + '</graph_data></html_content>'
+
+
+def load_corpus(corpus_dir):
+    """ Load recorded responses, one response per file.
+    """
+    responses = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, '*'))):
+        with open(path, 'r', encoding='utf-8') as fin:
+            responses.append(fin.read())
+    return responses
+
+
+def parse_tree(xml_string):
+    """ Parse a response by building the xml tree and decoding json with the standard library.
+    """
+    return BaseCrawler._parse_graph_data(json.loads(BaseCrawler._extract_graph_data_tree(xml_string)))
+
+
+def bench(name, parser, responses, repeat):
+    """ Run parser over all responses repeat times, print the best throughput.
+    """
+    num_bytes = sum(len(response) for response in responses)
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for response in responses:
+            parser(response)
+        best = min(best, time.perf_counter() - start_time)
+    print('{0:<32} {1:>10.1f} responses/s {2:>8.1f} MB/s'.format(name, len(responses) / best, num_bytes / best / 1e6))
+    return best
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-c', '--corpus', help='directory of recorded insight_ajax responses, one per file')
+    arg_parser.add_argument('-n', '--num', type=int, default=1000, help='number of synthetic responses if no corpus')
+    arg_parser.add_argument('-d', '--days', type=int, default=600, help='number of days in synthetic responses')
+    arg_parser.add_argument('-r', '--repeat', type=int, default=5, help='number of repeats, the best one is reported')
+    args = arg_parser.parse_args()
+
+    if args.corpus is not None:
+        corpus = load_corpus(args.corpus)
+    else:
+        corpus = [make_response(args.days, seed, escaped=seed % 2 == 1) for seed in range(args.num)]
+    print('>>> {0} responses, {1:.1f} MB, json backend: {2}'.format(
+        len(corpus), sum(len(response) for response in corpus) / 1e6, json_loads.__module__))
+
+    # both parsers must agree before timing them
+    for response in corpus:
+        if parse_tree(response) != BaseCrawler._parse_xml(response):
+            print('>>> Parsers disagree on a response!')
+            sys.exit(1)
+
+    tree_time = bench('xml tree parser', parse_tree, corpus, args.repeat)
+    fast_time = bench('fast-path parser', BaseCrawler._parse_xml, corpus, args.repeat)
+    bench('fast-path parser, views only', lambda response: BaseCrawler._parse_xml(response, series=()),
+          corpus, args.repeat)
+    try:
+        bench('fast-path parser, numpy arrays', lambda response: BaseCrawler._parse_xml(response, as_array=True),
+              corpus, args.repeat)
+    except ImportError:
+        print('>>> numpy is not installed, skip array parser')
+    print('>>> fast-path speedup: {0:.2f}x'.format(tree_time / fast_time))
@@ -4,9 +4,17 @@
 Example to illustrate the usage of youtube_insight crawler.
 """
 
-import sys, os, argparse, json, logging
+import sys, os, argparse, logging
 
-from youtube_insight.crawler import Crawler
+from youtube_insight import DATA_API, INSIGHT, PARTS, FIELDS
+from youtube_insight.crawler import Crawler, MAX_RESULTS
+from youtube_insight.engine import CrawlEngine
+from youtube_insight.checkpoint import Checkpoint
+from youtube_insight.sink import JsonlSink, list_shards
+from youtube_insight.cache import LRUCache, SqliteCache
+from youtube_insight.frontier import Frontier
+from youtube_insight.keypool import KeyPool
+from youtube_insight.metrics import Metrics, MetricsReporter
 
 
 if __name__ == '__main__':
@@ -16,8 +24,52 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--output', help='output file path of video data or channel video list', required=True)
     parser.add_argument('-c', '--channel', dest='channel', action='store_true', default=False)
     parser.add_argument('-r', '--relevant',  dest='relevant', action='store_true', default=False)
+    parser.add_argument('-b', '--batch', dest='batch', action='store_true', default=False,
+                        help='crawl video metadata in batches of 50 ids per API call')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of concurrent worker threads')
+    parser.add_argument('-k', '--key-file', dest='key_file', default=None,
+                        help='file of developer keys, one per line, calls rotate to the next key once one is spent')
+    parser.add_argument('--daily-quota', dest='daily_quota', type=int, default=10000,
+                        help='daily quota units of each developer key')
+    parser.add_argument('--session-cache', dest='session_cache', default=None,
+                        help='file to share cookie and sessiontoken across worker threads and processes')
+    parser.add_argument('--api-rate', dest='api_rate', type=float, default=None,
+                        help='maximum data api requests per second')
+    parser.add_argument('--insight-rate', dest='insight_rate', type=float, default=None,
+                        help='maximum historical data requests per second, random sleeps are used if not set')
+    parser.add_argument('--retry-failed', dest='retry_failed', action='store_true', default=False,
+                        help='only retry the ids that failed in previous runs')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], default=None, help='compress output file')
+    parser.add_argument('--flush-records', dest='flush_records', type=int, default=100,
+                        help='number of records buffered before writing to output file')
+    parser.add_argument('--fsync-interval', dest='fsync_interval', type=float, default=None,
+                        help='minimum seconds between two fsyncs of output file')
+    parser.add_argument('--rotate-records', dest='rotate_records', type=int, default=None,
+                        help='start a new output shard after this number of records')
+    parser.add_argument('--rotate-mb', dest='rotate_mb', type=float, default=None,
+                        help='start a new output shard after this size of uncompressed data')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=None,
+                        help='cache at most this number of responses in memory')
+    parser.add_argument('--cache-db', dest='cache_db', default=None,
+                        help='cache responses in a persistent sqlite database at this path')
+    parser.add_argument('--cache-ttl', dest='cache_ttl', type=float, default=None,
+                        help='seconds before a cached response expires')
+    parser.add_argument('--metrics-file', dest='metrics_file', default=None,
+                        help='file to write crawler metrics to periodically')
+    parser.add_argument('--metrics-format', dest='metrics_format', choices=['json', 'prometheus'], default='json',
+                        help='format of metrics file')
+    parser.add_argument('--metrics-interval', dest='metrics_interval', type=float, default=60,
+                        help='seconds between two writes of metrics file')
+    parser.add_argument('-s', '--snowball', dest='snowball', action='store_true', default=False,
+                        help='treat input video ids as seeds, and crawl over their relevant videos')
+    parser.add_argument('--max-depth', dest='max_depth', type=int, default=None,
+                        help='maximum number of hops from the seeds in snowball crawl')
+    parser.add_argument('--budget', type=int, default=None, help='maximum number of videos in snowball crawl')
+    parser.add_argument('--priority', default=None,
+                        help='crawl the relevant videos of the highest value first, e.g., statistics.viewCount')
     parser.set_defaults(channel=False)
     parser.set_defaults(relevant=False)
+    parser.set_defaults(batch=False)
     args = parser.parse_args()
 
     input_path = args.input
@@ -29,67 +81,110 @@ if __name__ == '__main__':
         print('>>> Exit...')
         sys.exit(1)
 
-    crawled_ids = set()
-    if os.path.exists(output_path):
+    if len(list_shards(output_path)) > 0:
         print('>>> Output file already exists, append to current file...')
-        is_channel = False
-        is_video = False
-        with open(output_path, 'r') as fin:
-            for line in fin:
-                obj_json = json.loads(line.rstrip())
-                if is_channel:
-                    crawled_ids.add(obj_json['channelId'])
-                elif is_video:
-                    crawled_ids.add(obj_json['id'])
-                elif 'channelId' in obj_json:
-                    crawled_ids.add(obj_json['channelId'])
-                    is_channel = True
-                elif 'id' in obj_json:
-                    crawled_ids.add(obj_json['id'])
-                    is_video = True
-        output_data = open(output_path, 'a+')
     else:
         print('>>> Output file does not exist, start a new file...')
-        output_data = open(output_path, 'w+')
+    # crawled and failed ids are kept in sidecar index files next to output file
+    checkpoint = Checkpoint(output_path).open()
+    rotate_bytes = int(args.rotate_mb * 1024 * 1024) if args.rotate_mb is not None else None
+    output_data = JsonlSink(output_path, compression=args.compression, batch_size=args.flush_records,
+                            fsync_interval=args.fsync_interval, rotate_records=args.rotate_records,
+                            rotate_bytes=rotate_bytes, checkpoint=checkpoint).open()
+    print('>>> {0} ids crawled, {1} ids failed in previous runs'.format(len(checkpoint.done_ids),
+                                                                        len(checkpoint.failed_ids)))
 
     # == == == == == == == == Part 2: Set up crawler == == == == == == == == #
     d_key = 'Set your own developer key!'
-    parts = 'snippet,contentDetails,statistics,topicDetails'
-    fields = 'items(id,' \
-             'snippet(publishedAt,channelId,title,description,thumbnails,channelTitle,categoryId,tags,defaultLanguage,defaultAudioLanguage),' \
-             'contentDetails(duration,definition,caption,licensedContent,regionRestriction),' \
-             'statistics,' \
-             'topicDetails)'
-
-    insight_crawler = Crawler()
-    insight_crawler.set_key(d_key)
-    insight_crawler.set_parts(parts)
-    insight_crawler.set_fields(fields)
+
+    # one response cache is shared by all worker threads
+    response_cache = None
+    if args.cache_db is not None:
+        response_cache = SqliteCache(args.cache_db, maxsize=args.cache_size, ttl=args.cache_ttl)
+    elif args.cache_size is not None:
+        response_cache = LRUCache(maxsize=args.cache_size, ttl=args.cache_ttl)
+
+    # one key pool is shared by all worker threads, so that quota usage is accounted over the whole crawl
+    key_pool = None
+    if args.key_file is not None:
+        with open(args.key_file, 'r') as key_data:
+            key_pool = KeyPool([line.strip() for line in key_data if line.strip()], daily_quota=args.daily_quota)
+
+    # one metrics registry is shared by all worker threads
+    metrics = Metrics()
+    metrics_reporter = None
+    if args.metrics_file is not None:
+        metrics_reporter = MetricsReporter(metrics, args.metrics_file, interval=args.metrics_interval,
+                                           fmt=args.metrics_format).start()
+
+    def build_crawler():
+        insight_crawler = Crawler()
+        if key_pool is not None:
+            insight_crawler.set_key_pool(key_pool)
+        else:
+            insight_crawler.set_key(d_key)
+        insight_crawler.set_parts(PARTS)
+        insight_crawler.set_fields(FIELDS)
+        insight_crawler.set_cache(response_cache)
+        insight_crawler.set_session_cache(args.session_cache)
+        insight_crawler.set_metrics(metrics)
+        return insight_crawler
+
+    # each worker thread builds its own crawler, requests are throttled by shared rate limiters
+    rate_limits = {}
+    if args.api_rate is not None:
+        rate_limits[DATA_API] = args.api_rate
+    if args.insight_rate is not None:
+        rate_limits[INSIGHT] = args.insight_rate
+    crawl_engine = CrawlEngine(build_crawler, workers=args.workers, rate_limits=rate_limits)
 
     # == == == == == == == == Part 3: Start crawler == == == == == == == == #
     # read the input file, start the crawler
     with open(input_path, 'r') as input_data:
+        if args.retry_failed:
+            target_ids = sorted(checkpoint.failed_ids)
+        else:
+            target_ids = (line.rstrip() for line in input_data if not checkpoint.is_done(line.rstrip()))
         if args.channel:
             logging.info('>>> Crawling video ids for channels...')
-            for cid in input_data:
-                cid = cid.rstrip()
-                if cid not in crawled_ids:
-                    channel_data = insight_crawler.crawl_channel_vids(cid)
-                    if channel_data is not None:
-                        output_data.write('{0}\n'.format(json.dumps(channel_data)))
-                        logging.info('--- Channel data crawler succeeded for channel: {0}'.format(cid))
-                    else:
-                        logging.error('--- Channel data crawler failed for channel: {0}'.format(cid))
+            target_type = 'channel'
+            results = crawl_engine.crawl_channel_vids(target_ids)
+        elif args.snowball:
+            logging.info('>>> Crawling insight data for videos by snowball from seeds...')
+            target_type = 'video'
+            # frontier state is kept next to output file, crawled videos are skipped by the frontier itself
+            frontier = Frontier(output_path + '.frontier', max_depth=args.max_depth, budget=args.budget,
+                                priority=args.priority).open()
+            frontier.seen_ids.update(checkpoint.done_ids)
+            # visited videos are logged once their records are written, failed videos are queued again
+            output_data.add_checkpoint(frontier)
+            frontier.add_seeds(line.rstrip() for line in input_data)
+            results = frontier.run(crawl_engine, batch_size=2 * args.workers)
+        elif args.batch:
+            logging.info('>>> Crawling insight data for videos in batches...')
+            target_type = 'video'
+            results = crawl_engine.crawl_insight_data_batch(target_ids, args.relevant, batch_size=MAX_RESULTS)
         else:
             logging.info('>>> Crawling insight data for videos...')
-            for vid in input_data:
-                vid = vid.rstrip()
-                if vid not in crawled_ids:
-                    video_data = insight_crawler.crawl_insight_data(vid, args.relevant)
-                    if video_data is not None:
-                        output_data.write('{0}\n'.format(json.dumps(video_data)))
-                        logging.info('--- Insight data crawler succeeded for video {0}'.format(vid))
-                    else:
-                        logging.error('--- Insight data crawler failed for video {0}'.format(vid))
+            target_type = 'video'
+            results = crawl_engine.crawl_insight_data(target_ids, args.relevant)
+
+        for target_id, target_data in results:
+            if target_data is not None:
+                # target id is marked done in checkpoint once its record is written
+                output_data.write(target_data, target_id)
+                logging.info('--- Crawler succeeded for {0} {1}'.format(target_type, target_id))
+            else:
+                checkpoint.mark_failed(target_id)
+                logging.error('--- Crawler failed for {0} {1}'.format(target_type, target_id))
 
     output_data.close()
+    checkpoint.close()
+    if args.snowball:
+        frontier.close()
+    if metrics_reporter is not None:
+        metrics_reporter.stop()
+    if key_pool is not None:
+        logging.warning('>>> Developer key stats: {0}'.format(key_pool.stats()))
+    if response_cache is not None:
+        logging.warning('>>> Response cache stats: {0}'.format(response_cache.stats()))
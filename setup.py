@@ -10,5 +10,11 @@ setup(name='youtube_insight',
       url='https://github.com/avalanchesiqi/youtube-insight',
       install_requires=['google-api-python-client>=1.6.4',
                         'urllib3>=1.22',
-                        'googletrans>=2.3.0']
+                        'googletrans>=2.3.0'],
+      extras_require={'async': ['aiohttp>=3.5'],
+                      'zstd': ['zstandard>=0.15'],
+                      'array': ['numpy>=1.13'],
+                      'parquet': ['numpy>=1.13', 'pyarrow>=0.15'],
+                      'analytics': ['numpy>=1.13'],
+                      'fast': ['orjson>=2.0']}
       )
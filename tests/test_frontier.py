@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+""" Failed and unwritten videos of crawl frontier.
+"""
+
+from youtube_insight.checkpoint import Checkpoint
+from youtube_insight.frontier import Frontier
+from youtube_insight.sink import JsonlSink
+
+
+class FlakyCrawler(object):
+    """ A crawler whose videos are relevant to nothing, each video in failures fails that many times first.
+    """
+    def __init__(self, failures):
+        self.failures = dict(failures)
+
+    def crawl_insight_data(self, video_id, relevant=False):
+        if self.failures.get(video_id, 0) > 0:
+            self.failures[video_id] -= 1
+            return None
+        return {'id': video_id}
+
+
+def test_failed_videos_are_queued_again(tmp_path):
+    frontier = Frontier(str(tmp_path / 'frontier'), budget=3, max_tries=2).open()
+    frontier.add_seeds(['vid1', 'vid2', 'vid3', 'vid4'])
+    results = list(frontier.run(FlakyCrawler({'vid1': 1, 'vid2': 5})))
+    frontier.close()
+    # vid1 succeeds on its second try, vid2 is dropped after two tries, failures are not charged to budget
+    crawled_ids = [video_id for video_id, insight_json in results if insight_json is not None]
+    assert crawled_ids == ['vid3', 'vid4', 'vid1']
+    assert frontier.num_visited == 3
+
+
+def test_visits_are_logged_once_written(tmp_path):
+    state_path = str(tmp_path / 'frontier')
+    output_path = str(tmp_path / 'video_insights.json')
+    frontier = Frontier(state_path).open()
+    frontier.add_seeds(['vid{0}'.format(i) for i in range(10)])
+    checkpoint = Checkpoint(output_path).open()
+    output_data = JsonlSink(output_path, batch_size=4, checkpoint=checkpoint).open()
+    output_data.add_checkpoint(frontier)
+    for video_id, insight_json in frontier.run(FlakyCrawler({})):
+        output_data.write(insight_json, video_id)
+        if video_id == 'vid5':
+            break
+    # a crash loses the buffered records of vid4 and vid5, so they are crawled again on resume
+    frontier.close()
+    resumed = Frontier(state_path).open()
+    assert resumed.num_visited == 4
+    assert sorted(video_id for _, _, video_id, _, _ in resumed.queue) == ['vid{0}'.format(i) for i in range(4, 10)]
+    resumed.close()
+    checkpoint.close()
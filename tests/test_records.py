@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+""" Compact records read as crawled json objects, in snowball and refresh.
+"""
+
+import datetime
+
+from youtube_insight.crawler import Crawler
+from youtube_insight.engine import CrawlEngine
+from youtube_insight.frontier import Frontier
+from youtube_insight.records import VideoRecord, to_record
+from youtube_insight.refresh import refresh
+from youtube_insight.sink import JsonlSink, iter_records
+
+TODAY = datetime.date(2020, 3, 1)
+
+
+class FakeCrawler(Crawler):
+    """ A crawler over a chain of videos, video k is relevant to videos k+1 and k+2, and has k * 1000 views.
+    """
+    def get_metadata(self, video_id):
+        return {'id': video_id, 'snippet': {'title': video_id},
+                'statistics': {'viewCount': str(int(video_id[3:]) * 1000)}}
+
+    def crawl_metadata(self, video_id):
+        return self.get_metadata(video_id)
+
+    def crawl_metadata_batch(self, video_ids):
+        return {video_id: self.get_metadata(video_id) for video_id in video_ids}, []
+
+    def crawl_statistics_batch(self, video_ids):
+        return {video_id: {'viewCount': str(int(video_id[3:]) * 2000)} for video_id in video_ids}, []
+
+    def crawl_historical_data(self, video_id):
+        return {'startDate': '2020-02-28', 'days': [0, 1], 'dailyView': [5, 7], 'totalView': 12}
+
+    def search_relevant_videos(self, video_id):
+        k = int(video_id[3:])
+        return ['vid{0}'.format(k + 1), 'vid{0}'.format(k + 2)]
+
+
+def test_record_is_read_only_mapping():
+    obj_json = {'id': 'vid1', 'snippet': {'title': 'vid1', 'unknown': 1}, 'statistics': {'viewCount': '10'},
+                'relevantVideos': ['vid2'], 'unknown': [1]}
+    record = to_record(obj_json)
+    assert dict(record) == obj_json
+    assert record['snippet'] == obj_json['snippet']
+    assert record['statistics']['viewCount'] == '10'
+    assert record.get('insights') is None
+    assert 'unknown' in record and 'insights' not in record
+
+
+def snowball(compact_records):
+    crawler = FakeCrawler()
+    crawler.set_compact_records(compact_records)
+    frontier = Frontier(budget=5, priority='statistics.viewCount')
+    frontier.add_seeds(['vid1'])
+    return list(frontier.run(crawler))
+
+
+def test_snowball_with_compact_records():
+    results = snowball(True)
+    assert all(isinstance(insight_json, VideoRecord) for _, insight_json in results)
+    # compact records are followed and prioritized as json objects are
+    assert [(video_id, dict(insight_json)) for video_id, insight_json in results] == snowball(False)
+    assert len(set(video_id for video_id, _ in results)) == 5
+
+
+def test_refresh_with_compact_records():
+    crawler = FakeCrawler()
+    crawler.set_compact_records(True)
+    records = [crawler.crawl_insight_data('vid{0}'.format(k)) for k in range(1, 4)]
+    for record in records:
+        assert isinstance(record, VideoRecord)
+    stale_record = to_record(dict(records[0], crawledAt='2020-01-01'))
+    fresh_record = to_record(dict(records[1], crawledAt='2020-02-29'))
+    results = list(crawler.refresh_insight_data_batch([stale_record, fresh_record], min_change=10, today=TODAY))
+    refreshed = {obj_json['id']: refreshed_json for obj_json, refreshed_json in results}
+    assert refreshed['vid1']['crawledAt'] == TODAY.isoformat()
+    assert refreshed['vid1']['insights']['days'] == [0, 1]
+    assert refreshed['vid2']['statistics'] == {'viewCount': '4000'}
+    assert refreshed['vid2']['refreshedAt'] == TODAY.isoformat()
+
+
+class OutOfQuotaCrawler(FakeCrawler):
+    """ A crawler whose video vid0 is deleted, and whose statistics calls fail for videos after vid1.
+    """
+    def crawl_statistics_batch(self, video_ids):
+        statistics, _ = super(OutOfQuotaCrawler, self).crawl_statistics_batch(video_ids)
+        return {'vid1': statistics['vid1']}, ['vid0']
+
+
+def test_refresh_failures_are_not_checkpointed(tmp_path):
+    input_path = str(tmp_path / 'video_insights.json')
+    output_path = str(tmp_path / 'video_insights.refreshed.json')
+    crawler = FakeCrawler()
+    with JsonlSink(input_path) as input_data:
+        for k in range(4):
+            input_data.write(dict(crawler.crawl_insight_data('vid{0}'.format(k)), crawledAt=datetime.date.today().isoformat()))
+
+    # the deleted vid0 is kept, the failed vid2 and vid3 are left for the next run
+    num_records = refresh(input_path, output_path, CrawlEngine(OutOfQuotaCrawler, workers=1), min_change=10)
+    assert num_records == {'statistics': 1, 'full': 0, 'kept': 1, 'failed': 2}
+    assert sorted(obj_json['id'] for obj_json in iter_records(output_path)) == ['vid0', 'vid1']
+
+    num_records = refresh(input_path, output_path, CrawlEngine(FakeCrawler, workers=1), min_change=10)
+    assert num_records == {'statistics': 2, 'full': 0, 'kept': 0, 'failed': 0}
+    assert sorted(obj_json['id'] for obj_json in iter_records(output_path)) == ['vid0', 'vid1', 'vid2', 'vid3']
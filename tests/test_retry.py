@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+""" Circuit breaker of retry policies.
+"""
+
+import urllib.error
+
+import pytest
+
+from youtube_insight.keypool import QuotaExhaustedError
+from youtube_insight.retry import RetryPolicy, CircuitBreaker, CircuitOpenError
+
+
+def fail_with(status):
+    def request(attempt):
+        raise urllib.error.HTTPError('https://www.youtube.com/insight_ajax', status, 'error', {}, None)
+    return request
+
+
+def quota_exhausted(attempt):
+    raise QuotaExhaustedError('All API keys are out of quota')
+
+
+def test_session_errors_do_not_open_circuit():
+    policy = RetryPolicy(max_tries=1, retry_statuses=(403, 503), circuit_breaker=CircuitBreaker(failure_threshold=2))
+    for _ in range(5):
+        with pytest.raises(urllib.error.HTTPError):
+            policy.call(fail_with(403))
+    assert not policy.circuit_breaker.is_open()
+    for _ in range(2):
+        with pytest.raises(urllib.error.HTTPError):
+            policy.call(fail_with(503))
+    assert policy.circuit_breaker.is_open()
+
+
+def test_wait_open_circuit():
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+    policy = RetryPolicy(max_tries=1, circuit_breaker=circuit_breaker, name='insight_ajax')
+    with pytest.raises(urllib.error.HTTPError):
+        policy.call(fail_with(503))
+    with pytest.raises(CircuitOpenError):
+        policy.call(lambda attempt: 'ok')
+
+    # a waiting request goes through as the probe once the circuit half-opens
+    policy.wait_open = True
+    assert policy.call(lambda attempt: 'ok') == 'ok'
+    assert not circuit_breaker.is_open()
+
+
+@pytest.mark.parametrize('request_error', [(fail_with(403), urllib.error.HTTPError),
+                                           (quota_exhausted, QuotaExhaustedError)])
+def test_probe_released_after_session_or_quota_error(request_error):
+    request, error = request_error
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+    policy = RetryPolicy(max_tries=1, retry_statuses=(403, 503), circuit_breaker=circuit_breaker,
+                         wait_open=True, max_elapsed=5, name='insight_ajax')
+    with pytest.raises(urllib.error.HTTPError):
+        policy.call(fail_with(503))
+
+    # the probe fails with a stale session or a spent quota, the next request is let through as a new probe
+    with pytest.raises(error):
+        policy.call(request)
+    assert not circuit_breaker.is_probing
+    assert policy.call(lambda attempt: 'ok') == 'ok'
+    assert not circuit_breaker.is_open()
+
+
+def test_wait_open_bounded_by_max_elapsed():
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    policy = RetryPolicy(max_tries=1, circuit_breaker=circuit_breaker, wait_open=True, max_elapsed=0.5)
+    with pytest.raises(urllib.error.HTTPError):
+        policy.call(fail_with(503))
+    with pytest.raises(CircuitOpenError):
+        policy.call(lambda attempt: 'ok')
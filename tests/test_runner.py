@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+""" Resume and merge of multi-process runner after a worker lost records.
+"""
+
+import os
+
+from youtube_insight.checkpoint import Checkpoint
+from youtube_insight.sink import JsonlSink, list_shards, iter_records
+from youtube_insight.runner import get_worker_path, split_ids, merge_workers
+
+
+def write_worker(worker_path, video_ids, compression='gzip'):
+    with Checkpoint(worker_path) as checkpoint:
+        with JsonlSink(worker_path, compression=compression, checkpoint=checkpoint) as output_data:
+            for video_id in video_ids:
+                output_data.write({'id': video_id}, video_id)
+
+
+def test_resume_worker_with_lost_records(tmp_path):
+    input_path = str(tmp_path / 'video_ids.txt')
+    output_path = str(tmp_path / 'video_insights.json')
+    video_ids = ['vid{0:02d}'.format(i) for i in range(40)]
+    with open(input_path, 'w') as fout:
+        fout.writelines(video_id + '\n' for video_id in video_ids)
+
+    # worker 0 marked 20 ids done, but only 10 records can be read back
+    worker_path = get_worker_path(output_path, 0)
+    write_worker(worker_path, video_ids[:10])
+    with open(worker_path + '.done', 'a') as fout:
+        fout.writelines(video_id + '\n' for video_id in video_ids[10:20])
+
+    # the lost records are not merged, and the worker files are kept
+    assert merge_workers(output_path, compression='gzip') == 10
+    assert len(list_shards(worker_path)) > 0
+
+    # they are split again, and merged once crawled
+    assert sum(split_ids(input_path, output_path, 2)) == 30
+    for i in range(2):
+        with open(get_worker_path(output_path, i) + '.ids') as fin:
+            write_worker(get_worker_path(output_path, i), [line.rstrip() for line in fin])
+    assert merge_workers(output_path, compression='gzip') == 30
+    assert sorted(obj_json['id'] for obj_json in iter_records(output_path)) == video_ids
+    assert list_shards(worker_path) == []
+    assert not os.path.exists(worker_path + '.done')
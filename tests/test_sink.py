@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+""" Crash, resume and read back of output sink.
+"""
+
+import os, multiprocessing
+
+import pytest
+
+from youtube_insight.checkpoint import Checkpoint
+from youtube_insight.sink import JsonlSink, COMPRESSION_SUFFIX, list_shards, iter_records
+
+COMPRESSIONS = [None, 'gzip', 'zstd']
+
+
+def write_and_crash(path, compression, video_ids):
+    """ Write records one batch at a time, then exit without closing the sink, as a killed crawler does.
+    """
+    checkpoint = Checkpoint(path).open()
+    output_data = JsonlSink(path, compression=compression, batch_size=1, checkpoint=checkpoint).open()
+    for video_id in video_ids:
+        output_data.write({'id': video_id}, video_id)
+    os._exit(0)
+
+
+def crash(path, compression, video_ids):
+    process = multiprocessing.get_context('fork').Process(target=write_and_crash, args=(path, compression, video_ids))
+    process.start()
+    process.join()
+
+
+def resume(path, compression, video_ids):
+    checkpoint = Checkpoint(path).open()
+    output_data = JsonlSink(path, compression=compression, checkpoint=checkpoint).open()
+    for video_id in video_ids:
+        if not checkpoint.is_done(video_id):
+            output_data.write({'id': video_id}, video_id)
+    output_data.close()
+    checkpoint.close()
+    return checkpoint
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_resume_after_crash(tmp_path, compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    path = str(tmp_path / 'video_insights.json')
+    video_ids = ['vid{0:02d}'.format(i) for i in range(20)]
+    crash(path, compression, video_ids[:10])
+    checkpoint = resume(path, compression, video_ids)
+    read_ids = [obj_json['id'] for obj_json in iter_records(path)]
+    assert sorted(read_ids) == video_ids
+    assert checkpoint.done_ids <= set(read_ids)
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_resume_after_torn_write(tmp_path, compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    path = str(tmp_path / 'video_insights.json')
+    video_ids = ['vid{0:02d}'.format(i) for i in range(20)]
+    crash(path, compression, video_ids[:10])
+    # a batch cut short by a crash, it is not marked done
+    with open(path + COMPRESSION_SUFFIX[compression], 'ab') as fout:
+        fout.write(b'{"id": "vi' if compression is None else b'\x00\x01\x02')
+    resume(path, compression, video_ids)
+    assert sorted(obj_json['id'] for obj_json in iter_records(path)) == video_ids
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'zstd'])
+def test_read_prefix_of_corrupted_shard(tmp_path, compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    path = str(tmp_path / 'video_insights.json')
+    video_ids = ['vid{0:05d}'.format(i) for i in range(20000)]
+    crash(path, compression, video_ids)
+    shard_path = list_shards(path)[0]
+    with open(shard_path, 'ab') as fout:
+        fout.write(os.urandom(1 << 12))
+    read_ids = [obj_json['id'] for obj_json in iter_records(path)]
+    assert read_ids == video_ids[:len(read_ids)]
+    # only the records in the last decompressed step before the corruption are lost
+    assert len(read_ids) >= 0.95 * len(video_ids)
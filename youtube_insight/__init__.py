@@ -2,37 +2,163 @@
 """
 This is the base class of youtube_insight crawler.
 It sets up a client to interact with API and an opener to send request from.
+Both are set up lazily, so that a crawler only pays the startup cost of the path it uses.
 """
 
-import time, datetime, random, json, re, urllib
+import os, time, random, json, html, re, urllib, threading
 from http.cookiejar import CookieJar
 from googleapiclient import discovery
+from googleapiclient.errors import HttpError
 # from googletrans import Translator
 from xml.etree import ElementTree
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# use orjson to parse graph data if installed, it is several times faster than json
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+from youtube_insight.keypool import is_quota_error
+from youtube_insight.retry import get_default_policies
+from youtube_insight.endpoints import VIDEOS_LIST, CHANNELS_LIST, SEARCH_LIST, INSIGHT_AJAX
+
 # YouTube API service and version
 YOUTUBE_API_SERVICE_NAME = 'youtube'
 YOUTUBE_API_VERSION = 'v3'
 
+# YouTube web pages to crawl historical data from
+WATCH_URL = 'https://www.youtube.com/watch?v='
+INSIGHT_URL = 'https://www.youtube.com/insight_ajax?action_get_statistics_and_data=1&v='
+
+# endpoints that can be throttled separately
+DATA_API = 'data_api'
+INSIGHT = 'insight'
+
+# default target video parts and fields of YouTube API, used by example.py and refresh
+PARTS = 'snippet,contentDetails,statistics,topicDetails'
+FIELDS = 'items(id,' \
+         'snippet(publishedAt,channelId,title,description,thumbnails,channelTitle,categoryId,tags,defaultLanguage,defaultAudioLanguage),' \
+         'contentDetails(duration,definition,caption,licensedContent,regionRestriction),' \
+         'statistics,' \
+         'topicDetails)'
+
+# discovery document of YouTube API, cached locally and reloaded after DISCOVERY_TTL seconds
+DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/{0}/{1}/rest'.format(YOUTUBE_API_SERVICE_NAME,
+                                                                                     YOUTUBE_API_VERSION)
+DISCOVERY_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'youtube_insight',
+                                    '{0}.{1}.json'.format(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION))
+DISCOVERY_TTL = 7 * 24 * 3600
+
+# seconds that a cached cookie and sessiontoken are reused for
+SESSION_TTL = 3600
+
+_discovery_doc = None
+_discovery_lock = threading.Lock()
+
+
+def _write_atomic(path, text):
+    """ Write text to path via a temporary file, so that concurrent readers never see a partial file.
+    """
+    dir_path = os.path.dirname(path)
+    if dir_path != '':
+        os.makedirs(dir_path, exist_ok=True)
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w', encoding='utf-8') as fout:
+        fout.write(text)
+    os.replace(tmp_path, path)
+
+
+def get_discovery_doc(cache_path=None):
+    """ Get the parsed discovery document of YouTube API, it is loaded once per process.
+    A cached copy at cache_path, DISCOVERY_CACHE_PATH by default, is used if younger than DISCOVERY_TTL,
+    otherwise the document is downloaded and cached. A stale copy is still used if the download fails.
+    """
+    global _discovery_doc
+    if cache_path is None:
+        cache_path = DISCOVERY_CACHE_PATH
+    with _discovery_lock:
+        if _discovery_doc is not None:
+            return _discovery_doc
+        is_cached = os.path.exists(cache_path)
+        if not is_cached or time.time() - os.path.getmtime(cache_path) > DISCOVERY_TTL:
+            try:
+                text = urllib.request.urlopen(DISCOVERY_URL, timeout=10).read().decode('utf-8')
+                _discovery_doc = json.loads(text)
+                _write_atomic(cache_path, text)
+                return _discovery_doc
+            except (OSError, ValueError):
+                if not is_cached:
+                    raise
+        with open(cache_path, 'r', encoding='utf-8') as fin:
+            _discovery_doc = json.load(fin)
+        return _discovery_doc
+
+
+def build_client(key):
+    """ Build a data api client of a developer key from the cached discovery document.
+    """
+    return discovery.build_from_document(get_discovery_doc(), developerKey=key)
+
 
 class BaseCrawler(object):
     def __init__(self):
         self.key = None
         self.parts = None
         self.fields = None
-        self.client = None
+        self.array_series = False
+        self.insight_series = None
+        self.compact_records = False
+        self.cache = None
+        self.metrics = None
+        self.key_pool = None
+        self.clients = {}
+        self.rate_limiters = {}
+        self.retry_policies = get_default_policies()
         self.opener = urllib.request.build_opener()
-        self.cookie, self.session_token = self._get_cookie_and_sessiontoken()
-        self.post_data = self.get_post_data(self.session_token)
+        self.session_cache_path = None
+        self._client = None
+        self._cookie = None
+        self._session_token = None
+        self._post_data = None
         # self.translator = Translator()
 
     # == == == == == == == == methods to construct data api client == == == == == == == == #
     def set_key(self, key):
-        """ Set developer key.
+        """ Set developer key, the client is built on first API call.
         """
         self.key = key
-        self.client = discovery.build(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION,
-                                      developerKey=self.key, cache_discovery=False)
+        self._client = None
+
+    @property
+    def client(self):
+        """ Data api client of the developer key, built on first access.
+        """
+        if self._client is None and self.key is not None:
+            self._client = build_client(self.key)
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def set_key_pool(self, key_pool):
+        """ Set a pool of developer keys, see KeyPool in youtube_insight.keypool.
+        API calls are charged to the keys in the pool, which rotates to the next key before current one runs out.
+        """
+        self.key_pool = key_pool
+
+    def _get_client(self, key):
+        """ Get the client of a developer key in the pool, build one if not exists.
+        """
+        if key not in self.clients:
+            self.clients[key] = build_client(key)
+        return self.clients[key]
 
     def set_parts(self, parts):
         """ Set target video parts.
@@ -44,28 +170,246 @@ class BaseCrawler(object):
         """
         self.fields = fields
 
+    def set_array_series(self, array_series):
+        """ Set whether historical data series are returned as numpy arrays instead of lists.
+        """
+        self.array_series = array_series
+
+    def set_compact_records(self, compact_records):
+        """ Set whether crawled videos and channels are returned as compact records instead of json objects,
+        see youtube_insight.records.
+        """
+        self.compact_records = compact_records
+
+    def set_insight_series(self, insight_series):
+        """ Set optional historical data series to parse, e.g., {'dailyWatch'}, None for all.
+        """
+        self.insight_series = insight_series
+
+    def _call_api(self, resource, **kwargs):
+        """ Call the list method of an API resource, e.g., videos, channels or search.
+        If a key pool is set, a quotaExceeded error rotates the call to the next key rather than failing it,
+        and KeyPool.acquire raises QuotaExhaustedError once all keys are spent.
+        """
+        endpoint = resource + '.list'
+        if self.key_pool is None:
+            self._throttle(DATA_API)
+            return self._execute(endpoint, getattr(self.client, resource)().list(**kwargs))
+
+        while True:
+            key = self.key_pool.acquire(resource)
+            self._throttle(DATA_API)
+            try:
+                return self._execute(endpoint, getattr(self._get_client(key), resource)().list(**kwargs))
+            except HttpError as e:
+                if not is_quota_error(e.resp.status, e.content):
+                    raise
+                self._count('key_rotations_total', endpoint)
+                self.key_pool.mark_exhausted(key)
+
+    def _execute(self, endpoint, request):
+        """ Execute an API request, and record its latency, outcome and response size.
+        """
+        # the response body is measured before the client parses it
+        postproc = request.postproc
+
+        def measure(resp, content):
+            self._count('bytes_total', endpoint, len(content))
+            return postproc(resp, content)
+        request.postproc = measure
+
+        start_time = time.perf_counter()
+        try:
+            return request.execute()
+        except Exception as e:
+            self._count('errors_total', endpoint, reason=type(e).__name__)
+            raise
+        finally:
+            self._count('requests_total', endpoint)
+            self._observe('request_seconds', endpoint, time.perf_counter() - start_time)
+
+    # == == == == == == == == methods to cache responses == == == == == == == == #
+    def set_cache(self, cache):
+        """ Set a response cache, e.g., LRUCache or SqliteCache in youtube_insight.cache.
+        """
+        self.cache = cache
+
+    def _cache_get(self, endpoint, obj_id, parts=None, fields=None, query=None):
+        """ Get cached response of endpoint, None if no cache is set or not cached.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.get(endpoint, obj_id, parts, fields, query)
+
+    def _cache_set(self, endpoint, obj_id, value, parts=None, fields=None, query=None):
+        """ Cache response of endpoint if a cache is set.
+        """
+        if self.cache is not None:
+            self.cache.set(endpoint, obj_id, value, parts, fields, query)
+
+    # == == == == == == == == methods to record metrics == == == == == == == == #
+    def set_metrics(self, metrics):
+        """ Set a metrics registry, see Metrics in youtube_insight.metrics.
+        Response bytes of every endpoint are exported from the start, even before its first response.
+        """
+        self.metrics = metrics
+        if metrics is not None:
+            for endpoint in (VIDEOS_LIST, CHANNELS_LIST, SEARCH_LIST, INSIGHT_AJAX):
+                metrics.inc('bytes_total', 0, endpoint=endpoint)
+
+    def _count(self, name, endpoint, value=1, **labels):
+        """ Increase counter name of endpoint if a metrics registry is set.
+        """
+        if self.metrics is not None:
+            self.metrics.inc(name, value, endpoint=endpoint, **labels)
+
+    def _observe(self, name, endpoint, value):
+        """ Observe value in histogram name of endpoint if a metrics registry is set.
+        """
+        if self.metrics is not None:
+            self.metrics.observe(name, value, endpoint=endpoint)
+
+    # == == == == == == == == methods to retry requests == == == == == == == == #
+    def set_retry_policy(self, endpoint, retry_policy):
+        """ Set the retry policy of endpoint, e.g., VIDEOS_LIST or INSIGHT_AJAX in youtube_insight.endpoints,
+        see RetryPolicy in youtube_insight.retry.
+        """
+        self.retry_policies[endpoint] = retry_policy
+
+    def _retry(self, endpoint, func):
+        """ Call func(attempt) under the retry policy of endpoint, and return its result.
+        It raises the last error if func keeps failing, or a permanent error at once.
+        """
+        return self.retry_policies[endpoint].call(func, sleep=lambda seconds: self._backoff(endpoint, seconds))
+
+    def _backoff(self, endpoint, seconds):
+        """ Sleep seconds before retrying a request to endpoint, and record the retry.
+        """
+        self._count('retries_total', endpoint)
+        self._count('backoff_seconds_total', endpoint, seconds)
+        time.sleep(seconds)
+
+    # == == == == == == == == methods to throttle requests == == == == == == == == #
+    def set_rate_limiter(self, endpoint, rate_limiter):
+        """ Set a rate limiter for endpoint, either DATA_API or INSIGHT.
+        A rate limiter can be any object with an acquire() method that blocks until a request is allowed.
+        """
+        self.rate_limiters[endpoint] = rate_limiter
+
+    def _throttle(self, endpoint):
+        """ Block until the rate limiter of endpoint allows a request.
+        Return False if no rate limiter is set for endpoint.
+        """
+        if endpoint in self.rate_limiters:
+            start_time = time.perf_counter()
+            self.rate_limiters[endpoint].acquire()
+            self._count('throttle_seconds_total', endpoint, time.perf_counter() - start_time)
+            return True
+        return False
+
     # def update_translator(self):
     #     """ Update Google translator.
     #     """
     #     self.translator = Translator()
 
     # == == == == == == == == methods to construct historical data opener == == == == == == == == #
+    def set_session_cache(self, session_cache_path):
+        """ Set a file to share cookie and sessiontoken across crawlers and processes.
+        A cached session is reused for SESSION_TTL seconds, or until reset_session is called.
+        """
+        self.session_cache_path = session_cache_path
+
+    @property
+    def cookie(self):
+        if self._cookie is None:
+            self._load_session()
+        return self._cookie
+
+    @property
+    def session_token(self):
+        if self._session_token is None:
+            self._load_session()
+        return self._session_token
+
+    @property
+    def post_data(self):
+        if self._post_data is None:
+            self._post_data = self.get_post_data(self.session_token)
+        return self._post_data
+
+    def _load_session(self):
+        """ Load cookie and sessiontoken from session cache if fresh, otherwise get new ones from watch page.
+        """
+        session = self._read_session_cache(self.session_cache_path)
+        if session is None:
+            start_time = time.perf_counter()
+            try:
+                session = self._get_cookie_and_sessiontoken()
+            finally:
+                self._observe('session_seconds', INSIGHT_AJAX, time.perf_counter() - start_time)
+            self._write_session_cache(self.session_cache_path, session)
+        self._cookie, self._session_token = session
+        self._post_data = None
+
+    def reset_session(self):
+        """ Drop current cookie and sessiontoken, e.g., after they are rejected, new ones are got on next use.
+        The session cache is also removed if it still holds the dropped session.
+        """
+        if self._session_token is not None and \
+                self._read_session_cache(self.session_cache_path, None) == (self._cookie, self._session_token):
+            try:
+                os.remove(self.session_cache_path)
+            except OSError:
+                pass
+        self._cookie = None
+        self._session_token = None
+        self._post_data = None
+
+    @staticmethod
+    def _write_session_cache(session_cache_path, session):
+        """ Write a tuple of (cookie, sessiontoken) to session cache if session_cache_path is set.
+        """
+        if session_cache_path is not None:
+            _write_atomic(session_cache_path, json.dumps({'cookie': session[0], 'sessionToken': session[1],
+                                                          'timestamp': time.time()}))
+
+    @staticmethod
+    def _read_session_cache(session_cache_path, ttl=SESSION_TTL):
+        """ Read a tuple of (cookie, sessiontoken) from session cache, None if not exists or older than ttl seconds.
+        """
+        if session_cache_path is None or not os.path.exists(session_cache_path):
+            return None
+        try:
+            with open(session_cache_path, 'r', encoding='utf-8') as fin:
+                session = json.load(fin)
+            if ttl is not None and time.time() - session['timestamp'] > ttl:
+                return None
+            return session['cookie'], session['sessionToken']
+        except (OSError, ValueError, KeyError):
+            return None
+
     @staticmethod
     def _get_cookie_and_sessiontoken():
         """ Get cookie and sessiontoken.
         """
         cj = CookieJar()
         opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cj), urllib.request.HTTPHandler())
-        req = urllib.request.Request('https://www.youtube.com/watch?v=' + 'rYEDA3JcQqw')
+        req = urllib.request.Request(WATCH_URL + 'rYEDA3JcQqw')
         src = opener.open(req).read().decode('utf-8')
 
         time.sleep(random.random())
 
+        return BaseCrawler._parse_cookie_and_sessiontoken([(cookie_i.name, cookie_i.value) for cookie_i in cj], src)
+
+    @staticmethod
+    def _parse_cookie_and_sessiontoken(cookie_pairs, src):
+        """ Parse cookie from (name, value) pairs and sessiontoken from watch page source.
+        """
         cookiename = ['YSC', 'PREF', 'VISITOR_INFO1_LIVE', 'ACTIVITY']
         cookie = ''
-        for cookie_i in cj:
-            if cookie_i.name in cookiename:
-                cookie += (cookie_i.name + '=' + cookie_i.value + '; ')
+        for name, value in cookie_pairs:
+            if name in cookiename:
+                cookie += (name + '=' + value + '; ')
         cookie = cookie[0:-2]
 
         re_st = re.compile('\'XSRF_TOKEN\'\: \"([^\"]+)\"\,')
@@ -82,7 +426,7 @@ class BaseCrawler(object):
     def get_url(vid):
         """ Get the historical data request URL.
         """
-        return 'https://www.youtube.com/insight_ajax?action_get_statistics_and_data=1&v=' + vid
+        return INSIGHT_URL + vid
 
     @staticmethod
     def _get_header(cookie, vid):
@@ -92,22 +436,56 @@ class BaseCrawler(object):
         headers.append(('Content-Type', 'application/x-www-form-urlencoded'))
         headers.append(('Cookie', cookie))
         headers.append(('Origin', 'https://www.youtube.com'))
-        headers.append(('Referer', 'https://www.youtube.com/watch?v=' + vid))
+        headers.append(('Referer', WATCH_URL + vid))
         headers.append(('User-Agent', 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/52.0.2743.116 Safari/537.36'))
         return headers
 
     # == == == == == == == == method to parse retrieved xml response == == == == == == == == #
     @staticmethod
-    def _parse_xml(xml_string):
+    def _parse_xml(xml_string, as_array=False, series=None):
         """ Parse xml response from historical data crawler.
+        If as_array is True, daily series are returned as typed numpy arrays, see _parse_graph_data_array.
+        series is a collection of optional series to parse, e.g., {'dailyWatch'}, None for all of
+        dailyShare, dailyWatch and dailySubscriber. dailyView and days are always parsed.
+        """
+        json_data = json_loads(BaseCrawler._extract_graph_data(xml_string))
+        if as_array:
+            return BaseCrawler._parse_graph_data_array(json_data, series)
+        return BaseCrawler._parse_graph_data(json_data, series)
+
+    @staticmethod
+    def _extract_graph_data(xml_string):
+        """ Extract the text of graph_data element by string search, without building the xml tree.
+        It falls back to _extract_graph_data_tree if graph_data is not a plain element with text or one CDATA section.
+        """
+        start = xml_string.find('<graph_data>')
+        end = xml_string.rfind('</graph_data>')
+        if start == -1 or end < start:
+            return BaseCrawler._extract_graph_data_tree(xml_string)
+        text = xml_string[start + len('<graph_data>'): end]
+        if text.startswith('<![CDATA[') and text.endswith(']]>') and text.count(']]>') == 1:
+            return text[len('<![CDATA['): -len(']]>')]
+        if '<' in text:
+            return BaseCrawler._extract_graph_data_tree(xml_string)
+        if '&' in text:
+            return html.unescape(text)
+        return text
+
+    @staticmethod
+    def _extract_graph_data_tree(xml_string):
+        """ Extract the text of graph_data element from the xml tree.
         """
         xml_tree = ElementTree.fromstring(xml_string)
         graph_data = xml_tree.find('graph_data')
 
         if graph_data is None:
             raise Exception('--- Can not find data in the xml response')
+        return graph_data.text
 
-        json_data = json.loads(graph_data.text)
+    @staticmethod
+    def _parse_graph_data(json_data, series=None):
+        """ Parse graph data into daily series lists and totals.
+        """
         json_return = {}
 
         # try parse daily view count
@@ -118,34 +496,33 @@ class BaseCrawler(object):
         json_return['dailyView'] = daily_view
 
         # get start date
-        start_date = datetime.datetime.fromtimestamp(json_data['day']['data'][0]/1000.0)
-        start_date = start_date.strftime('%Y-%m-%d')
-        json_return['startDate'] = start_date
+        day_data = json_data['day']['data']
+        json_return['startDate'] = time.strftime('%Y-%m-%d', time.localtime(day_data[0] / 1000.0))
 
         # get days with stats
-        days = [round((d - json_data['day']['data'][0]) / 86400000) for d in json_data['day']['data']]
-        json_return['days'] = days
+        start_day = day_data[0]
+        json_return['days'] = [round((d - start_day) / 86400000) for d in day_data]
 
         # get total views
         total_view = sum(daily_view)
         json_return['totalView'] = total_view
 
         # try parse daily share count and get total shares
-        if 'shares' in json_data:
+        if 'shares' in json_data and (series is None or 'dailyShare' in series):
             daily_share = json_data['shares']['daily']['data']
             total_share = sum(daily_share)
             json_return['dailyShare'] = daily_share
             json_return['totalShare'] = total_share
 
         # try parse daily watch time and get average watch time
-        if 'watch-time' in json_data:
+        if 'watch-time' in json_data and (series is None or 'dailyWatch' in series):
             daily_watch = json_data['watch-time']['daily']['data']
             avg_watch = sum(daily_watch) / total_view
             json_return['dailyWatch'] = daily_watch
             json_return['avgWatch'] = avg_watch
 
         # try parse daily subscriber count and get total subscribers
-        if 'subscribers' in json_data:
+        if 'subscribers' in json_data and (series is None or 'dailySubscriber' in series):
             daily_subscriber = json_data['subscribers']['daily']['data']
             total_subscriber = sum(daily_subscriber)
             json_return['dailySubscriber'] = daily_subscriber
@@ -153,6 +530,54 @@ class BaseCrawler(object):
 
         return json_return
 
+    @staticmethod
+    def _parse_graph_data_array(json_data, series=None):
+        """ Parse graph data into numpy arrays, with the same keys as _parse_xml.
+        days and dailyView, dailyShare, dailySubscriber are int64 arrays, dailyWatch is a float64 array,
+        totals and averages are python numbers computed from the arrays.
+        """
+        if np is None:
+            raise ImportError('Array series require numpy, install it with pip install numpy')
+        json_return = {}
+
+        # try parse daily view count
+        try:
+            daily_view = np.asarray(json_data['views']['daily']['data'], dtype=np.int64)
+        except:
+            raise Exception('-- Can not get view count in the xml response')
+        json_return['dailyView'] = daily_view
+
+        # get start date
+        day_data = np.asarray(json_data['day']['data'], dtype=np.int64)
+        json_return['startDate'] = time.strftime('%Y-%m-%d', time.localtime(day_data[0] / 1000.0))
+
+        # get days with stats, np.rint rounds half to even as python round does
+        json_return['days'] = np.rint((day_data - day_data[0]) / 86400000).astype(np.int64)
+
+        # get total views
+        total_view = int(daily_view.sum())
+        json_return['totalView'] = total_view
+
+        # try parse daily share count and get total shares
+        if 'shares' in json_data and (series is None or 'dailyShare' in series):
+            daily_share = np.asarray(json_data['shares']['daily']['data'], dtype=np.int64)
+            json_return['dailyShare'] = daily_share
+            json_return['totalShare'] = int(daily_share.sum())
+
+        # try parse daily watch time and get average watch time
+        if 'watch-time' in json_data and (series is None or 'dailyWatch' in series):
+            daily_watch = np.asarray(json_data['watch-time']['daily']['data'], dtype=np.float64)
+            json_return['dailyWatch'] = daily_watch
+            json_return['avgWatch'] = float(daily_watch.sum()) / total_view
+
+        # try parse daily subscriber count and get total subscribers
+        if 'subscribers' in json_data and (series is None or 'dailySubscriber' in series):
+            daily_subscriber = np.asarray(json_data['subscribers']['daily']['data'], dtype=np.int64)
+            json_return['dailySubscriber'] = daily_subscriber
+            json_return['totalSubscriber'] = int(daily_subscriber.sum())
+
+        return json_return
+
     # == == == == == == == == method to remove emoji in string == == == == == == == == #
     @staticmethod
     def _remove_emoji(text):
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+This is the engagement analytics of youtube_insight crawler.
+It computes per video features of a crawl output as numpy arrays, following the engagement measures of
+Beyond Views: Measuring and Predicting Engagement in Online Videos, ICWSM 2018:
+1. watch percentage, i.e., average watch time over video duration,
+2. relative engagement, i.e., the rank percentile of watch percentage among videos of similar duration,
+3. view growth, i.e., views in the first days of historical data and their share of total views.
+
+Records are read in chunks of lines, and each chunk is parsed and reduced to fixed-size features in a pool of
+worker processes, so that daily series are never held beyond one chunk. Relative engagement is looked up in an
+engagement map, a histogram of watch percentage per duration bin, which is built over the whole crawl or loaded
+from a reference crawl.
+
+Usage: python -m youtube_insight.analytics -i data/video_insights.json -o data/video_features.npz -p 8
+"""
+
+import os, re, sys, argparse, itertools, collections, multiprocessing
+
+import numpy as np
+
+from youtube_insight import json_loads
+from youtube_insight.sink import iter_lines
+
+# ISO 8601 duration of contentDetails, e.g., PT1H2M3S or P1DT2H
+RE_DURATION = re.compile(r'^P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d+)?)S)?)?$')
+
+# engagement map resolution, duration bins are log-spaced between 10 seconds and 1 day
+NUM_DURATION_BINS = 1000
+NUM_WATCH_BINS = 1000
+MIN_DURATION = 10
+MAX_DURATION = 86400
+
+# (name, dtype) of feature arrays, missing values are '', -1 or nan
+FEATURES = [('id', str),
+            ('category_id', str),
+            ('duration', np.float64),
+            ('view_count', np.int64),
+            ('total_view', np.int64),
+            ('avg_watch', np.float64),
+            ('watch_percentage', np.float64),
+            ('first_views', np.int64),
+            ('view_growth', np.float64)]
+
+
+def parse_duration(duration):
+    """ Parse an ISO 8601 duration into seconds, nan if it is not a duration.
+    """
+    match = RE_DURATION.match(duration) if isinstance(duration, str) else None
+    if match is None or duration in ('P', 'PT'):
+        return np.nan
+    weeks, days, hours, minutes, seconds = [float(value) if value is not None else 0.0 for value in match.groups()]
+    return (((weeks * 7 + days) * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def parse_durations(durations):
+    """ Parse an array of ISO 8601 durations into seconds, each distinct duration is parsed once.
+    """
+    distinct, inverse = np.unique(np.asarray(durations, dtype=str), return_inverse=True)
+    return np.array([parse_duration(duration) for duration in distinct], dtype=np.float64)[inverse]
+
+
+def get_duration_bins(durations, num_bins=NUM_DURATION_BINS):
+    """ Get the log-spaced duration bin of each duration, durations out of range fall into the first or last bin.
+    """
+    log_range = np.log10(MAX_DURATION) - np.log10(MIN_DURATION)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bins = np.floor((np.log10(durations) - np.log10(MIN_DURATION)) / log_range * num_bins)
+    return np.clip(np.nan_to_num(bins), 0, num_bins - 1).astype(np.int64)
+
+
+def get_watch_bins(watch_percentages, num_bins=NUM_WATCH_BINS):
+    """ Get the watch percentage bin of each watch percentage in [0, 1].
+    """
+    return np.clip(np.nan_to_num(watch_percentages * num_bins), 0, num_bins - 1).astype(np.int64)
+
+
+def get_features(lines, num_days=30):
+    """ Parse a chunk of json lines into a dict of feature arrays, see FEATURES.
+    watch_percentage is avgWatch in minutes over duration, capped at 1, and missing for zero duration, e.g., live
+    streams.
+    first_views is the number of views in the first num_days days of historical data, view_growth is its share of
+    totalView, both are missing if historical data covers fewer days.
+    """
+    columns = {name: [] for name, _ in FEATURES[:6]}
+    days = []
+    daily_view = []
+    lengths = []
+    for line in lines:
+        obj_json = json_loads(line)
+        if 'id' not in obj_json or 'channelId' in obj_json:
+            continue
+        snippet = obj_json.get('snippet', {})
+        insights = obj_json.get('insights', {})
+        columns['id'].append(obj_json['id'])
+        columns['category_id'].append(snippet.get('categoryId', ''))
+        columns['duration'].append(obj_json.get('contentDetails', {}).get('duration', ''))
+        columns['view_count'].append(int(obj_json.get('statistics', {}).get('viewCount', -1)))
+        columns['total_view'].append(insights.get('totalView', -1))
+        columns['avg_watch'].append(insights.get('avgWatch', np.nan))
+        # only the series needed for view growth are kept, concatenated over the chunk
+        video_days = insights.get('days', [])
+        days.extend(video_days)
+        daily_view.extend(insights.get('dailyView', [0] * len(video_days)))
+        lengths.append(len(video_days))
+
+    features = {}
+    for name, dtype in FEATURES[:6]:
+        features[name] = np.array(columns[name], dtype=dtype) if name != 'duration' else parse_durations(columns[name])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        features['watch_percentage'] = np.where(features['duration'] > 0,
+                                                np.minimum(features['avg_watch'] * 60 / features['duration'], 1.0),
+                                                np.nan)
+
+    num_videos = len(lengths)
+    lengths = np.array(lengths, dtype=np.int64)
+    days = np.array(days, dtype=np.int64)
+    daily_view = np.array(daily_view, dtype=np.int64)
+    video_index = np.repeat(np.arange(num_videos), lengths)
+    is_first = days < num_days
+    features['first_views'] = np.bincount(video_index[is_first], weights=daily_view[is_first],
+                                          minlength=num_videos).astype(np.int64)
+    # the last day of each video, -1 for videos without historical data
+    last_days = np.full(num_videos, -1, dtype=np.int64)
+    last_days[lengths > 0] = days[np.cumsum(lengths)[lengths > 0] - 1]
+    is_covered = last_days >= num_days - 1
+    features['first_views'][~is_covered] = -1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        features['view_growth'] = np.where(is_covered & (features['total_view'] > 0),
+                                           features['first_views'] / features['total_view'], np.nan)
+    return features
+
+
+class EngagementMap(object):
+    def __init__(self, num_duration_bins=NUM_DURATION_BINS, num_watch_bins=NUM_WATCH_BINS):
+        """ A histogram of watch percentage per log-spaced duration bin, used to rank watch percentage
+        among videos of similar duration. It is built chunk by chunk with add, and saved to be reused as a reference.
+        """
+        self.num_duration_bins = num_duration_bins
+        self.num_watch_bins = num_watch_bins
+        self.counts = np.zeros((num_duration_bins, num_watch_bins), dtype=np.int64)
+
+    def add(self, durations, watch_percentages):
+        """ Add videos to the histogram, videos with missing duration or watch percentage are skipped.
+        """
+        is_valid = ~(np.isnan(durations) | np.isnan(watch_percentages))
+        index = get_duration_bins(durations[is_valid], self.num_duration_bins) * self.num_watch_bins + \
+            get_watch_bins(watch_percentages[is_valid], self.num_watch_bins)
+        self.counts += np.bincount(index, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def get_relative_engagement(self, durations, watch_percentages):
+        """ Get the relative engagement of each video in [0, 1], i.e., the share of videos in its duration bin that
+        have lower watch percentage, with ties counted as half. Missing values are nan.
+        """
+        duration_bins = get_duration_bins(durations, self.num_duration_bins)
+        watch_bins = get_watch_bins(watch_percentages, self.num_watch_bins)
+        cumulative = np.cumsum(self.counts, axis=1)
+        totals = cumulative[:, -1][duration_bins]
+        below = cumulative[duration_bins, watch_bins] - self.counts[duration_bins, watch_bins] / 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative_engagement = below / totals
+        relative_engagement[np.isnan(durations) | np.isnan(watch_percentages) | (totals == 0)] = np.nan
+        return relative_engagement
+
+    def save(self, path):
+        np.savez_compressed(path, counts=self.counts)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            counts = data['counts']
+        engagement_map = cls(*counts.shape)
+        engagement_map.counts = counts
+        return engagement_map
+
+
+def iter_chunks(path, chunk_size=10000):
+    """ Iterate over lists of chunk_size json lines in all output shards of path.
+    """
+    lines = iter_lines(path)
+    return iter(lambda: list(itertools.islice(lines, chunk_size)), [])
+
+
+def compute_features(path, num_days=30, processes=None, chunk_size=10000, engagement_map=None):
+    """ Compute feature arrays of all videos in path, in a pool of processes workers, see get_features.
+    It returns a tuple of (features, engagement_map), features also has relative_engagement.
+    If engagement_map is None, it is built over all videos in path.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    chunks = []
+    new_map = EngagementMap() if engagement_map is None else None
+    with multiprocessing.Pool(processes) as pool:
+        # chunks are parsed in parallel, only their fixed-size features are sent back.
+        # At most twice the number of processes chunks are read ahead, so that input is not loaded at once
+        pending = collections.deque()
+        for lines in itertools.chain(iter_chunks(path, chunk_size), [None]):
+            if lines is not None:
+                pending.append(pool.apply_async(get_features, (lines, num_days)))
+            while len(pending) > 0 and (lines is None or len(pending) >= 2 * processes):
+                features = pending.popleft().get()
+                if new_map is not None:
+                    new_map.add(features['duration'], features['watch_percentage'])
+                chunks.append(features)
+    if engagement_map is None:
+        engagement_map = new_map
+
+    if len(chunks) == 0:
+        features = {name: np.array([], dtype=dtype) for name, dtype in FEATURES}
+    else:
+        features = {name: np.concatenate([chunk[name] for chunk in chunks]) for name, _ in FEATURES}
+    features['relative_engagement'] = engagement_map.get_relative_engagement(features['duration'],
+                                                                           features['watch_percentage'])
+    return features, engagement_map
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help='input file path of video data', required=True)
+    parser.add_argument('-o', '--output', help='output file path of video features, ends with .npz', required=True)
+    parser.add_argument('-p', '--processes', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--num-days', dest='num_days', type=int, default=30,
+                        help='number of first days of view growth')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=10000,
+                        help='number of records parsed at once by a worker')
+    parser.add_argument('--engagement-map', dest='engagement_map', default=None,
+                        help='load engagement map from this .npz file if it exists, otherwise save the built one')
+    args = parser.parse_args()
+
+    if not args.output.endswith('.npz'):
+        print('>>> Output file must end with .npz!')
+        sys.exit(1)
+    reference_map = None
+    if args.engagement_map is not None and os.path.exists(args.engagement_map):
+        reference_map = EngagementMap.load(args.engagement_map)
+    video_features, built_map = compute_features(args.input, args.num_days, args.processes, args.chunk_size,
+                                                 reference_map)
+    if args.engagement_map is not None and reference_map is None:
+        built_map.save(args.engagement_map)
+    np.savez_compressed(args.output, **video_features)
+    print('>>> Computed features of {0} videos to {1}'.format(len(video_features['id']), args.output))
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+This is the asyncio version of youtube_insight crawler.
+It crawls metadata from YouTube V3 API and historical data from web request with one pooled keep-alive HTTP session,
+so that thousands of requests can be in flight from one process.
+
+Requests are throttled by token buckets, see set_rate_limiter, and historical data requests by DEFAULT_INSIGHT_RATE
+unless another rate limiter is set, as thousands of concurrent requests would overwhelm the server otherwise.
+
+It requires aiohttp, install it with `pip install .[async]`.
+"""
+
+import os, asyncio, logging
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from youtube_insight import BaseCrawler, WATCH_URL, DATA_API, INSIGHT
+from youtube_insight.crawler import Crawler, MAX_RESULTS
+from youtube_insight.engine import TokenBucket
+from youtube_insight.keypool import is_quota_error, redact_key
+from youtube_insight.retry import get_default_policies, SESSION_STATUSES
+from youtube_insight.endpoints import VIDEOS_LIST, CHANNELS_LIST, SEARCH_LIST, INSIGHT_AJAX
+
+# YouTube V3 API REST endpoint
+API_URL = 'https://www.googleapis.com/youtube/v3/'
+
+# default maximum historical data requests per second of a crawler
+DEFAULT_INSIGHT_RATE = 5
+
+
+class AsyncCrawler(object):
+    def __init__(self, connection_limit=100, keepalive_timeout=30, session_cache_path=None):
+        """ Set up an asyncio crawler.
+        connection_limit is the maximum number of simultaneous connections in the pool,
+        idle connections are kept alive for keepalive_timeout seconds.
+        Cookie and sessiontoken are shared with other crawlers via session_cache_path if set, see BaseCrawler.
+        """
+        if aiohttp is None:
+            raise ImportError('AsyncCrawler requires aiohttp, install it with pip install aiohttp')
+        self.key = None
+        self.key_pool = None
+        self.parts = None
+        self.fields = None
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+        self.cookie = None
+        self.session_token = None
+        self.post_data = None
+        self.session_cache_path = session_cache_path
+        self.session_lock = None
+        self.retry_policies = get_default_policies()
+        self.rate_limiters = {INSIGHT: TokenBucket(DEFAULT_INSIGHT_RATE)}
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    # == == == == == == == == methods to construct http session == == == == == == == == #
+    async def start(self):
+        """ Open the pooled HTTP session, and get cookie and sessiontoken for historical data crawler.
+        """
+        connector = aiohttp.TCPConnector(limit=self.connection_limit, keepalive_timeout=self.keepalive_timeout)
+        # unsafe cookie jar also accepts cookies from ip address hosts, e.g., a local stand-in server
+        self.session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.CookieJar(unsafe=True))
+        self.session_lock = asyncio.Lock()
+        await self._load_session()
+
+    async def _load_session(self):
+        """ Load cookie and sessiontoken from session cache if fresh, otherwise get new ones from watch page.
+        """
+        session = BaseCrawler._read_session_cache(self.session_cache_path)
+        if session is None:
+            async with self.session.get(WATCH_URL + 'rYEDA3JcQqw') as response:
+                src = await response.text()
+            cookie_pairs = [(morsel.key, morsel.value) for morsel in self.session.cookie_jar]
+            session = BaseCrawler._parse_cookie_and_sessiontoken(cookie_pairs, src)
+            BaseCrawler._write_session_cache(self.session_cache_path, session)
+        self.cookie, self.session_token = session
+        self.post_data = BaseCrawler.get_post_data(self.session_token)
+        # cookie is sent in request header, do not let the session jar interfere
+        self.session.cookie_jar.clear()
+
+    async def reset_session(self, session_token):
+        """ Get a new cookie and sessiontoken after session_token is rejected, see BaseCrawler.reset_session.
+        Many requests may be rejected at once, the session is renewed only by the first of them.
+        """
+        async with self.session_lock:
+            if session_token != self.session_token:
+                return
+            if BaseCrawler._read_session_cache(self.session_cache_path, None) == (self.cookie, self.session_token):
+                try:
+                    os.remove(self.session_cache_path)
+                except OSError:
+                    pass
+            await self._load_session()
+
+    async def close(self):
+        """ Close the HTTP session and its connection pool.
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def set_key(self, key):
+        """ Set developer key.
+        """
+        self.key = key
+
+    def set_key_pool(self, key_pool):
+        """ Set a pool of developer keys, see Crawler.set_key_pool.
+        """
+        self.key_pool = key_pool
+
+    def set_retry_policy(self, endpoint, retry_policy):
+        """ Set the retry policy of endpoint, see BaseCrawler.set_retry_policy.
+        Backoff is awaited, so one retrying request does not hold up the others.
+        """
+        self.retry_policies[endpoint] = retry_policy
+
+    def _retry(self, endpoint, func):
+        return self.retry_policies[endpoint].call_async(func)
+
+    def set_rate_limiter(self, endpoint, rate_limiter):
+        """ Set a rate limiter for endpoint, either DATA_API or INSIGHT.
+        A rate limiter can be any object with an acquire_async() coroutine, e.g., a TokenBucket,
+        which may be shared with other crawlers. Pass None to turn off throttling of endpoint.
+        """
+        if rate_limiter is None:
+            self.rate_limiters.pop(endpoint, None)
+        else:
+            self.rate_limiters[endpoint] = rate_limiter
+
+    async def _throttle(self, endpoint):
+        """ Await until the rate limiter of endpoint allows a request.
+        """
+        if endpoint in self.rate_limiters:
+            await self.rate_limiters[endpoint].acquire_async()
+
+    def set_parts(self, parts):
+        """ Set target video parts.
+        """
+        self.parts = parts
+
+    def set_fields(self, fields):
+        """ Set fine-grained target video fields within parts.
+        """
+        self.fields = fields
+
+    async def _call_api(self, resource, **kwargs):
+        """ Call the list method of an API resource, e.g., videos, channels or search.
+        If a key pool is set, a quotaExceeded error rotates the call to the next key, see Crawler._call_api.
+        """
+        params = {}
+        for name, value in kwargs.items():
+            if value is not None:
+                params[name] = str(value)
+        while True:
+            key = self.key if self.key_pool is None else self.key_pool.acquire(resource)
+            params['key'] = key
+            await self._throttle(DATA_API)
+            async with self.session.get(API_URL + resource, params=params) as response:
+                if self.key_pool is not None and response.status == 403 and \
+                        is_quota_error(response.status, await response.read()):
+                    self.key_pool.mark_exhausted(key)
+                    continue
+                response.raise_for_status()
+                return await response.json()
+
+    # == == == == == == == == methods to crawl channel == == == == == == == == #
+    async def crawl_channel_vids(self, channel_id):
+        """ Crawl channel video id list, see Crawler.crawl_channel_vids.
+        """
+        channel_json = await self.list_channel_statistics(channel_id)
+        if channel_json is not None:
+            try:
+                channel_videos_list = await self.list_channel_videos(channel_id)
+            except Exception:
+                return None
+            if len(channel_videos_list) > 0:
+                channel_json.update({'channelVideos': channel_videos_list})
+            return channel_json
+        return None
+
+    async def list_channel_statistics(self, channel_id):
+        """ Call the API's channels().list method to list the existing channel statistics.
+        """
+        try:
+            response = await self._retry(CHANNELS_LIST, lambda attempt: self._call_api('channels', id=channel_id,
+                                                                                       part='snippet,statistics'))
+        except Exception as e:
+            logging.error('--- Channel statistics crawler failed on channel {0}: {1}'.format(
+                channel_id, redact_key(str(e))))
+            return None
+        if isinstance(response.get('items'), list) and len(response['items']) > 0:
+            return Crawler._format_channel(response['items'][0])
+        logging.error('--- Channel statistics crawler found no channel {0}'.format(channel_id))
+        return None
+
+    async def list_channel_videos(self, channel_id):
+        """ Call the API's search().list method to list the existing channel video ids.
+        """
+        return await self._list_search_results(channelId=channel_id, part='snippet', type='video', order='date')
+
+    # == == == == == == == == methods to crawl video == == == == == == == == #
+    async def crawl_insight_data(self, video_id, relevant=False):
+        """ Crawl youtube insight data, see Crawler.crawl_insight_data.
+        """
+        insight_json = await self.crawl_metadata(video_id)
+        if insight_json is not None:
+            historical_json = await self.crawl_historical_data(video_id)
+            if historical_json is not None:
+                insight_json.update({'insights': historical_json})
+            if relevant:
+                relevant_videos_list = await self.search_relevant_videos(video_id)
+                if len(relevant_videos_list) > 0:
+                    insight_json.update({'relevantVideos': relevant_videos_list})
+            return insight_json
+        return None
+
+    async def crawl_metadata(self, video_id):
+        """ Call API's videos().list method to list video metadata.
+        """
+        try:
+            response = await self._retry(VIDEOS_LIST, lambda attempt: self._call_api('videos', id=video_id,
+                                                                                     part=self.parts,
+                                                                                     fields=self.fields))
+        except Exception as e:
+            logging.error('--- Metadata crawler failed on video {0}: {1}'.format(video_id, redact_key(str(e))))
+            return None
+        if isinstance(response.get('items'), list) and len(response['items']) > 0:
+            try:
+                return Crawler._format_metadata(response['items'][0])
+            except Exception as e:
+                logging.error('--- Metadata crawler failed to format video {0}: {1}'.format(video_id, repr(e)))
+                return None
+        logging.error('--- Metadata crawler found no video {0}'.format(video_id))
+        return None
+
+    async def crawl_historical_data(self, video_id):
+        """ Make a request to YouTube server to get historical data.
+        """
+        url = BaseCrawler.get_url(video_id)
+
+        async def request(attempt):
+            await self._throttle(INSIGHT)
+            # session is read per try, as a rejected session is renewed before next try
+            session_token = self.session_token
+            headers = dict(BaseCrawler._get_header(self.cookie, video_id))
+            async with self.session.post(url, data=self.post_data, headers=headers,
+                                         timeout=aiohttp.ClientTimeout(total=2 ** (attempt + 1))) as response:
+                if response.status in SESSION_STATUSES:
+                    await self.reset_session(session_token)
+                response.raise_for_status()
+                return await response.text()
+
+        try:
+            content = await self._retry(INSIGHT_AJAX, request)
+        except Exception as e:
+            logging.error('--- Historical data crawler failed on video {0}: {1}'.format(video_id, redact_key(str(e))))
+            return None
+
+        try:
+            return BaseCrawler._parse_xml(content)
+        except Exception as e:
+            logging.error('--- Failed to parse historical data of video {0}: {1}'.format(video_id, str(e)))
+            return None
+
+    async def search_relevant_videos(self, video_id):
+        """ Call API's search().list method to search the relevant videos, an empty list if the listing fails.
+        """
+        try:
+            return await self._list_search_results(relatedToVideoId=video_id, part='snippet', type='video',
+                                                   order='relevance')
+        except Exception:
+            return []
+
+    async def _list_search_results(self, **kwargs):
+        """ Call API's search().list method page by page, and collect video ids from all pages.
+        The error of a page that keeps failing is raised, as a partial list would look complete.
+        """
+        video_ids = []
+        page_token = None
+        while True:
+            try:
+                response = await self._retry(SEARCH_LIST, lambda attempt: self._call_api(
+                    'search', maxResults=MAX_RESULTS, pageToken=page_token, **kwargs))
+            except Exception as e:
+                logging.error('--- Search crawler failed on {0}: {1}'.format(kwargs, redact_key(str(e))))
+                raise
+            if response is None or not isinstance(response.get('items'), list) or len(response['items']) == 0:
+                break
+            for res_json in response['items']:
+                video_ids.append(res_json['id']['videoId'])
+            if 'nextPageToken' not in response:
+                break
+            page_token = response['nextPageToken']
+        return video_ids
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+This is the response cache of youtube_insight crawler.
+It caches crawled json results keyed on (endpoint, id, parts, fields, query), so that a video or channel that is reached
+many times, e.g., in a snowball crawl over relevant videos, costs network and quota only once.
+
+There are two backends with the same interface,
+1. LRUCache, an in-memory cache bounded by the number and the total size of entries,
+2. SqliteCache, a persistent on-disk cache that survives restarts.
+Values are stored as json strings, hence every get returns a fresh object that the caller can modify.
+"""
+
+import time, json, sqlite3, threading
+from collections import OrderedDict
+
+
+class BaseCache(object):
+    def __init__(self, ttl=None):
+        """ Set up hit/miss counters and ttl.
+        ttl is the time to live in seconds, either a number for all endpoints or a dict mapping endpoint to seconds,
+        None for never expire. An endpoint missing from the dict never expires.
+        """
+        self.ttl = ttl
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+
+    def _get_ttl(self, endpoint):
+        if isinstance(self.ttl, dict):
+            return self.ttl.get(endpoint)
+        return self.ttl
+
+    def _get_expire_time(self, endpoint):
+        ttl = self._get_ttl(endpoint)
+        if ttl is None:
+            return None
+        return time.time() + ttl
+
+    def _count(self, endpoint, hit):
+        counter = self.hits if hit else self.misses
+        counter[endpoint] = counter.get(endpoint, 0) + 1
+
+    def stats(self):
+        """ Get hit and miss counts and hit rate of each endpoint.
+        """
+        with self.lock:
+            stats = {}
+            for endpoint in set(self.hits) | set(self.misses):
+                hits = self.hits.get(endpoint, 0)
+                misses = self.misses.get(endpoint, 0)
+                stats[endpoint] = {'hits': hits, 'misses': misses, 'hitRate': hits / (hits + misses)}
+            return stats
+
+    def get(self, endpoint, obj_id, parts=None, fields=None, query=None):
+        """ Get cached value, None if not cached or expired.
+        query names the parameter that obj_id is passed as when it is not the id, e.g., channelId of search.list.
+        """
+        raise NotImplementedError
+
+    def set(self, endpoint, obj_id, value, parts=None, fields=None, query=None):
+        """ Cache a json serializable value.
+        """
+        raise NotImplementedError
+
+
+class LRUCache(BaseCache):
+    def __init__(self, maxsize=100000, ttl=None, maxbytes=1 << 28):
+        """ Set up an in-memory cache that keeps at most maxsize entries, and at most maxbytes of json strings,
+        as an entry of historical data is tens of KB. Least recently used entries are evicted first.
+        """
+        super(LRUCache, self).__init__(ttl)
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.num_bytes = 0
+        self.entries = OrderedDict()
+
+    def get(self, endpoint, obj_id, parts=None, fields=None, query=None):
+        key = (endpoint, obj_id, parts, fields, query)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.time():
+                del self.entries[key]
+                self.num_bytes -= len(entry[1])
+                entry = None
+            self._count(endpoint, entry is not None)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+        return json.loads(entry[1])
+
+    def set(self, endpoint, obj_id, value, parts=None, fields=None, query=None):
+        key = (endpoint, obj_id, parts, fields, query)
+        entry = (self._get_expire_time(endpoint), json.dumps(value))
+        with self.lock:
+            old_entry = self.entries.pop(key, None)
+            if old_entry is not None:
+                self.num_bytes -= len(old_entry[1])
+            self.entries[key] = entry
+            self.num_bytes += len(entry[1])
+            while len(self.entries) > self.maxsize or (self.maxbytes is not None and self.num_bytes > self.maxbytes):
+                _, old_entry = self.entries.popitem(last=False)
+                self.num_bytes -= len(old_entry[1])
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SqliteCache(BaseCache):
+    def __init__(self, path, maxsize=None, ttl=None):
+        """ Set up a persistent cache in sqlite database at path.
+        If maxsize is set, least recently used entries beyond maxsize are evicted from time to time.
+        """
+        super(SqliteCache, self).__init__(ttl)
+        self.path = path
+        self.maxsize = maxsize
+        self.num_sets = 0
+        # one connection shared by all threads, serialized by the lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, '
+                          'expire_time REAL, access_time REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS cache_access_time ON cache (access_time)')
+        self.conn.commit()
+
+    @staticmethod
+    def _get_key(endpoint, obj_id, parts, fields, query):
+        return json.dumps([endpoint, obj_id, parts, fields, query])
+
+    def get(self, endpoint, obj_id, parts=None, fields=None, query=None):
+        key = self._get_key(endpoint, obj_id, parts, fields, query)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT value, expire_time FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] < now:
+                self.conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+                self.conn.commit()
+                row = None
+            self._count(endpoint, row is not None)
+            if row is None:
+                return None
+            self.conn.execute('UPDATE cache SET access_time = ? WHERE key = ?', (now, key))
+            # commit at once, an open write transaction would block other processes sharing the database
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def set(self, endpoint, obj_id, value, parts=None, fields=None, query=None):
+        key = self._get_key(endpoint, obj_id, parts, fields, query)
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                              (key, json.dumps(value), self._get_expire_time(endpoint), time.time()))
+            self.num_sets += 1
+            # evict in bulk rather than on every insert
+            if self.maxsize is not None and self.num_sets % 1000 == 0:
+                self.conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY access_time DESC '
+                                  'LIMIT -1 OFFSET ?)', (self.maxsize,))
+            self.conn.commit()
+
+    def close(self):
+        """ Close the database.
+        """
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
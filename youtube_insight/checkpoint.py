@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+This is the checkpoint index of youtube_insight crawler.
+It keeps the crawled and failed ids of an output file in two sidecar files, one id per line,
+so that a crawl can resume without re-parsing the whole output file.
+"""
+
+import os, logging
+
+from youtube_insight.sink import list_shards, iter_records
+
+
+def get_record_id(obj_json):
+    """ Get the id of a crawled record, either a channel or a video.
+    """
+    if 'channelId' in obj_json:
+        return obj_json['channelId']
+    return obj_json['id']
+
+
+class Checkpoint(object):
+    def __init__(self, output_path):
+        """ Set up a checkpoint index for output_path.
+        Crawled ids are appended to output_path.done, failed ids are appended to output_path.failed.
+        """
+        self.output_path = output_path
+        self.done_path = output_path + '.done'
+        self.failed_path = output_path + '.failed'
+        self.done_ids = set()
+        self.failed_ids = set()
+        self._done_fd = None
+        self._failed_fd = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def open(self):
+        """ Load existing index, or build it from output file on first use, then open index files for appending.
+        """
+        if os.path.exists(self.done_path):
+            self.done_ids = self._read_ids(self.done_path)
+        elif len(list_shards(self.output_path)) > 0:
+            logging.warning('>>> Checkpoint index does not exist, build it from {0}...'.format(self.output_path))
+            self.done_ids = self._scan_output(self.output_path)
+            with open(self.done_path, 'w') as fout:
+                fout.writelines('{0}\n'.format(obj_id) for obj_id in self.done_ids)
+        if os.path.exists(self.failed_path):
+            self.failed_ids = self._read_ids(self.failed_path) - self.done_ids
+
+        self._done_fd = os.open(self.done_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._failed_fd = os.open(self.failed_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self
+
+    def rebuild(self):
+        """ Rebuild crawled ids from the records that can be read back from output file instead of the index,
+        as the records of a compressed shard torn by a crash may be lost after they were marked done.
+        Call it before open. Return the ids marked done whose records can not be read back.
+        """
+        indexed_ids = self._read_ids(self.done_path) if os.path.exists(self.done_path) else set()
+        self.done_ids = self._scan_output(self.output_path)
+        lost_ids = indexed_ids - self.done_ids
+        if len(lost_ids) > 0:
+            logging.error('--- {0} crawled ids can not be read back from {1}, they are crawled again'.format(
+                len(lost_ids), self.output_path))
+        if indexed_ids != self.done_ids:
+            with open(self.done_path, 'w') as fout:
+                fout.writelines('{0}\n'.format(obj_id) for obj_id in self.done_ids)
+        return lost_ids
+
+    def close(self):
+        """ Close index files.
+        """
+        for fd in (self._done_fd, self._failed_fd):
+            if fd is not None:
+                os.close(fd)
+        self._done_fd = None
+        self._failed_fd = None
+
+    def is_done(self, obj_id):
+        """ Check whether obj_id has been crawled.
+        """
+        return obj_id in self.done_ids
+
+    def mark_done(self, obj_id):
+        """ Record obj_id as crawled.
+        Call it only after the record of obj_id has been written to output file.
+        """
+        # one write call on an O_APPEND file descriptor, so a line is never interleaved or half written
+        os.write(self._done_fd, '{0}\n'.format(obj_id).encode('utf-8'))
+        self.done_ids.add(obj_id)
+        self.failed_ids.discard(obj_id)
+
+    def mark_failed(self, obj_id):
+        """ Record obj_id as failed, so that it can be retried later.
+        """
+        os.write(self._failed_fd, '{0}\n'.format(obj_id).encode('utf-8'))
+        self.failed_ids.add(obj_id)
+
+    @staticmethod
+    def _read_ids(path):
+        """ Read ids from an index file, skip an incomplete last line.
+        """
+        ids = set()
+        with open(path, 'r') as fin:
+            for line in fin:
+                if line.endswith('\n') and len(line) > 1:
+                    ids.add(line[:-1])
+        return ids
+
+    @staticmethod
+    def _scan_output(output_path):
+        """ Collect record ids from all output shards, skip corrupted lines.
+        """
+        ids = set()
+        for obj_json in iter_records(output_path):
+            try:
+                ids.add(get_record_id(obj_json))
+            except KeyError:
+                logging.error('--- Skip record without id in output file {0}'.format(output_path))
+        return ids
@@ -4,17 +4,29 @@ This is the main class of youtube_insight crawler.
 It crawls metadata from YouTube V3 API and historical data from web request.
 """
 
-import time, random, logging
+import time, random, logging, datetime, urllib.request, urllib.error
+from collections import OrderedDict
 
-from youtube_insight import BaseCrawler
+from youtube_insight import BaseCrawler, INSIGHT
+from youtube_insight.endpoints import VIDEOS_LIST, CHANNELS_LIST, SEARCH_LIST, INSIGHT_AJAX
+from youtube_insight.retry import SESSION_STATUSES
+from youtube_insight.keypool import redact_key
+from youtube_insight.records import to_record
+
+# maximum number of ids in one API call, or results in one page
+MAX_RESULTS = 50
+
+# daily series in historical data, all aligned with days
+SERIES_KEYS = ('dailyView', 'dailyShare', 'dailyWatch', 'dailySubscriber')
 
 
 class Crawler(BaseCrawler):
     def __init__(self):
         super(Crawler, self).__init__()
 
-    def crawl_channel_vids(self, channel_id):
+    def crawl_channel_vids(self, channel_id, on_video=None):
         """ Crawl channel video id list.
+        on_video is called with each video id as soon as its page arrives, see list_channel_videos.
         It returns a json object that lists channel snippet and current videos, an example would be
         {channelId: ,
          snippet: {publishedAt: ,
@@ -31,56 +43,101 @@ class Crawler(BaseCrawler):
         """
         channel_json = self.list_channel_statistics(channel_id)
         if channel_json is not None:
-            channel_videos_list = self.list_channel_videos(channel_id)
+            try:
+                channel_videos_list = self.list_channel_videos(channel_id, on_video=on_video)
+            except Exception:
+                # a partial listing would look complete, so the channel fails as a whole and is retried
+                return None
             if len(channel_videos_list) > 0:
                 channel_json.update({'channelVideos': channel_videos_list})
-            return channel_json
+            return self._to_record(channel_json)
         return None
 
     def list_channel_statistics(self, channel_id):
         """ Call the API's channels().list method to list the existing channel statistics.
         """
-        # exponential back-off
-        for i in range(0, 3):
-            try:
-                response = self.client.channels().list(id=channel_id, part='snippet, statistics').execute()
-                if response is not None and isinstance(response['items'], list) and len(response['items']) > 0:
-                    res_json = response['items'][0]
-                    channel_json = {'channelId': res_json['id'],
-                                    'snippet': {'publishedAt': res_json['snippet']['publishedAt'],
-                                                'description': res_json['snippet']['description'],
-                                                'thumbnails': res_json['snippet']['thumbnails']['default']['url'],
-                                                'title': res_json['snippet']['title']},
-                                    'statistics': res_json['statistics']}
-                    return channel_json
-            except Exception as e:
-                logging.error('--- Exception in channel statistics crawler:', str(e))
-                time.sleep((2 ** i) + random.random())
-        logging.error('--- Channel statistics crawler failed on channel {0}'.format(channel_id))
+        channel_json = self._cache_get(CHANNELS_LIST, channel_id, 'snippet,statistics')
+        if channel_json is not None:
+            return channel_json
+
+        try:
+            response = self._retry(CHANNELS_LIST, lambda attempt: self._call_api('channels', id=channel_id,
+                                                                                 part='snippet, statistics'))
+        except Exception as e:
+            self._count('failures_total', CHANNELS_LIST)
+            logging.error('--- Channel statistics crawler failed on channel {0}: {1}'.format(
+                channel_id, redact_key(str(e))))
+            return None
+        if isinstance(response.get('items'), list) and len(response['items']) > 0:
+            channel_json = self._format_channel(response['items'][0])
+            self._cache_set(CHANNELS_LIST, channel_id, channel_json, 'snippet,statistics')
+            return channel_json
+        logging.error('--- Channel statistics crawler found no channel {0}'.format(channel_id))
         return None
 
-    def list_channel_videos(self, channel_id, page_token=None):
+    def list_channel_videos(self, channel_id, page_token=None, on_video=None):
         """ Call the API's search().list method to list the existing channel video ids.
+        If on_video is set, it is called with each video id while the listing goes on,
+        so that the videos can be crawled before the whole channel is listed.
+        """
+        if page_token is None:
+            channel_videos = self._cache_get(SEARCH_LIST, channel_id, 'snippet', query='channelId')
+            if channel_videos is not None:
+                if on_video is not None:
+                    for video_id in channel_videos:
+                        on_video(video_id)
+                return channel_videos
+
+        next_page_tokens = []
+        channel_videos = []
+        for video_id in self.iter_channel_videos(channel_id, page_token=page_token, on_page=next_page_tokens.append):
+            channel_videos.append(video_id)
+            if on_video is not None:
+                on_video(video_id)
+        # only cache a complete listing
+        if page_token is None and len(next_page_tokens) > 0 and next_page_tokens[-1] is None:
+            self._cache_set(SEARCH_LIST, channel_id, channel_videos, 'snippet', query='channelId')
+        return channel_videos
+
+    def iter_channel_videos(self, channel_id, page_token=None, max_pages=None, max_items=None, on_page=None):
+        """ Call the API's search().list method page by page, and yield the existing channel video ids.
+        See _iter_search_results for the arguments.
+        """
+        return self._iter_search_results(page_token, max_pages, max_items, on_page,
+                                         channelId=channel_id, order='date')
+
+    def _iter_search_results(self, page_token, max_pages, max_items, on_page, **kwargs):
+        """ Call the API's search().list method page by page, and yield video ids as each page arrives.
+        It starts from page_token, and stops after max_pages pages or max_items ids if set.
+        on_page is called with the next page token after all ids of a page are yielded, None after the last page,
+        so that an interrupted listing can be resumed from the last token it received.
+        Each page is retried under the retry policy of SEARCH_LIST, the error of a page that keeps failing is raised.
         """
-        # exponential back-off
-        for i in range(0, 3):
+        num_pages = 0
+        num_items = 0
+        while max_pages is None or num_pages < max_pages:
             try:
-                response = self.client.search().list(channelId=channel_id, part='snippet', type='video',
-                                                     order='date', maxResults=50, pageToken=page_token).execute()
-                if response is not None and isinstance(response['items'], list) and len(response['items']) > 0:
-                    channel_videos = []
-                    for res_json in response['items']:
-                        # extract channel video ids
-                        channel_videos.append(res_json['id']['videoId'])
-
-                    # recursively request next page
-                    if 'nextPageToken' in response:
-                        next_page_token = response['nextPageToken']
-                        channel_videos.extend(self.list_channel_videos(channel_id, page_token=next_page_token))
-                    return channel_videos
+                response = self._retry(SEARCH_LIST, lambda attempt: self._call_api(
+                    'search', part='snippet', type='video', maxResults=MAX_RESULTS, pageToken=page_token, **kwargs))
             except Exception as e:
-                logging.error('--- Channel videos crawler failed on channel {0}: {1}'.format(channel_id, str(e)))
-        return []
+                self._count('failures_total', SEARCH_LIST)
+                logging.error('--- Search crawler failed on {0}: {1}'.format(kwargs, redact_key(str(e))))
+                raise
+
+            num_pages += 1
+            items = response.get('items', [])
+            for res_json in items:
+                yield res_json['id']['videoId']
+                num_items += 1
+                if max_items is not None and num_items >= max_items:
+                    return
+
+            # an empty page also ends the listing
+            page_token = response.get('nextPageToken') if len(items) > 0 else None
+            if on_page is not None:
+                on_page(page_token)
+            if page_token is None:
+                return
 
     def crawl_insight_data(self, video_id, relevant=False):
         """ Crawl youtube insight data.
@@ -127,104 +184,404 @@ class Crawler(BaseCrawler):
         """
         insight_json = self.crawl_metadata(video_id)
         if insight_json is not None:
+            return self._to_record(self._complete_insight_data(video_id, insight_json, relevant))
+        return None
+
+    def crawl_insight_data_batch(self, video_ids, relevant=False, historical=True):
+        """ Crawl youtube insight data for a batch of videos.
+        Metadata is retrieved with one API call per 50 videos, historical data is then crawled video by video,
+        unless historical is False.
+        It yields a tuple of (video_id, insight_json) for each unique video id, insight_json is None if crawler fails.
+        """
+        metadata, _ = self.crawl_metadata_batch(video_ids)
+        for video_id in self._unique(video_ids):
+            if video_id in metadata:
+                yield video_id, self._to_record(self._complete_insight_data(video_id, metadata[video_id], relevant,
+                                                                            historical))
+            else:
+                yield video_id, None
+
+    def _complete_insight_data(self, video_id, insight_json, relevant, historical=True):
+        """ Add historical data and relevant videos to video metadata.
+        """
+        if historical:
             historical_json = self.crawl_historical_data(video_id)
             if historical_json is not None:
                 insight_json.update({'insights': historical_json})
-            if relevant:
-                relevant_videos_list = self.search_relevant_videos(video_id)
-                if len(relevant_videos_list) > 0:
-                    insight_json.update({'relevantVideos': relevant_videos_list})
-            return insight_json
-        return None
+        if relevant:
+            relevant_videos_list = self.search_relevant_videos(video_id)
+            if len(relevant_videos_list) > 0:
+                insight_json.update({'relevantVideos': relevant_videos_list})
+        return insight_json
 
     def crawl_metadata(self, video_id):
         """ Call API's videos().list method to list video metadata.
         """
-        # exponential back-off
-        for i in range(0, 3):
+        res_json = self._cache_get(VIDEOS_LIST, video_id, self.parts, self.fields)
+        if res_json is not None:
+            return res_json
+
+        try:
+            response = self._retry(VIDEOS_LIST, lambda attempt: self._call_api('videos', id=video_id, part=self.parts,
+                                                                               fields=self.fields))
+        except Exception as e:
+            self._count('failures_total', VIDEOS_LIST)
+            logging.error('--- Metadata crawler failed on video {0}: {1}'.format(video_id, redact_key(str(e))))
+            return None
+        if isinstance(response.get('items'), list) and len(response['items']) > 0:
             try:
-                response = self.client.videos().list(id=video_id, part=self.parts, fields=self.fields).execute()
-                if response is not None and isinstance(response['items'], list) and len(response['items']) > 0:
-                    res_json = response['items'][0]
-                    # remove the unnecessary part in thumbnail
-                    res_json['snippet']['thumbnails'] = res_json['snippet']['thumbnails']['default']['url']
-
-                    # **********************************************
-                    # Change log: remove google translate field
-                    # There are some issues with google translate python api.
-                    # A fix is posted on Github, however some users report a 403 error returned by Google.
-                    # Therefore I disable the function as of now.
-                    # See more at: https://github.com/ssut/py-googletrans/issues/77
-                    # **********************************************
-
-                    # # use googletrans if defaultLanguage not available
-                    # if 'defaultLanguage' not in res_json['snippet']:
-                    #     try:
-                    #         # remove emoji as googeltrans cannot handle emoji
-                    #         res_json['snippet']['detectLanguage'] = self.translator.detect(
-                    #             self._remove_emoji(
-                    #                 res_json['snippet']['title'] + res_json['snippet']['description'])).lang
-                    #     except Exception:
-                    #         # Google translator throws an exception after many detections, reset the translator
-                    #         time.sleep(2 * random.random())
-                    #         self.update_translator()
-                    #         res_json['snippet']['detectLanguage'] = self.translator.detect(
-                    #             self._remove_emoji(
-                    #                 res_json['snippet']['title'] + res_json['snippet']['description'])).lang
-                    # remove duplicate relevant topic ids
-
-                    if 'topicDetails' in res_json and 'relevantTopicIds' in res_json['topicDetails']:
-                        res_json['topicDetails']['relevantTopicIds'] = list(set(res_json['topicDetails']['relevantTopicIds']))
-                    return res_json
+                res_json = self._format_metadata(response['items'][0])
             except Exception as e:
-                logging.error('--- Exception in metadata crawler:', str(e))
-                time.sleep((2 ** i) + random.random())
-        logging.error('--- Metadata crawler failed on video {0}'.format(video_id))
+                self._count('failures_total', VIDEOS_LIST)
+                logging.error('--- Metadata crawler failed to format video {0}: {1}'.format(video_id, repr(e)))
+                return None
+            self._cache_set(VIDEOS_LIST, video_id, res_json, self.parts, self.fields)
+            return res_json
+        # deleted or private videos are not returned, retrying would not help
+        logging.error('--- Metadata crawler found no video {0}'.format(video_id))
         return None
 
-    def crawl_historical_data(self, video_id):
-        """ Make a request to YouTube server to get historical data.
+    def crawl_metadata_batch(self, video_ids):
+        """ Call API's videos().list method to list video metadata for a batch of videos.
+        Video ids are split into groups of 50, which is the maximum number of ids per API call at the same quota cost.
+        It returns a tuple of a dict mapping video id to video metadata, and a list of video ids missing from the response.
+        Video ids of a failed API call are in neither, as they may well exist.
+
+        note:
+        1. fields must include items(id) so that the response can be keyed by video id
+        2. deleted or private videos are silently dropped by the API, hence reported as missing
+        """
+        video_ids = self._unique(video_ids)
+        metadata = {}
+        uncached_ids = []
+        failed_ids = set()
+        for vid in video_ids:
+            res_json = self._cache_get(VIDEOS_LIST, vid, self.parts, self.fields)
+            if res_json is not None:
+                metadata[vid] = res_json
+            else:
+                uncached_ids.append(vid)
+        for i in range(0, len(uncached_ids), MAX_RESULTS):
+            batch_ids = uncached_ids[i: i + MAX_RESULTS]
+            batch_metadata = self._list_metadata_batch(batch_ids)
+            if batch_metadata is None:
+                failed_ids.update(batch_ids)
+                continue
+            for vid, res_json in batch_metadata.items():
+                self._cache_set(VIDEOS_LIST, vid, res_json, self.parts, self.fields)
+            metadata.update(batch_metadata)
+        missing_ids = [vid for vid in video_ids if vid not in metadata and vid not in failed_ids]
+        if len(missing_ids) > 0:
+            logging.error('--- Metadata crawler missed {0} videos: {1}'.format(len(missing_ids), ','.join(missing_ids)))
+        return metadata, missing_ids
+
+    def _list_metadata_batch(self, batch_ids):
+        """ Call API's videos().list method once with at most 50 comma-separated video ids.
+        Return None if the call fails.
+        """
+        try:
+            response = self._retry(VIDEOS_LIST, lambda attempt: self._call_api(
+                'videos', id=','.join(batch_ids), part=self.parts, fields=self.fields))
+        except Exception as e:
+            self._count('failures_total', VIDEOS_LIST)
+            logging.error('--- Batch metadata crawler failed on videos {0}: {1}'.format(
+                ','.join(batch_ids), redact_key(str(e))))
+            return None
+        batch_metadata = {}
+        for res_json in response.get('items', []):
+            # a malformed item fails only its own video, which is then reported as missing
+            try:
+                batch_metadata[res_json['id']] = self._format_metadata(res_json)
+            except Exception as e:
+                self._count('failures_total', VIDEOS_LIST)
+                logging.error('--- Metadata crawler failed to format video {0}: {1}'.format(res_json.get('id'),
+                                                                                            repr(e)))
+        return batch_metadata
+
+    # == == == == == == == == methods to refresh video == == == == == == == == #
+    def refresh_insight_data_batch(self, records, max_age=7, min_change=0.1, today=None):
+        """ Refresh crawled youtube insight records of a batch of videos.
+        Current statistics of all videos are retrieved first, with one API call per 50 videos.
+        A record is fully refreshed, i.e., its metadata is crawled again and new days of historical data are merged
+        into its stored series, if it was crawled max_age days ago or earlier, has no insights, or its view count grew
+        by min_change or more. Otherwise only its statistics are replaced, and its insights are kept as they are.
+        It yields a tuple of (record, refreshed_record) for each record. refreshed_record is the stored record itself
+        if the video is not returned by the API, e.g., deleted or private, or None if an API call fails, then the
+        record should be refreshed again later.
+
+        note:
+        1. a fully refreshed record gets crawledAt of today, a record with only new statistics gets refreshedAt
+        2. the crawl date of a record without crawledAt is the last day of its historical data
         """
-        url = self.get_url(video_id)
-        header = self._get_header(self.cookie, video_id)
-        self.opener.addheaders = header
-        content = None
+        today = today or datetime.date.today()
+        records = list(records)
+        statistics, missing_ids = self.crawl_statistics_batch([obj_json['id'] for obj_json in records])
+        missing_ids = set(missing_ids)
+
+        full_records = []
+        for obj_json in records:
+            video_id = obj_json['id']
+            if video_id not in statistics:
+                yield obj_json, obj_json if video_id in missing_ids else None
+                continue
+            crawl_date = self.get_crawl_date(obj_json)
+            is_stale = crawl_date is None or (today - crawl_date).days >= max_age or 'insights' not in obj_json
+            old_view = int(obj_json.get('statistics', {}).get('viewCount', 0))
+            new_view = int(statistics[video_id].get('viewCount', 0))
+            if is_stale or new_view - old_view >= min_change * max(old_view, 1):
+                full_records.append(obj_json)
+            else:
+                refreshed_json = dict(obj_json)
+                refreshed_json['statistics'] = statistics[video_id]
+                refreshed_json['refreshedAt'] = today.isoformat()
+                yield obj_json, refreshed_json
+
+        if len(full_records) == 0:
+            return
+        metadata, missing_ids = self.crawl_metadata_batch([obj_json['id'] for obj_json in full_records])
+        missing_ids = set(missing_ids)
+        for obj_json in full_records:
+            video_id = obj_json['id']
+            if video_id not in metadata:
+                yield obj_json, obj_json if video_id in missing_ids else None
+                continue
+            refreshed_json = metadata[video_id]
+            if 'relevantVideos' in obj_json:
+                refreshed_json['relevantVideos'] = obj_json['relevantVideos']
+            historical_json = self.crawl_historical_data(video_id)
+            if historical_json is not None:
+                if 'insights' in obj_json:
+                    historical_json = self._merge_insights(obj_json['insights'], historical_json)
+                refreshed_json['insights'] = historical_json
+                refreshed_json['crawledAt'] = today.isoformat()
+            else:
+                # keep stored insights and crawl date, so that the record is refreshed again next time
+                for key in ('insights', 'crawledAt'):
+                    if key in obj_json:
+                        refreshed_json[key] = obj_json[key]
+            yield obj_json, refreshed_json
 
-        # exponential back-off
-        for i in range(1, 4):
-            time.sleep(0.1 + random.random())
+    def crawl_statistics_batch(self, video_ids):
+        """ Call API's videos().list method for the statistics part only, one call per 50 videos.
+        It returns a tuple of a dict mapping video id to video statistics, and a list of video ids missing from the
+        response, see crawl_metadata_batch. Statistics are never served from the response cache, as they are expected
+        to be current.
+        """
+        statistics = {}
+        failed_ids = set()
+        video_ids = self._unique(video_ids)
+        for i in range(0, len(video_ids), MAX_RESULTS):
+            batch_ids = video_ids[i: i + MAX_RESULTS]
             try:
-                response = self.opener.open(url, self.post_data, timeout=2**i)
-                content = response.read().decode('utf-8')
-                break
-            except OSError as e:
-                logging.error('--- Socket timed out in historical data crawler:', str(e))
+                response = self._retry(VIDEOS_LIST, lambda attempt: self._call_api(
+                    'videos', id=','.join(batch_ids), part='statistics', fields='items(id,statistics)'))
             except Exception as e:
-                logging.error('--- Exception in historical data crawler:', str(e))
+                self._count('failures_total', VIDEOS_LIST)
+                logging.error('--- Statistics crawler failed on videos {0}: {1}'.format(
+                    ','.join(batch_ids), redact_key(str(e))))
+                failed_ids.update(batch_ids)
                 continue
+            for res_json in response.get('items', []):
+                statistics[res_json['id']] = res_json.get('statistics', {})
+        missing_ids = [vid for vid in video_ids if vid not in statistics and vid not in failed_ids]
+        return statistics, missing_ids
+
+    @staticmethod
+    def get_crawl_date(obj_json):
+        """ Get the date a video record was crawled, either its crawledAt or the last day of its historical data.
+        Return None if neither exists.
+        """
+        if 'crawledAt' in obj_json:
+            return datetime.datetime.strptime(obj_json['crawledAt'], '%Y-%m-%d').date()
+        insights = obj_json.get('insights', {})
+        if 'startDate' in insights and len(insights.get('days', [])) > 0:
+            start_date = datetime.datetime.strptime(insights['startDate'], '%Y-%m-%d').date()
+            return start_date + datetime.timedelta(days=int(insights['days'][-1]))
+        return None
+
+    @staticmethod
+    def _merge_insights(old_json, new_json):
+        """ Merge two historical data of a video by date, values of new_json win on the days both have.
+        Days are counted from the earliest start date, and totals are computed again from merged series.
+        A series is kept only if it has a value on every merged day, so that all series stay aligned with days.
+        """
+        def get_ordinals(insight_json):
+            start_date = datetime.datetime.strptime(insight_json['startDate'], '%Y-%m-%d').date()
+            return [start_date.toordinal() + int(d) for d in insight_json['days']]
+
+        old_ordinals = get_ordinals(old_json)
+        new_ordinals = get_ordinals(new_json)
+        ordinals = sorted(set(old_ordinals) | set(new_ordinals))
+
+        json_return = {'startDate': datetime.date.fromordinal(ordinals[0]).isoformat(),
+                       'days': [ordinal - ordinals[0] for ordinal in ordinals]}
+        for key in SERIES_KEYS:
+            values = {}
+            for insight_json, insight_ordinals in [(old_json, old_ordinals), (new_json, new_ordinals)]:
+                if key in insight_json:
+                    values.update(zip(insight_ordinals, insight_json[key]))
+            if len(values) == len(ordinals):
+                json_return[key] = [values[ordinal] for ordinal in ordinals]
+            elif len(values) > 0:
+                logging.warning('--- Drop {0} in merged historical data, it misses some days'.format(key))
+
+        json_return['totalView'] = sum(json_return['dailyView'])
+        if 'dailyShare' in json_return:
+            json_return['totalShare'] = sum(json_return['dailyShare'])
+        if 'dailyWatch' in json_return and json_return['totalView'] > 0:
+            json_return['avgWatch'] = sum(json_return['dailyWatch']) / json_return['totalView']
+        if 'dailySubscriber' in json_return:
+            json_return['totalSubscriber'] = sum(json_return['dailySubscriber'])
+        return json_return
+
+    @staticmethod
+    def _format_channel(res_json):
+        """ Extract channel snippet and statistics from a channel resource returned by API's channels().list method.
+        """
+        channel_json = {'channelId': res_json['id'],
+                        'snippet': {'publishedAt': res_json['snippet']['publishedAt'],
+                                    'description': res_json['snippet']['description'],
+                                    'thumbnails': res_json['snippet']['thumbnails']['default']['url'],
+                                    'title': res_json['snippet']['title']},
+                        'statistics': res_json['statistics']}
+        return channel_json
+
+    @staticmethod
+    def _format_metadata(res_json):
+        """ Clean up a video resource returned by API's videos().list method.
+        """
+        # remove the unnecessary part in thumbnail
+        res_json['snippet']['thumbnails'] = res_json['snippet']['thumbnails']['default']['url']
+
+        # **********************************************
+        # Change log: remove google translate field
+        # There are some issues with google translate python api.
+        # A fix is posted on Github, however some users report a 403 error returned by Google.
+        # Therefore I disable the function as of now.
+        # See more at: https://github.com/ssut/py-googletrans/issues/77
+        # **********************************************
+
+        # # use googletrans if defaultLanguage not available
+        # if 'defaultLanguage' not in res_json['snippet']:
+        #     try:
+        #         # remove emoji as googeltrans cannot handle emoji
+        #         res_json['snippet']['detectLanguage'] = self.translator.detect(
+        #             self._remove_emoji(
+        #                 res_json['snippet']['title'] + res_json['snippet']['description'])).lang
+        #     except Exception:
+        #         # Google translator throws an exception after many detections, reset the translator
+        #         time.sleep(2 * random.random())
+        #         self.update_translator()
+        #         res_json['snippet']['detectLanguage'] = self.translator.detect(
+        #             self._remove_emoji(
+        #                 res_json['snippet']['title'] + res_json['snippet']['description'])).lang
+
+        # remove duplicate relevant topic ids
+        if 'topicDetails' in res_json and 'relevantTopicIds' in res_json['topicDetails']:
+            res_json['topicDetails']['relevantTopicIds'] = list(set(res_json['topicDetails']['relevantTopicIds']))
+        return res_json
+
+    def _to_record(self, obj_json):
+        """ Convert a crawled json object into a compact record if set, see set_compact_records.
+        """
+        if self.compact_records:
+            return to_record(obj_json)
+        return obj_json
+
+    @staticmethod
+    def _unique(ids):
+        """ Remove duplicate ids while keeping the input order.
+        """
+        return list(OrderedDict.fromkeys(ids))
+
+    def crawl_historical_data(self, video_id):
+        """ Make a request to YouTube server to get historical data.
+        """
+        # raw response is cached, so that it can be parsed with any series options
+        content = self._cache_get(INSIGHT_AJAX, video_id)
+        if content is not None:
+            return self._parse_historical_data(content)
 
         try:
-            historical_json = self._parse_xml(content)
-            return historical_json
-        except:
+            content = self._retry(INSIGHT_AJAX, lambda attempt: self._request_historical_data(video_id, attempt))
+        except Exception as e:
+            self._count('failures_total', INSIGHT_AJAX)
+            logging.error('--- Historical data crawler failed on video {0}: {1}'.format(video_id, redact_key(str(e))))
             return None
+        historical_json = self._parse_historical_data(content)
+        if historical_json is None:
+            self._count('failures_total', INSIGHT_AJAX)
+        else:
+            self._cache_set(INSIGHT_AJAX, video_id, content)
+        return historical_json
 
-    def search_relevant_videos(self, video_id, page_token=None):
-        """ Call API's search().list method to search the relevant videos.
+    def _request_historical_data(self, video_id, attempt):
+        """ Send one historical data request, its timeout doubles with each attempt.
+        """
+        # be polite to the server, either by the rate limiter or by a random sleep
+        if not self._throttle(INSIGHT):
+            sleep_time = 0.1 + random.random()
+            self._count('throttle_seconds_total', INSIGHT, sleep_time)
+            time.sleep(sleep_time)
+        # a new session is got before the request is timed, its bootstrap is observed as session_seconds
+        post_data, cookie = self.post_data, self.cookie
+        start_time = time.perf_counter()
+        try:
+            # headers are set per request, so that the opener can be shared by several threads
+            request = urllib.request.Request(self.get_url(video_id), data=post_data,
+                                             headers=dict(self._get_header(cookie, video_id)))
+            body = self.opener.open(request, timeout=2 ** (attempt + 1)).read()
+        except urllib.error.HTTPError as e:
+            self._count('errors_total', INSIGHT_AJAX, reason='HTTP {0}'.format(e.code))
+            # an expired session is rejected, get a new one for the next try
+            if e.code in SESSION_STATUSES:
+                self.reset_session()
+            raise
+        except Exception as e:
+            self._count('errors_total', INSIGHT_AJAX, reason=type(e).__name__)
+            raise
+        finally:
+            self._count('requests_total', INSIGHT_AJAX)
+            self._observe('request_seconds', INSIGHT_AJAX, time.perf_counter() - start_time)
+        self._count('bytes_total', INSIGHT_AJAX, len(body))
+        return body.decode('utf-8')
+
+    def _parse_historical_data(self, content):
+        """ Parse a historical data response with series options of the crawler, None if it cannot be parsed.
         """
-        relevant_videos = []
+        start_time = time.perf_counter()
         try:
-            response = self.client.search().list(relatedToVideoId=video_id,  part='snippet', type='video',
-                                                 order='relevance', maxResults=50, pageToken=page_token).execute()
-            if response is not None and isinstance(response['items'], list) and len(response['items']) > 0:
-                for res_json in response['items']:
-                    # extract relevant video ids
-                    relevant_videos.append(res_json['id']['videoId'])
-
-                # recursively request next page
-                if 'nextPageToken' in response:
-                    next_page_token = response['nextPageToken']
-                    relevant_videos.extend(self.search_relevant_videos(video_id, page_token=next_page_token))
+            return self._parse_xml(content, as_array=self.array_series, series=self.insight_series)
         except Exception as e:
-            logging.error('--- Relevant videos crawler failed on video {0}: {1}'.format(video_id, str(e)))
+            self._count('errors_total', INSIGHT_AJAX, reason='parse')
+            logging.error('--- Failed to parse historical data: {0}'.format(str(e)))
+            return None
+        finally:
+            self._observe('parse_seconds', INSIGHT_AJAX, time.perf_counter() - start_time)
+
+    def search_relevant_videos(self, video_id, page_token=None):
+        """ Call API's search().list method to search the relevant videos, an empty list if the listing fails.
+        """
+        if page_token is None:
+            relevant_videos = self._cache_get(SEARCH_LIST, video_id, 'snippet', query='relatedToVideoId')
+            if relevant_videos is not None:
+                return relevant_videos
+
+        next_page_tokens = []
+        try:
+            relevant_videos = list(self.iter_relevant_videos(video_id, page_token=page_token,
+                                                             on_page=next_page_tokens.append))
+        except Exception:
+            # relevant videos are optional, a video is kept without them rather than with a partial list
+            return []
+        # only cache a complete listing
+        if page_token is None and len(next_page_tokens) > 0 and next_page_tokens[-1] is None:
+            self._cache_set(SEARCH_LIST, video_id, relevant_videos, 'snippet', query='relatedToVideoId')
         return relevant_videos
+
+    def iter_relevant_videos(self, video_id, page_token=None, max_pages=None, max_items=None, on_page=None):
+        """ Call API's search().list method page by page, and yield the relevant video ids.
+        See _iter_search_results for the arguments.
+        """
+        return self._iter_search_results(page_token, max_pages, max_items, on_page,
+                                         relatedToVideoId=video_id, order='relevance')
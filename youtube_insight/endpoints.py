@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+This is the endpoint registry of youtube_insight crawler.
+It names the endpoints that response caches, retry policies and metrics are keyed by.
+"""
+
+# YouTube API list methods
+VIDEOS_LIST = 'videos.list'
+CHANNELS_LIST = 'channels.list'
+SEARCH_LIST = 'search.list'
+
+# historical data web request
+INSIGHT_AJAX = 'insight_ajax'
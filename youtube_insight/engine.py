@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+This is the concurrent engine of youtube_insight crawler.
+It runs crawler methods across many ids with a bounded pool of worker threads,
+each endpoint is throttled by its own token bucket rate limiter.
+"""
+
+import time, asyncio, threading, logging, itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from youtube_insight.retry import get_default_policies
+from youtube_insight.keypool import redact_key
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=None):
+        """ A thread-safe token bucket that refills rate tokens per second, up to capacity tokens.
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _take(self, tokens):
+        """ Consume tokens if available and return 0, otherwise return the seconds to wait for them.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """ Block until tokens are available, then consume them.
+        """
+        wait_time = self._take(tokens)
+        while wait_time > 0:
+            time.sleep(wait_time)
+            wait_time = self._take(tokens)
+
+    async def acquire_async(self, tokens=1):
+        """ Await until tokens are available, then consume them, other coroutines keep running meanwhile.
+        """
+        wait_time = self._take(tokens)
+        while wait_time > 0:
+            await asyncio.sleep(wait_time)
+            wait_time = self._take(tokens)
+
+
+class CrawlEngine(object):
+    def __init__(self, crawler_factory, workers=8, rate_limits=None, retry_policies=None):
+        """ Set up a concurrent engine.
+        crawler_factory is a callable that returns a ready-to-use crawler, it is called once in each worker thread,
+        as neither the API client nor the opener can be shared across threads.
+        rate_limits maps an endpoint (DATA_API or INSIGHT) to its maximum number of requests per second,
+        the rate limiters are shared by all workers.
+        retry_policies maps an endpoint (e.g., VIDEOS_LIST or INSIGHT_AJAX) to its RetryPolicy, defaults to
+        get_default_policies() in youtube_insight.retry, the policies and their circuit breakers are shared by all workers.
+        """
+        self.crawler_factory = crawler_factory
+        self.workers = workers
+        self.rate_limiters = {}
+        if rate_limits is not None:
+            for endpoint, rate in rate_limits.items():
+                self.rate_limiters[endpoint] = TokenBucket(rate)
+        self.retry_policies = get_default_policies()
+        if retry_policies is not None:
+            self.retry_policies.update(retry_policies)
+        self._local = threading.local()
+
+    def _get_crawler(self):
+        """ Get the crawler of current worker thread, build one if not exists.
+        """
+        crawler = getattr(self._local, 'crawler', None)
+        if crawler is None:
+            crawler = self.crawler_factory()
+            for endpoint, rate_limiter in self.rate_limiters.items():
+                crawler.set_rate_limiter(endpoint, rate_limiter)
+            for endpoint, retry_policy in self.retry_policies.items():
+                crawler.set_retry_policy(endpoint, retry_policy)
+            self._local.crawler = crawler
+        return crawler
+
+    def _run(self, method, obj_id, *args, **kwargs):
+        """ Run crawler method on obj_id in current worker thread.
+        """
+        return getattr(self._get_crawler(), method)(obj_id, *args, **kwargs)
+
+    def _run_batch(self, method, batch_ids, *args, **kwargs):
+        """ Run crawler batch method on batch_ids in current worker thread, consuming its results there.
+        """
+        return list(getattr(self._get_crawler(), method)(batch_ids, *args, **kwargs))
+
+    def map(self, method, obj_ids, *args, **kwargs):
+        """ Run crawler method on each id concurrently.
+        It yields a tuple of (obj_id, result) in completion order, result is None if the method raises an exception.
+        At most twice the number of workers ids are in flight, so obj_ids can be a lazy iterator of any length.
+        """
+        return self._map(self._run, method, obj_ids, *args, **kwargs)
+
+    def _map(self, runner, method, obj_ids, *args, **kwargs):
+        """ Submit runner(method, obj_id, ...) to the worker pool with a bounded number of pending tasks.
+        """
+        obj_ids = iter(obj_ids)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            for obj_id in itertools.islice(obj_ids, 2 * self.workers):
+                futures[executor.submit(runner, method, obj_id, *args, **kwargs)] = obj_id
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    obj_id = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logging.error('--- Exception in {0} on {1}: {2}'.format(method, obj_id, redact_key(str(e))))
+                        result = None
+                    yield obj_id, result
+                for obj_id in itertools.islice(obj_ids, len(done)):
+                    futures[executor.submit(runner, method, obj_id, *args, **kwargs)] = obj_id
+
+    def map_batches(self, method, obj_ids, batch_size, *args, **kwargs):
+        """ Run crawler batch method on each group of batch_size ids concurrently.
+        The batch method must return an iterable of (obj_id, result) tuples, which are flattened.
+        """
+        obj_ids = iter(obj_ids)
+        batches = iter(lambda: list(itertools.islice(obj_ids, batch_size)), [])
+        for batch_ids, results in self._map(self._run_batch, method, batches, *args, **kwargs):
+            if results is None:
+                for obj_id in batch_ids:
+                    yield obj_id, None
+            else:
+                for obj_id, result in results:
+                    yield obj_id, result
+
+    def crawl_insight_data(self, video_ids, relevant=False):
+        """ Crawl youtube insight data for each video concurrently.
+        """
+        return self.map('crawl_insight_data', video_ids, relevant)
+
+    def crawl_insight_data_batch(self, video_ids, relevant=False, batch_size=50):
+        """ Crawl youtube insight data for each group of videos concurrently.
+        """
+        return self.map_batches('crawl_insight_data_batch', video_ids, batch_size, relevant)
+
+    def refresh_insight_data_batch(self, records, max_age=7, min_change=0.1, batch_size=50):
+        """ Refresh crawled youtube insight records for each group of videos concurrently.
+        It yields a tuple of (record, refreshed_record), see Crawler.refresh_insight_data_batch.
+        """
+        return self.map_batches('refresh_insight_data_batch', records, batch_size, max_age, min_change)
+
+    def crawl_metadata(self, video_ids):
+        """ Crawl video metadata for each video concurrently.
+        """
+        return self.map('crawl_metadata', video_ids)
+
+    def crawl_historical_data(self, video_ids):
+        """ Crawl historical data for each video concurrently.
+        """
+        return self.map('crawl_historical_data', video_ids)
+
+    def search_relevant_videos(self, video_ids):
+        """ Search relevant videos for each video concurrently.
+        """
+        return self.map('search_relevant_videos', video_ids)
+
+    def crawl_channel_vids(self, channel_ids):
+        """ Crawl channel video id list for each channel concurrently.
+        """
+        return self.map('crawl_channel_vids', channel_ids)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+This is the columnar exporter of youtube_insight crawler.
+It converts crawled video records into columnar files for analytics, either
+1. a numpy .npz archive, where the daily series of all videos are concatenated and indexed by an offsets array, or
+2. a parquet file with one list column per daily series, which requires pyarrow.
+
+Usage: python -m youtube_insight.export -i data/video_insights.json -o data/video_insights.npz
+"""
+
+import sys, argparse
+from array import array
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from youtube_insight.sink import iter_records
+
+# (json key, column name, numpy dtype, array typecode) of the daily series in insights
+SERIES = [('days', 'days', np.int64, 'q'),
+          ('dailyView', 'daily_view', np.int64, 'q'),
+          ('dailyShare', 'daily_share', np.int64, 'q'),
+          ('dailyWatch', 'daily_watch', np.float64, 'd'),
+          ('dailySubscriber', 'daily_subscriber', np.int64, 'q')]
+
+# (json key, column name, numpy dtype) of the totals in insights, missing values are -1 or nan
+TOTALS = [('totalView', 'total_view', np.int64),
+          ('totalShare', 'total_share', np.int64),
+          ('avgWatch', 'avg_watch', np.float64),
+          ('totalSubscriber', 'total_subscriber', np.int64)]
+
+
+def _iter_insight_records(records):
+    """ Iterate over records with insights, skip the others.
+    """
+    for obj_json in records:
+        if 'insights' in obj_json and 'days' in obj_json['insights']:
+            yield obj_json
+
+
+def export_npz(records, output_path, compressed=True):
+    """ Export records to a numpy .npz archive, return the number of exported videos.
+    The archive has the following arrays, n is the number of videos:
+    id, start_date: (n,) string arrays
+    offsets: (n + 1,) int64 array, the series of video i are at [offsets[i], offsets[i + 1])
+    days, daily_view, daily_share, daily_watch, daily_subscriber: concatenated series
+    has_daily_share, has_daily_watch, has_daily_subscriber: (n,) bool arrays, missing series are filled with 0
+    total_view, total_share, avg_watch, total_subscriber: (n,) arrays, missing values are -1 or nan
+    """
+    ids = []
+    start_dates = []
+    offsets = array('q', [0])
+    series = {column: array(typecode) for _, column, _, typecode in SERIES}
+    masks = {column: array('b') for _, column, _, _ in SERIES[2:]}
+    totals = {column: array('q' if dtype == np.int64 else 'd') for _, column, dtype in TOTALS}
+
+    # accumulate in compact typed buffers, so that memory grows with the number of values, not python objects
+    for obj_json in _iter_insight_records(records):
+        insights = obj_json['insights']
+        num_days = len(insights['days'])
+        ids.append(obj_json['id'])
+        start_dates.append(insights['startDate'])
+        offsets.append(offsets[-1] + num_days)
+        for key, column, dtype, _ in SERIES:
+            if isinstance(insights.get(key), np.ndarray):
+                series[column].frombytes(insights[key].astype(dtype).tobytes())
+            elif key in insights:
+                series[column].extend(insights[key])
+            else:
+                series[column].extend([0] * num_days)
+            if column in masks:
+                masks[column].append(key in insights)
+        for key, column, dtype in TOTALS:
+            totals[column].append(insights.get(key, -1 if dtype == np.int64 else float('nan')))
+
+    arrays = {'id': np.array(ids, dtype=str),
+              'start_date': np.array(start_dates, dtype=str),
+              'offsets': np.frombuffer(offsets, dtype=np.int64)}
+    for _, column, dtype, _ in SERIES:
+        arrays[column] = np.frombuffer(series[column], dtype=dtype)
+    for column, mask in masks.items():
+        arrays['has_' + column] = np.frombuffer(mask, dtype=np.int8).astype(bool)
+    for _, column, dtype in TOTALS:
+        arrays[column] = np.frombuffer(totals[column], dtype=dtype)
+
+    if compressed:
+        np.savez_compressed(output_path, **arrays)
+    else:
+        np.savez(output_path, **arrays)
+    return len(ids)
+
+
+def load_npz(input_path):
+    """ Load a .npz archive written by export_npz as a dict of arrays.
+    """
+    with np.load(input_path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def get_series(arrays, i, column):
+    """ Get a daily series of video i from arrays loaded by load_npz, as a view without copy.
+    """
+    return arrays[column][arrays['offsets'][i]: arrays['offsets'][i + 1]]
+
+
+def export_parquet(records, output_path, batch_size=10000):
+    """ Export records to a parquet file in row groups of batch_size videos, return the number of exported videos.
+    Daily series are list columns, missing series and totals are null.
+    """
+    if pyarrow is None:
+        raise ImportError('Parquet export requires pyarrow, install it with pip install pyarrow')
+    schema = pyarrow.schema([('id', pyarrow.string()), ('start_date', pyarrow.string())] +
+                            [(column, pyarrow.list_(pyarrow.from_numpy_dtype(dtype))) for _, column, dtype, _ in SERIES] +
+                            [(column, pyarrow.from_numpy_dtype(dtype)) for _, column, dtype in TOTALS])
+
+    num_videos = 0
+    with pyarrow.parquet.ParquetWriter(output_path, schema) as writer:
+        batch = []
+        for obj_json in _iter_insight_records(records):
+            batch.append(obj_json)
+            if len(batch) == batch_size:
+                writer.write_table(_to_table(batch, schema))
+                num_videos += len(batch)
+                batch = []
+        if len(batch) > 0:
+            writer.write_table(_to_table(batch, schema))
+            num_videos += len(batch)
+    return num_videos
+
+
+def _to_table(batch, schema):
+    """ Convert a batch of records into a pyarrow table.
+    """
+    columns = {'id': [obj_json['id'] for obj_json in batch],
+               'start_date': [obj_json['insights']['startDate'] for obj_json in batch]}
+    for key, column, _, _ in SERIES:
+        columns[column] = [_to_list(obj_json['insights'].get(key)) for obj_json in batch]
+    for key, column, _ in TOTALS:
+        columns[column] = [obj_json['insights'].get(key) for obj_json in batch]
+    return pyarrow.Table.from_pydict(columns, schema=schema)
+
+
+def _to_list(values):
+    """ Convert a series, either a list or a numpy array, to a list.
+    """
+    if isinstance(values, np.ndarray):
+        return values.tolist()
+    return values
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help='input file path of video data', required=True)
+    parser.add_argument('-o', '--output', help='output file path, ends with .npz or .parquet', required=True)
+    args = parser.parse_args()
+
+    if args.output.endswith('.parquet'):
+        num_exported = export_parquet(iter_records(args.input), args.output)
+    elif args.output.endswith('.npz'):
+        num_exported = export_npz(iter_records(args.input), args.output)
+    else:
+        print('>>> Output file must end with .npz or .parquet!')
+        sys.exit(1)
+    print('>>> Exported {0} videos to {1}'.format(num_exported, args.output))
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+This is the crawl frontier of youtube_insight crawler.
+It snowballs from seed videos or channels over relevant videos, in breadth-first or priority order,
+with a deduplicating visited set, depth and budget limits, and a state log on disk to resume from.
+
+The state log has one tab-separated line per event,
+Q <video_id> <depth> <priority> when a video is queued, V <video_id> when the record of a visited video is written,
+F <video_id> when a video fails to crawl. A failed video is queued again, up to max_tries times, and is not charged
+to the budget.
+"""
+
+import os, heapq, logging
+
+from youtube_insight.engine import CrawlEngine
+
+
+def get_priority_by_path(path):
+    """ Get a priority function that reads a dotted path in the crawled json, e.g., 'statistics.viewCount'.
+    Missing or non-numeric values have priority 0.
+    """
+    keys = path.split('.')
+
+    def get_priority(insight_json):
+        value = insight_json
+        try:
+            for key in keys:
+                value = value[key]
+            return float(value)
+        except (KeyError, TypeError, ValueError):
+            return 0.0
+    return get_priority
+
+
+class Frontier(object):
+    def __init__(self, state_path=None, max_depth=None, budget=None, priority=None, max_queue=None, max_tries=3):
+        """ Set up a crawl frontier.
+        Videos are crawled in breadth-first order if priority is None. Otherwise priority is a dotted path,
+        e.g., 'statistics.viewCount', or a function of the crawled json, and relevant videos inherit the priority of
+        the video they are found from, so that the crawl expands from the highest priority videos first.
+        Relevant videos are followed up to max_depth hops from the seeds, and at most budget videos are crawled.
+        At most max_queue videos are kept in queue, the lowest priority ones are dropped, it defaults to budget.
+        A video that fails to crawl is queued again, and dropped after max_tries failures.
+        Visited videos are logged by mark_done, so add the frontier as a checkpoint of the output sink, see
+        JsonlSink.add_checkpoint, to log them only once their records are written.
+        """
+        self.state_path = state_path
+        self.max_depth = max_depth
+        self.budget = budget
+        if isinstance(priority, str):
+            priority = get_priority_by_path(priority)
+        self.priority = priority
+        self.max_queue = max_queue if max_queue is not None else budget
+        self.max_tries = max_tries
+
+        self.queue = []
+        self.seen_ids = set()
+        self.num_visited = 0
+        self.num_pushed = 0
+        self.num_failures = {}
+        self._state_fd = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def open(self):
+        """ Replay the state log if exists, then open it for appending.
+        """
+        if self.state_path is None:
+            return self
+        if os.path.exists(self.state_path):
+            queued = {}
+            with open(self.state_path, 'r') as fin:
+                for line in fin:
+                    if not line.endswith('\n'):
+                        continue
+                    fields = line[:-1].split('\t')
+                    if fields[0] == 'Q' and len(fields) == 4:
+                        self.seen_ids.add(fields[1])
+                        queued[fields[1]] = (int(fields[2]), float(fields[3]))
+                    elif fields[0] == 'V' and len(fields) == 2:
+                        self.seen_ids.add(fields[1])
+                        queued.pop(fields[1], None)
+                        self.num_failures.pop(fields[1], None)
+                        self.num_visited += 1
+                    elif fields[0] == 'F' and len(fields) == 2:
+                        self.num_failures[fields[1]] = self.num_failures.get(fields[1], 0) + 1
+            for video_id, (depth, priority) in queued.items():
+                if self.num_failures.get(video_id, 0) < self.max_tries:
+                    self._push(video_id, depth, priority)
+            self._trim()
+            logging.warning('>>> Frontier resumed with {0} visited and {1} queued videos'.format(
+                self.num_visited, len(self.queue)))
+        self._state_fd = os.open(self.state_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self
+
+    def close(self):
+        """ Close the state log.
+        """
+        if self._state_fd is not None:
+            os.close(self._state_fd)
+            self._state_fd = None
+
+    def _log(self, *fields):
+        if self._state_fd is not None:
+            os.write(self._state_fd, ('\t'.join(str(field) for field in fields) + '\n').encode('utf-8'))
+
+    def _push(self, video_id, depth, priority):
+        # heapq pops the smallest entry, breadth-first order is by depth, priority order is by negated priority,
+        # ties are broken by insertion order
+        key = depth if self.priority is None else -priority
+        heapq.heappush(self.queue, (key, self.num_pushed, video_id, depth, priority))
+        self.num_pushed += 1
+
+    def _trim(self):
+        """ Drop the lowest priority videos once the queue grows well beyond max_queue.
+        """
+        if self.max_queue is not None and len(self.queue) > 2 * self.max_queue:
+            self.queue = heapq.nsmallest(self.max_queue, self.queue)
+            heapq.heapify(self.queue)
+
+    def add(self, video_id, depth=0, priority=0.0):
+        """ Queue a video if it has not been seen, return True if queued.
+        """
+        if video_id in self.seen_ids:
+            return False
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        self.seen_ids.add(video_id)
+        self._push(video_id, depth, priority)
+        self._log('Q', video_id, depth, priority)
+        self._trim()
+        return True
+
+    def add_seeds(self, video_ids):
+        """ Queue seed videos at depth 0, seeds are crawled before the videos found from them.
+        """
+        for video_id in video_ids:
+            self.add(video_id, priority=float('inf'))
+
+    def add_seed_channels(self, crawler, channel_ids, max_items=None):
+        """ Queue the videos of seed channels at depth 0, at most max_items videos per channel.
+        """
+        for channel_id in channel_ids:
+            for video_id in crawler.iter_channel_videos(channel_id, max_items=max_items):
+                self.add(video_id, priority=float('inf'))
+
+    def is_exhausted(self):
+        """ Check whether the queue is empty or the budget is spent.
+        """
+        return len(self.queue) == 0 or (self.budget is not None and self.num_visited >= self.budget)
+
+    def pop(self):
+        """ Pop the next video to crawl, as a tuple of (video_id, depth, priority).
+        """
+        _, _, video_id, depth, priority = heapq.heappop(self.queue)
+        return video_id, depth, priority
+
+    def visit(self, video_id, depth, priority, insight_json):
+        """ Record a crawled video, and queue its relevant videos one hop deeper.
+        A failed video, i.e., insight_json is None, is queued again unless it has failed max_tries times.
+        """
+        if insight_json is None:
+            self._log('F', video_id)
+            self.num_failures[video_id] = self.num_failures.get(video_id, 0) + 1
+            if self.num_failures[video_id] < self.max_tries:
+                self._push(video_id, depth, priority)
+            else:
+                logging.error('--- Frontier drops video {0} after {1} failures'.format(video_id, self.max_tries))
+            return
+        self.num_visited += 1
+        self.num_failures.pop(video_id, None)
+        if self.priority is not None:
+            priority = self.priority(insight_json)
+        for relevant_id in insight_json.get('relevantVideos', []):
+            self.add(relevant_id, depth + 1, priority)
+
+    def mark_done(self, video_id):
+        """ Log a visited video once its record is written, so that it is crawled again if the record is lost.
+        """
+        self._log('V', video_id)
+
+    def run(self, crawler, batch_size=1):
+        """ Crawl the frontier until it is exhausted, yield a tuple of (video_id, insight_json) for each video,
+        insight_json is None if crawler fails.
+        crawler is either a Crawler, or a CrawlEngine that crawls batch_size videos from the frontier concurrently.
+        """
+        while not self.is_exhausted():
+            num_left = batch_size if self.budget is None else min(batch_size, self.budget - self.num_visited)
+            batch = {}
+            while len(batch) < num_left and len(self.queue) > 0:
+                video_id, depth, priority = self.pop()
+                batch[video_id] = (depth, priority)
+
+            # relevant videos are not searched at the maximum depth, as they would not be followed
+            relevant = self.max_depth is None or min(depth for depth, _ in batch.values()) < self.max_depth
+            if isinstance(crawler, CrawlEngine):
+                results = crawler.crawl_insight_data(list(batch), relevant)
+            else:
+                results = ((video_id, crawler.crawl_insight_data(video_id, relevant)) for video_id in batch)
+            for video_id, insight_json in results:
+                depth, priority = batch[video_id]
+                self.visit(video_id, depth, priority, insight_json)
+                yield video_id, insight_json
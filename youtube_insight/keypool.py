@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+This is the developer key pool of youtube_insight crawler.
+It spreads data api calls over several developer keys, charges the quota cost of each call to its key,
+and rotates to the next key before the daily quota of current key runs out.
+
+The daily quota of a key resets at midnight Pacific Time, see https://developers.google.com/youtube/v3/getting-started
+"""
+
+import re, json, time, threading, logging
+
+# quota cost of the list method of each API resource
+QUOTA_COSTS = {'videos': 1, 'channels': 1, 'search': 100}
+
+# default daily quota of a developer key
+DAILY_QUOTA = 10000
+
+# developer key in a request url, e.g., of an API error message
+RE_KEY = re.compile(r'([?&]key=)[^&\s"\'>]+')
+
+# error reasons of a spent quota, rate limit errors are not among them as they are retried on the same key
+QUOTA_REASONS = {'quotaExceeded', 'dailyLimitExceeded'}
+
+
+class QuotaExhaustedError(Exception):
+    """ Raised when the daily quotas of all developer keys in a pool are spent.
+    """
+    pass
+
+
+def get_quota_day():
+    """ Get current quota day as a string.
+    It uses Pacific Standard Time all year round, so that during daylight saving time the quota is reset
+    one hour later than it actually is, but never earlier.
+    """
+    return time.strftime('%Y-%m-%d', time.gmtime(time.time() - 8 * 3600))
+
+
+def redact_key(text):
+    """ Hide developer keys in a text, e.g., an error message with the request url, before it is logged.
+    """
+    return RE_KEY.sub(r'\1<redacted>', text)
+
+
+def is_quota_error(status, content):
+    """ Check whether an API error response, given its http status and body, reports a spent quota.
+    """
+    if status != 403:
+        return False
+    try:
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        errors = json.loads(content)['error']['errors']
+        return any(error.get('reason') in QUOTA_REASONS for error in errors)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+
+
+class KeyPool(object):
+    def __init__(self, keys, daily_quota=DAILY_QUOTA, costs=None):
+        """ Set up a thread-safe pool of developer keys, each with daily_quota units a day.
+        costs maps an API resource to the quota cost of its list method, unknown resources cost 1 unit.
+        One pool can be shared by all crawlers of a process, each crawler builds its own client per key.
+        """
+        self.keys = list(keys)
+        if len(self.keys) == 0:
+            raise ValueError('KeyPool requires at least one developer key')
+        self.daily_quota = daily_quota
+        self.costs = dict(QUOTA_COSTS)
+        if costs is not None:
+            self.costs.update(costs)
+        self.used = {key: 0 for key in self.keys}
+        self.num_calls = {key: 0 for key in self.keys}
+        self.current = 0
+        self.quota_day = get_quota_day()
+        self.lock = threading.Lock()
+
+    def _reset_if_new_day(self):
+        quota_day = get_quota_day()
+        if quota_day != self.quota_day:
+            logging.warning('>>> Quota day {0} starts, reset quota usage of {1} keys'.format(quota_day, len(self.keys)))
+            self.quota_day = quota_day
+            self.used = {key: 0 for key in self.keys}
+            self.current = 0
+
+    def get_cost(self, resource):
+        """ Get the quota cost of calling the list method of resource.
+        """
+        return self.costs.get(resource, 1)
+
+    def acquire(self, resource):
+        """ Pick a key with enough quota left to call the list method of resource, and charge the cost to it.
+        Current key is used until its quota cannot afford the call, then the pool rotates to the next key.
+        It raises QuotaExhaustedError if no key can afford the call.
+        """
+        cost = self.get_cost(resource)
+        with self.lock:
+            self._reset_if_new_day()
+            for i in range(len(self.keys)):
+                index = (self.current + i) % len(self.keys)
+                key = self.keys[index]
+                if self.used[key] + cost <= self.daily_quota:
+                    if index != self.current:
+                        logging.warning('>>> Rotate to developer key #{0}'.format(index))
+                        self.current = index
+                    self.used[key] += cost
+                    self.num_calls[key] += 1
+                    return key
+        raise QuotaExhaustedError('Daily quotas of all {0} developer keys are spent'.format(len(self.keys)))
+
+    def mark_exhausted(self, key):
+        """ Mark the quota of key as spent for the rest of the day, e.g., after API reports quotaExceeded.
+        """
+        with self.lock:
+            if self.used[key] < self.daily_quota:
+                logging.warning('>>> Developer key #{0} is exhausted after {1} units'.format(
+                    self.keys.index(key), self.used[key]))
+                self.used[key] = self.daily_quota
+
+    def remaining(self):
+        """ Get the total quota units left today over all keys.
+        """
+        with self.lock:
+            self._reset_if_new_day()
+            return sum(self.daily_quota - used for used in self.used.values())
+
+    def stats(self):
+        """ Get the quota units used and the number of calls of each key, keys are referred to by their index.
+        """
+        with self.lock:
+            return [{'used': self.used[key], 'calls': self.num_calls[key]} for key in self.keys]
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+This is the metrics registry of youtube_insight crawler.
+It keeps thread-safe counters and latency histograms labeled by endpoint, e.g., requests, retries, failures,
+bytes received, time spent in backoff sleeps and in parsing, so that a slow crawl can be told apart as
+bound by the network, by backoff or by parsing.
+
+Metrics are exported as a json snapshot or in Prometheus text format, either on demand or periodically to a file
+by MetricsReporter.
+"""
+
+import json, time, bisect, threading, logging
+
+from youtube_insight import _write_atomic
+
+# prefix of metric names in Prometheus text format
+PREFIX = 'youtube_insight_'
+
+# upper bounds of latency histogram buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """ A histogram of observed values over fixed buckets, the last bucket is unbounded.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """ Estimate quantile q by linear interpolation within its bucket, None if nothing is observed.
+        Values in the unbounded bucket are estimated as the largest bucket bound.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count > 0 and cumulative + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def to_json(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip([str(bound) for bound in self.buckets] + ['+Inf'], self.counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {'count': self.count, 'sum': self.sum, 'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+                'buckets': buckets}
+
+
+class Metrics(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """ Set up an empty registry, one registry can be shared by all crawlers of a process.
+        Each metric is keyed by its name and labels, e.g., inc('requests_total', endpoint='videos.list').
+        """
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _get_key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """ Increase a counter by value.
+        """
+        key = self._get_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """ Observe a value, e.g., a latency in seconds, in a histogram.
+        """
+        key = self._get_key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets)
+            self.histograms[key].observe(value)
+
+    def get(self, name, **labels):
+        """ Get the value of a counter, 0 if never increased.
+        """
+        with self.lock:
+            return self.counters.get(self._get_key(name, labels), 0)
+
+    def snapshot(self):
+        """ Get all metrics as a json serializable dict.
+        """
+        with self.lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            histograms = {}
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                histograms.setdefault(name, []).append(dict(histogram.to_json(), labels=dict(labels)))
+        return {'timestamp': time.time(), 'uptime': time.time() - self.start_time,
+                'counters': counters, 'histograms': histograms}
+
+    def to_prometheus(self):
+        """ Get all metrics in Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            last_name = None
+            for (name, labels), value in sorted(self.counters.items()):
+                if name != last_name:
+                    lines.append('# TYPE {0}{1} counter'.format(PREFIX, name))
+                    last_name = name
+                lines.append('{0}{1}{2} {3}'.format(PREFIX, name, self._format_labels(labels), value))
+            last_name = None
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if name != last_name:
+                    lines.append('# TYPE {0}{1} histogram'.format(PREFIX, name))
+                    last_name = name
+                for bound, cumulative in histogram.to_json()['buckets'].items():
+                    lines.append('{0}{1}_bucket{2} {3}'.format(PREFIX, name,
+                                                               self._format_labels(labels + (('le', bound),)),
+                                                               cumulative))
+                lines.append('{0}{1}_sum{2} {3}'.format(PREFIX, name, self._format_labels(labels), histogram.sum))
+                lines.append('{0}{1}_count{2} {3}'.format(PREFIX, name, self._format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _format_labels(labels):
+        if len(labels) == 0:
+            return ''
+        return '{' + ','.join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for name, value in labels) + '}'
+
+
+class MetricsReporter(object):
+    def __init__(self, metrics, path, interval=60, fmt='json'):
+        """ Write metrics to path every interval seconds in a background thread, and once more on stop.
+        fmt is either 'json' for a json snapshot or 'prometheus' for Prometheus text format,
+        the file is replaced atomically so that a scraper never reads a partial file.
+        """
+        if fmt not in ('json', 'prometheus'):
+            raise ValueError('Unknown metrics format {0}'.format(fmt))
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.fmt = fmt
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='metrics-reporter', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                logging.error('--- Failed to write metrics to {0}: {1}'.format(self.path, str(e)))
+
+    def write(self):
+        """ Write current metrics to path.
+        """
+        if self.fmt == 'json':
+            text = json.dumps(self.metrics.snapshot())
+        else:
+            text = self.metrics.to_prometheus()
+        _write_atomic(self.path, text)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+This is the channel expansion pipeline of youtube_insight crawler.
+It crawls channels and the videos of those channels in one overlapped pass, in two stages over a bounded queue:
+1. channel stage lists channel statistics and channel videos page by page, for many channels concurrently,
+2. video stage crawls metadata of listed videos in batches of 50 ids per API call, while listing still goes on.
+Channel records and video records are written to two output stores, each with its own checkpoint index.
+
+On restart, finished channels are skipped, and the listed videos of finished channels that are not crawled yet
+are queued again, so that no video is lost by an interrupted run.
+
+Usage: python -m youtube_insight.pipeline -i data/channel_ids.txt -o data/channels.json -v data/videos.json -k data/keys.txt
+"""
+
+import os, sys, queue, logging, argparse, threading
+
+from youtube_insight import DATA_API, INSIGHT, PARTS, FIELDS
+from youtube_insight.crawler import Crawler, MAX_RESULTS
+from youtube_insight.engine import CrawlEngine
+from youtube_insight.checkpoint import Checkpoint
+from youtube_insight.sink import JsonlSink, iter_records
+from youtube_insight.keypool import KeyPool, DAILY_QUOTA
+
+# record types yielded by ChannelPipeline.run
+CHANNEL = 'channel'
+VIDEO = 'video'
+
+
+class ChannelPipeline(object):
+    def __init__(self, crawl_engine, batch_size=MAX_RESULTS, max_queue=None, historical=False, relevant=False):
+        """ Set up a channel expansion pipeline over crawl_engine, both stages run crawl_engine.workers threads.
+        Videos are crawled in batches of batch_size, at most max_queue listed videos wait for the video stage,
+        it defaults to 20 batches. Historical data and relevant videos are also crawled if historical or relevant.
+        """
+        self.crawl_engine = crawl_engine
+        self.batch_size = batch_size
+        self.max_queue = max_queue if max_queue is not None else 20 * batch_size
+        self.historical = historical
+        self.relevant = relevant
+        self.seen_ids = set()
+        self._lock = threading.Lock()
+
+    def _queue_video(self, video_queue, video_id):
+        """ Queue a listed video if it has not been seen, block while the queue is full.
+        """
+        with self._lock:
+            if video_id in self.seen_ids:
+                return
+            self.seen_ids.add(video_id)
+        video_queue.put(video_id)
+
+    def _run_channels(self, channel_ids, video_ids, video_queue, result_queue):
+        try:
+            for video_id in video_ids:
+                self._queue_video(video_queue, video_id)
+            on_video = lambda video_id: self._queue_video(video_queue, video_id)
+            for channel_id, channel_json in self.crawl_engine.map('crawl_channel_vids', channel_ids, on_video):
+                result_queue.put((CHANNEL, channel_id, channel_json))
+        finally:
+            video_queue.put(None)
+            result_queue.put(None)
+
+    def _run_videos(self, video_queue, result_queue):
+        try:
+            video_ids = iter(video_queue.get, None)
+            for video_id, video_json in self.crawl_engine.map_batches('crawl_insight_data_batch', video_ids,
+                                                                      self.batch_size, self.relevant, self.historical):
+                result_queue.put((VIDEO, video_id, video_json))
+        finally:
+            result_queue.put(None)
+
+    def run(self, channel_ids, video_ids=()):
+        """ Crawl channels and their videos, yield a tuple of (record_type, obj_id, obj_json) in completion order,
+        record_type is CHANNEL or VIDEO, obj_json is None if crawler fails.
+        video_ids are queued before any channel is listed, e.g., pending videos of a previous run.
+        Videos in seen_ids are not crawled, so that a resumed run can skip crawled videos.
+        """
+        video_queue = queue.Queue(maxsize=self.max_queue)
+        result_queue = queue.Queue(maxsize=self.max_queue)
+        stages = [threading.Thread(target=self._run_channels, args=(channel_ids, video_ids, video_queue, result_queue),
+                                   name='pipeline-channels', daemon=True),
+                  threading.Thread(target=self._run_videos, args=(video_queue, result_queue),
+                                   name='pipeline-videos', daemon=True)]
+        for stage in stages:
+            stage.start()
+        # each stage puts None once it finishes
+        num_running = len(stages)
+        while num_running > 0:
+            result = result_queue.get()
+            if result is None:
+                num_running -= 1
+            else:
+                yield result
+        for stage in stages:
+            stage.join()
+
+
+def get_pending_video_ids(channel_path, video_checkpoint):
+    """ Get the listed videos of crawled channels that are neither crawled nor failed.
+    """
+    pending_ids = []
+    for channel_json in iter_records(channel_path):
+        for video_id in channel_json.get('channelVideos', []):
+            if not video_checkpoint.is_done(video_id) and video_id not in video_checkpoint.failed_ids:
+                pending_ids.append(video_id)
+    return pending_ids
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help='input file path of channel ids', required=True)
+    parser.add_argument('-o', '--output', help='output file path of channel records', required=True)
+    parser.add_argument('-v', '--video-output', dest='video_output', help='output file path of video records',
+                        required=True)
+    parser.add_argument('-k', '--key-file', dest='key_file', help='file of developer keys, one per line', required=True)
+    parser.add_argument('-w', '--workers', type=int, default=8, help='number of worker threads in each stage')
+    parser.add_argument('--historical', dest='historical', action='store_true', default=False,
+                        help='also crawl historical data of videos')
+    parser.add_argument('-r', '--relevant', dest='relevant', action='store_true', default=False,
+                        help='also search relevant videos of videos')
+    parser.add_argument('--daily-quota', dest='daily_quota', type=int, default=DAILY_QUOTA,
+                        help='daily quota units of each developer key')
+    parser.add_argument('--session-cache', dest='session_cache', default=None,
+                        help='file to share cookie and sessiontoken of historical data crawler')
+    parser.add_argument('--api-rate', dest='api_rate', type=float, default=None,
+                        help='maximum data api requests per second')
+    parser.add_argument('--insight-rate', dest='insight_rate', type=float, default=None,
+                        help='maximum historical data requests per second')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], default=None, help='compress output files')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if not os.path.exists(args.input):
+        print('>>> Input file does not exist!')
+        print('>>> Exit...')
+        sys.exit(1)
+    logging.basicConfig(filename='./youtube_insight_crawler.log', level=logging.WARNING)
+
+    with open(args.key_file, 'r') as key_data:
+        key_pool = KeyPool([line.strip() for line in key_data if line.strip()], daily_quota=args.daily_quota)
+
+    def build_crawler():
+        insight_crawler = Crawler()
+        insight_crawler.set_key_pool(key_pool)
+        insight_crawler.set_parts(PARTS)
+        insight_crawler.set_fields(FIELDS)
+        insight_crawler.set_session_cache(args.session_cache)
+        return insight_crawler
+
+    rate_limits = {endpoint: rate for endpoint, rate in [(DATA_API, args.api_rate),
+                                                         (INSIGHT, args.insight_rate)] if rate is not None}
+    crawl_engine = CrawlEngine(build_crawler, workers=args.workers, rate_limits=rate_limits)
+
+    channel_checkpoint = Checkpoint(args.output).open()
+    video_checkpoint = Checkpoint(args.video_output).open()
+    channel_data = JsonlSink(args.output, compression=args.compression, checkpoint=channel_checkpoint).open()
+    video_data = JsonlSink(args.video_output, compression=args.compression, checkpoint=video_checkpoint).open()
+
+    pipeline = ChannelPipeline(crawl_engine, historical=args.historical, relevant=args.relevant)
+    pipeline.seen_ids.update(video_checkpoint.done_ids)
+    pipeline.seen_ids.update(video_checkpoint.failed_ids)
+    pending_ids = get_pending_video_ids(args.output, video_checkpoint)
+    print('>>> {0} channels crawled, {1} videos crawled, {2} videos pending from previous runs'.format(
+        len(channel_checkpoint.done_ids), len(video_checkpoint.done_ids), len(pending_ids)))
+
+    num_records = {CHANNEL: 0, VIDEO: 0}
+    with open(args.input, 'r') as input_data:
+        channel_ids = (line.rstrip() for line in input_data
+                       if line.rstrip() != '' and not channel_checkpoint.is_done(line.rstrip()))
+        for record_type, obj_id, obj_json in pipeline.run(channel_ids, pending_ids):
+            checkpoint, output_data = (channel_checkpoint, channel_data) if record_type == CHANNEL \
+                else (video_checkpoint, video_data)
+            if obj_json is not None:
+                output_data.write(obj_json, obj_id)
+                num_records[record_type] += 1
+            else:
+                checkpoint.mark_failed(obj_id)
+                logging.error('--- Crawler failed for {0} {1}'.format(record_type, obj_id))
+
+    video_data.close()
+    video_checkpoint.close()
+    channel_data.close()
+    channel_checkpoint.close()
+    print('>>> Crawled {0} channels and {1} videos'.format(num_records[CHANNEL], num_records[VIDEO]))
+    logging.warning('>>> Developer key stats: {0}'.format(key_pool.stats()))
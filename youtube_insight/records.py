@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+This is the compact record model of youtube_insight crawler.
+It holds crawled records in memory as __slots__ objects instead of nested dicts, so that millions of records
+can be kept for deduplication, joins or refresh diffing. Repeated strings, e.g., channel ids, category ids, tags and
+relevant video ids, are interned, count strings of statistics are kept as ints, and daily series as typed arrays.
+
+Each record converts losslessly from and back to the json layout of crawled records, i.e.,
+Record.from_json(obj_json).to_json() == obj_json. A value that does not fit its slot, e.g., a non-numeric count
+or a series of mixed types, and any unknown key are kept as they are in the extra dict of the record.
+A record is also a read-only mapping of the same json layout, e.g., record['statistics']['viewCount'], so that it
+can be passed wherever a crawled json object is read.
+"""
+
+import sys
+from array import array
+from collections.abc import Mapping
+
+from youtube_insight.sink import iter_records
+
+# kinds of slot values
+STR = 'str'                  # a string
+INTERN = 'intern'            # an interned string
+INT_STR = 'int_str'          # a string of a non-negative integer, kept as int
+RAW = 'raw'                  # any json value except null
+STR_LIST = 'str_list'        # a list of strings, kept as tuple
+INTERN_LIST = 'intern_list'  # a list of interned strings, kept as tuple
+SERIES = 'series'            # a list of numbers, kept as the narrowest int array or a float64 array
+
+# typecodes of int arrays from the narrowest, with their value ranges
+INT_TYPECODES = [(typecode, -2 ** (8 * size - 1), 2 ** (8 * size - 1) - 1)
+                 for typecode, size in [('b', 1), ('h', 2), ('i', 4), ('q', 8)]]
+
+
+def _pack(kind, value):
+    """ Pack a json value into its slot value, raise ValueError if it does not fit.
+    """
+    if kind == RAW:
+        return value
+    if kind == STR or kind == INTERN:
+        if type(value) is not str:
+            raise ValueError
+        return sys.intern(value) if kind == INTERN else value
+    if kind == INT_STR:
+        if type(value) is not str or not value.isdigit() or str(int(value)) != value:
+            raise ValueError
+        return int(value)
+    if kind == STR_LIST or kind == INTERN_LIST:
+        if type(value) is not list or not all(type(item) is str for item in value):
+            raise ValueError
+        return tuple(sys.intern(item) for item in value) if kind == INTERN_LIST else tuple(value)
+    if kind == SERIES:
+        # array series of historical data are numpy arrays
+        if type(value) is not list and hasattr(value, 'tolist'):
+            value = value.tolist()
+        if type(value) is not list:
+            raise ValueError
+        if all(type(item) is int for item in value):
+            low, high = (min(value), max(value)) if len(value) > 0 else (0, 0)
+            for typecode, type_low, type_high in INT_TYPECODES:
+                if type_low <= low and high <= type_high:
+                    return array(typecode, value)
+            raise ValueError
+        if all(type(item) is float for item in value):
+            return array('d', value)
+        raise ValueError
+    # kind is a Record class
+    if type(value) is not dict:
+        raise ValueError
+    return kind.from_json(value)
+
+
+def _unpack(kind, value):
+    """ Unpack a slot value into its json value.
+    """
+    if kind == INT_STR:
+        return str(value)
+    if kind == STR_LIST or kind == INTERN_LIST:
+        return list(value)
+    if kind == SERIES:
+        return value.tolist()
+    if isinstance(value, Record):
+        return value.to_json()
+    return value
+
+
+class Record(Mapping):
+    # (slot name, json path, kind) of each field, a path has at most two keys
+    FIELDS = ()
+    __slots__ = ('extra',)
+
+    @classmethod
+    def from_json(cls, obj_json):
+        """ Build a record from a json object.
+        """
+        record = cls.__new__(cls)
+        # copy the nested dicts, so that obj_json is left as it is
+        extra = {key: dict(value) if type(value) is dict else value for key, value in obj_json.items()}
+        for name, path, kind in cls.FIELDS:
+            parent = extra if len(path) == 1 else extra.get(path[0])
+            value = None
+            if type(parent) is dict and parent.get(path[-1]) is not None:
+                try:
+                    value = _pack(kind, parent[path[-1]])
+                    del parent[path[-1]]
+                except ValueError:
+                    pass
+            setattr(record, name, value)
+        # drop the nested dicts emptied above, an originally empty dict is kept
+        for key, value in obj_json.items():
+            if type(value) is dict and len(value) > 0 and type(extra.get(key)) is dict and len(extra[key]) == 0:
+                del extra[key]
+        record.extra = extra if len(extra) > 0 else None
+        return record
+
+    def to_json(self):
+        """ Convert the record back to its json object.
+        """
+        obj_json = {}
+        for name, path, kind in self.FIELDS:
+            value = getattr(self, name)
+            if value is None:
+                continue
+            parent = obj_json if len(path) == 1 else obj_json.setdefault(path[0], {})
+            parent[path[-1]] = _unpack(kind, value)
+        if self.extra is not None:
+            for key, value in self.extra.items():
+                if type(value) is dict and type(obj_json.get(key)) is dict:
+                    obj_json[key].update(value)
+                else:
+                    obj_json[key] = dict(value) if type(value) is dict else value
+        return obj_json
+
+    def __getitem__(self, key):
+        """ Get the json value of a top-level key, as in to_json, only the fields under key are unpacked.
+        """
+        obj_json = {}
+        for name, path, kind in self.FIELDS:
+            value = getattr(self, name) if path[0] == key else None
+            if value is not None:
+                parent = obj_json if len(path) == 1 else obj_json.setdefault(key, {})
+                parent[path[-1]] = _unpack(kind, value)
+        if self.extra is not None and key in self.extra:
+            value = self.extra[key]
+            if type(value) is dict and type(obj_json.get(key)) is dict:
+                obj_json[key].update(value)
+            else:
+                obj_json[key] = dict(value) if type(value) is dict else value
+        return obj_json[key]
+
+    def __iter__(self):
+        return iter(self.to_json())
+
+    def __len__(self):
+        return len(self.to_json())
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_json() == other.to_json()
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__, self.to_json())
+
+
+def _make_slots(fields):
+    return tuple(name for name, _, _ in fields)
+
+
+class InsightRecord(Record):
+    """ Historical data of a video, as returned by BaseCrawler._parse_xml.
+    """
+    FIELDS = (('start_date', ('startDate',), INTERN),
+              ('days', ('days',), SERIES),
+              ('daily_view', ('dailyView',), SERIES),
+              ('total_view', ('totalView',), RAW),
+              ('daily_share', ('dailyShare',), SERIES),
+              ('total_share', ('totalShare',), RAW),
+              ('daily_watch', ('dailyWatch',), SERIES),
+              ('avg_watch', ('avgWatch',), RAW),
+              ('daily_subscriber', ('dailySubscriber',), SERIES),
+              ('total_subscriber', ('totalSubscriber',), RAW))
+    __slots__ = _make_slots(FIELDS)
+
+
+class VideoRecord(Record):
+    """ A crawled video, as returned by Crawler.crawl_insight_data.
+    """
+    FIELDS = (('id', ('id',), STR),
+              ('published_at', ('snippet', 'publishedAt'), STR),
+              ('channel_id', ('snippet', 'channelId'), INTERN),
+              ('title', ('snippet', 'title'), STR),
+              ('description', ('snippet', 'description'), STR),
+              ('thumbnails', ('snippet', 'thumbnails'), STR),
+              ('channel_title', ('snippet', 'channelTitle'), INTERN),
+              ('category_id', ('snippet', 'categoryId'), INTERN),
+              ('tags', ('snippet', 'tags'), INTERN_LIST),
+              ('default_language', ('snippet', 'defaultLanguage'), INTERN),
+              ('default_audio_language', ('snippet', 'defaultAudioLanguage'), INTERN),
+              ('view_count', ('statistics', 'viewCount'), INT_STR),
+              ('comment_count', ('statistics', 'commentCount'), INT_STR),
+              ('favorite_count', ('statistics', 'favoriteCount'), INT_STR),
+              ('dislike_count', ('statistics', 'dislikeCount'), INT_STR),
+              ('like_count', ('statistics', 'likeCount'), INT_STR),
+              ('topic_ids', ('topicDetails', 'topicIds'), INTERN_LIST),
+              ('relevant_topic_ids', ('topicDetails', 'relevantTopicIds'), INTERN_LIST),
+              ('duration', ('contentDetails', 'duration'), INTERN),
+              ('definition', ('contentDetails', 'definition'), INTERN),
+              ('caption', ('contentDetails', 'caption'), INTERN),
+              ('licensed_content', ('contentDetails', 'licensedContent'), RAW),
+              ('insights', ('insights',), InsightRecord),
+              ('relevant_videos', ('relevantVideos',), INTERN_LIST),
+              ('crawled_at', ('crawledAt',), INTERN),
+              ('refreshed_at', ('refreshedAt',), INTERN))
+    __slots__ = _make_slots(FIELDS)
+
+
+class ChannelRecord(Record):
+    """ A crawled channel, as returned by Crawler.crawl_channel_vids.
+    """
+    FIELDS = (('channel_id', ('channelId',), STR),
+              ('published_at', ('snippet', 'publishedAt'), STR),
+              ('description', ('snippet', 'description'), STR),
+              ('thumbnails', ('snippet', 'thumbnails'), STR),
+              ('title', ('snippet', 'title'), STR),
+              ('view_count', ('statistics', 'viewCount'), INT_STR),
+              ('comment_count', ('statistics', 'commentCount'), INT_STR),
+              ('subscriber_count', ('statistics', 'subscriberCount'), INT_STR),
+              ('hidden_subscriber_count', ('statistics', 'hiddenSubscriberCount'), RAW),
+              ('video_count', ('statistics', 'videoCount'), INT_STR),
+              ('channel_videos', ('channelVideos',), STR_LIST))
+    __slots__ = _make_slots(FIELDS)
+
+
+def to_record(obj_json):
+    """ Build a ChannelRecord or a VideoRecord from a crawled json object.
+    """
+    if 'channelId' in obj_json:
+        return ChannelRecord.from_json(obj_json)
+    return VideoRecord.from_json(obj_json)
+
+
+def load_records(path):
+    """ Iterate over the records in all output shards of path as compact records, one line at a time.
+    """
+    for obj_json in iter_records(path):
+        yield to_record(obj_json)
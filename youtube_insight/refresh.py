@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+This is the incremental refresh of youtube_insight crawler.
+It reads an existing output store of video records, and writes a refreshed copy of it.
+Current statistics of every video are retrieved in batches, at the cost of 1 quota unit per 50 videos,
+while metadata and historical data are crawled again only for records that are stale or whose view count changed,
+see Crawler.refresh_insight_data_batch. New days of historical data are merged into the stored series.
+
+Records of videos no longer returned by the API, e.g., deleted, are copied as they are.
+Records whose API calls fail, e.g., once the quota is spent, are marked failed and left out, so that a resumed
+refresh retries them. An interrupted refresh resumes from the checkpoint index of the refreshed store.
+
+Usage: python -m youtube_insight.refresh -i data/video_insights.json -o data/video_insights.refreshed.json -k data/keys.txt
+"""
+
+import os, sys, logging, argparse
+
+from youtube_insight import DATA_API, INSIGHT, PARTS, FIELDS
+from youtube_insight.crawler import Crawler, MAX_RESULTS
+from youtube_insight.engine import CrawlEngine
+from youtube_insight.checkpoint import Checkpoint, get_record_id
+from youtube_insight.sink import JsonlSink, list_shards, iter_records
+from youtube_insight.keypool import KeyPool, DAILY_QUOTA
+
+
+def refresh(input_path, output_path, crawl_engine, max_age=7, min_change=0.1, compression=None):
+    """ Refresh the video records in input_path into output_path with crawl_engine.
+    Records already in output_path are skipped. Return a dict of the number of records by outcome,
+    i.e., statistics only, fully refreshed, kept as they are, and failed, which are refreshed again on a later run.
+    """
+    num_records = {'statistics': 0, 'full': 0, 'kept': 0, 'failed': 0}
+    checkpoint = Checkpoint(output_path).open()
+    output_data = JsonlSink(output_path, compression=compression, checkpoint=checkpoint).open()
+    records = (obj_json for obj_json in iter_records(input_path)
+               if 'id' in obj_json and not checkpoint.is_done(get_record_id(obj_json)))
+    for obj_json, refreshed_json in crawl_engine.refresh_insight_data_batch(records, max_age, min_change,
+                                                                            batch_size=MAX_RESULTS):
+        if refreshed_json is None:
+            num_records['failed'] += 1
+            checkpoint.mark_failed(obj_json['id'])
+            logging.error('--- Refresh failed for video {0}, retry on next run'.format(obj_json['id']))
+            continue
+        if refreshed_json is obj_json:
+            num_records['kept'] += 1
+            logging.error('--- Refresh found no video {0}, keep stored record'.format(obj_json['id']))
+        elif 'refreshedAt' in refreshed_json:
+            # only a record with new statistics has refreshedAt, a fully refreshed one is built from new metadata
+            num_records['statistics'] += 1
+        else:
+            num_records['full'] += 1
+        output_data.write(refreshed_json, obj_json['id'])
+    output_data.close()
+    checkpoint.close()
+    return num_records
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help='input path of crawled video records', required=True)
+    parser.add_argument('-o', '--output', help='output path of refreshed video records', required=True)
+    parser.add_argument('-k', '--key-file', dest='key_file', help='file of developer keys, one per line', required=True)
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of concurrent worker threads')
+    parser.add_argument('--max-age', dest='max_age', type=int, default=7,
+                        help='fully refresh records crawled this many days ago or earlier')
+    parser.add_argument('--min-change', dest='min_change', type=float, default=0.1,
+                        help='fully refresh records whose view count grew by this fraction or more')
+    parser.add_argument('--daily-quota', dest='daily_quota', type=int, default=DAILY_QUOTA,
+                        help='daily quota units of each developer key')
+    parser.add_argument('--session-cache', dest='session_cache', default=None,
+                        help='file to share cookie and sessiontoken of historical data crawler')
+    parser.add_argument('--api-rate', dest='api_rate', type=float, default=None,
+                        help='maximum data api requests per second')
+    parser.add_argument('--insight-rate', dest='insight_rate', type=float, default=None,
+                        help='maximum historical data requests per second')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], default=None, help='compress output file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if len(list_shards(args.input)) == 0:
+        print('>>> Input file does not exist!')
+        print('>>> Exit...')
+        sys.exit(1)
+    if os.path.abspath(args.input) == os.path.abspath(args.output):
+        print('>>> Output file must differ from input file!')
+        print('>>> Exit...')
+        sys.exit(1)
+    logging.basicConfig(filename='./youtube_insight_crawler.log', level=logging.WARNING)
+
+    with open(args.key_file, 'r') as key_data:
+        key_pool = KeyPool([line.strip() for line in key_data if line.strip()], daily_quota=args.daily_quota)
+
+    def build_crawler():
+        insight_crawler = Crawler()
+        insight_crawler.set_key_pool(key_pool)
+        insight_crawler.set_parts(PARTS)
+        insight_crawler.set_fields(FIELDS)
+        insight_crawler.set_session_cache(args.session_cache)
+        return insight_crawler
+
+    rate_limits = {endpoint: rate for endpoint, rate in [(DATA_API, args.api_rate),
+                                                         (INSIGHT, args.insight_rate)] if rate is not None}
+    crawl_engine = CrawlEngine(build_crawler, workers=args.workers, rate_limits=rate_limits)
+    num_records = refresh(args.input, args.output, crawl_engine, args.max_age, args.min_change, args.compression)
+    print('>>> Refreshed statistics of {0} records, fully refreshed {1} records, kept {2} records, '
+          'failed {3} records'.format(num_records['statistics'], num_records['full'], num_records['kept'],
+                                      num_records['failed']))
+    logging.warning('>>> Developer key stats: {0}'.format(key_pool.stats()))
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+This is the retry policy of youtube_insight crawler.
+A RetryPolicy retries a request with jittered exponential backoff, bounded by a number of tries and by elapsed time.
+Only retryable errors are retried, i.e., timeouts, connection errors, 5xx and 429 responses,
+while permanent errors, e.g., 404 or spent quota, fail at once.
+
+Each policy has a circuit breaker, which opens after several requests in a row fail, so that while an endpoint is down,
+requests fail fast instead of every worker sleeping through its backoff. A policy can instead hold requests until the
+circuit lets a probe through, e.g., for historical data, which is lost for good if its request fails.
+A policy is thread-safe and meant to be shared by all crawlers of an endpoint.
+"""
+
+import time, random, asyncio, logging, threading, http.client, urllib.error
+from googleapiclient.errors import HttpError
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from youtube_insight.keypool import QuotaExhaustedError, is_quota_error, redact_key
+from youtube_insight.endpoints import VIDEOS_LIST, CHANNELS_LIST, SEARCH_LIST, INSIGHT_AJAX
+
+# http statuses worth retrying, 403 rateLimitExceeded is also retried, see is_retryable
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+# http statuses of a rejected historical data session, the crawler gets a new session on them
+SESSION_STATUSES = (400, 401, 403)
+
+# errors without an http status that are worth retrying
+RETRY_ERRORS = (TimeoutError, asyncio.TimeoutError, OSError, http.client.HTTPException) + \
+               ((aiohttp.ClientPayloadError, aiohttp.ServerDisconnectedError) if aiohttp is not None else ())
+
+
+class CircuitOpenError(Exception):
+    """ Raised when a request is refused by an open circuit breaker.
+    """
+    pass
+
+
+def get_status(error):
+    """ Get the http status of a request error, None if it has none.
+    """
+    if isinstance(error, HttpError):
+        return error.resp.status
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code
+    # aiohttp.ClientResponseError
+    return getattr(error, 'status', None)
+
+
+class CircuitBreaker(object):
+    def __init__(self, failure_threshold=10, reset_timeout=30):
+        """ A thread-safe circuit breaker.
+        It opens after failure_threshold requests in a row fail, and refuses requests for reset_timeout seconds.
+        Then it lets one probe request through, which closes it on success, or opens it again on failure.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.num_failures = 0
+        self.open_time = None
+        self.is_probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """ Check whether a request is allowed.
+        """
+        with self.lock:
+            if self.open_time is None:
+                return True
+            if not self.is_probing and time.monotonic() - self.open_time >= self.reset_timeout:
+                self.is_probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.num_failures = 0
+            self.open_time = None
+            self.is_probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.num_failures += 1
+            if self.is_probing or (self.open_time is None and self.num_failures >= self.failure_threshold):
+                self.open_time = time.monotonic()
+                self.is_probing = False
+
+    def release_probe(self):
+        """ Let another probe through at once, after a probe neither succeeded nor failed, e.g., its session expired.
+        """
+        with self.lock:
+            self.is_probing = False
+
+    def is_open(self):
+        with self.lock:
+            return self.open_time is not None
+
+    def get_wait(self):
+        """ Get the seconds until the circuit lets a probe through, or a short poll interval while a probe is out.
+        """
+        with self.lock:
+            if self.open_time is None:
+                return 0
+            if self.is_probing:
+                return min(1.0, self.reset_timeout)
+            return max(0, self.open_time + self.reset_timeout - time.monotonic())
+
+
+class RetryPolicy(object):
+    def __init__(self, max_tries=3, base_delay=1.0, max_delay=30.0, max_elapsed=60.0,
+                 retry_statuses=RETRY_STATUSES, circuit_breaker=None, wait_open=False, name=None):
+        """ Set up a retry policy.
+        A request is tried at most max_tries times, the delay before try i + 1 is drawn uniformly from
+        [0, min(max_delay, base_delay * 2 ** i)], and no try starts after max_elapsed seconds from the first one.
+        Errors with http status in retry_statuses are retried, see is_retryable.
+        circuit_breaker defaults to a CircuitBreaker with default thresholds, pass False to turn it off.
+        A request refused by an open circuit fails with CircuitOpenError, or waits until the circuit lets a probe
+        through if wait_open is True, but no longer than max_elapsed seconds.
+        """
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+        self.retry_statuses = retry_statuses
+        self.circuit_breaker = CircuitBreaker() if circuit_breaker is None else circuit_breaker
+        self.wait_open = wait_open
+        self.name = name
+
+    def get_delay(self, attempt):
+        """ Get the backoff delay after try attempt fails, attempt starts from 0.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def is_retryable(self, error):
+        """ Check whether a request error is worth retrying.
+        """
+        if isinstance(error, (QuotaExhaustedError, CircuitOpenError)):
+            return False
+        status = get_status(error)
+        if status is not None:
+            if status in self.retry_statuses:
+                return True
+            # a per-second rate limit is retryable, a spent daily quota is not
+            return isinstance(error, HttpError) and status == 403 and not is_quota_error(status, error.content)
+        return isinstance(error, RETRY_ERRORS)
+
+    def _before_try(self, start_time):
+        """ Return None if a try is allowed, otherwise the seconds to wait before asking again.
+        """
+        if not self.circuit_breaker or self.circuit_breaker.allow():
+            return None
+        if not self.wait_open:
+            raise CircuitOpenError('Circuit of {0} is open after repeated failures'.format(self.name))
+        wait = self.circuit_breaker.get_wait()
+        if self.max_elapsed is not None and time.monotonic() + wait - start_time > self.max_elapsed:
+            raise CircuitOpenError('Circuit of {0} is still open after {1}s'.format(self.name, self.max_elapsed))
+        return wait
+
+    def _after_error(self, error, attempt, start_time):
+        """ Record a failed try, return the delay before next try, None if it should not be retried.
+        """
+        retryable = self.is_retryable(error)
+        if self.circuit_breaker:
+            if retryable and get_status(error) not in SESSION_STATUSES:
+                self.circuit_breaker.record_failure()
+            elif not retryable and not isinstance(error, (QuotaExhaustedError, CircuitOpenError)):
+                # the endpoint did answer, e.g., with 404
+                self.circuit_breaker.record_success()
+            else:
+                # a stale session or spent quota says nothing about the endpoint, but must not hold the probe
+                self.circuit_breaker.release_probe()
+        if not retryable or attempt + 1 >= self.max_tries:
+            return None
+        delay = self.get_delay(attempt)
+        if self.max_elapsed is not None and time.monotonic() + delay - start_time > self.max_elapsed:
+            return None
+        logging.warning('--- Retry {0} in {1:.1f}s after try {2} failed: {3}'.format(self.name, delay, attempt + 1,
+                                                                                       redact_key(str(error))))
+        return delay
+
+    def _after_success(self):
+        if self.circuit_breaker:
+            self.circuit_breaker.record_success()
+
+    def call(self, func, sleep=time.sleep):
+        """ Call func(attempt) until it returns, attempt starts from 0, and return its result.
+        The last error is raised if all tries fail, or at once if it is not retryable.
+        sleep is called with the backoff delay, e.g., to record it before sleeping.
+        """
+        start_time = time.monotonic()
+        attempt = 0
+        while True:
+            wait = self._before_try(start_time)
+            if wait is not None:
+                time.sleep(wait)
+                continue
+            try:
+                result = func(attempt)
+            except Exception as e:
+                delay = self._after_error(e, attempt, start_time)
+                if delay is None:
+                    raise
+                sleep(delay)
+                attempt += 1
+                continue
+            self._after_success()
+            return result
+
+    async def call_async(self, func, sleep=asyncio.sleep):
+        """ Await func(attempt) until it returns, see call.
+        Backoff is awaited, so other coroutines keep running while one request waits to retry.
+        """
+        start_time = time.monotonic()
+        attempt = 0
+        while True:
+            wait = self._before_try(start_time)
+            if wait is not None:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                result = await func(attempt)
+            except Exception as e:
+                delay = self._after_error(e, attempt, start_time)
+                if delay is None:
+                    raise
+                await sleep(delay)
+                attempt += 1
+                continue
+            self._after_success()
+            return result
+
+
+def get_default_policies():
+    """ Get a new set of default retry policies of all endpoints.
+    A rejected historical data session, i.e., 400, 401 or 403, is also retried, as the crawler gets a new session,
+    and historical data requests wait out an open circuit instead of failing.
+    """
+    return {VIDEOS_LIST: RetryPolicy(name=VIDEOS_LIST),
+            CHANNELS_LIST: RetryPolicy(name=CHANNELS_LIST),
+            SEARCH_LIST: RetryPolicy(name=SEARCH_LIST),
+            INSIGHT_AJAX: RetryPolicy(base_delay=0.5, retry_statuses=RETRY_STATUSES + SESSION_STATUSES,
+                                      wait_open=True, name=INSIGHT_AJAX)}
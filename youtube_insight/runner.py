@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+This is the multi-process runner of youtube_insight crawler.
+It splits input ids into shards by a hash of id, and crawls each shard in its own worker process,
+which writes its own output shard <output>.worker<k> with its own checkpoint index.
+After all workers exit, worker shards are merged into one deduplicated output.
+
+On restart, ids that are not crawled by any worker or found in the merged output are split again over all workers,
+so that the work left by a crashed or slow worker is rebalanced. The crawled ids of a worker are those that can be
+read back from its output shards, a worker shard torn by a crash is never appended to, and worker files are
+removed only once all their records are merged.
+
+Usage: python -m youtube_insight.runner -i data/video_ids.txt -o data/video_insights.json -k data/keys.txt -p 8
+"""
+
+import os, re, sys, glob, zlib, logging, argparse, multiprocessing
+
+from youtube_insight import DATA_API, INSIGHT, PARTS, FIELDS
+from youtube_insight.crawler import Crawler, MAX_RESULTS
+from youtube_insight.engine import CrawlEngine
+from youtube_insight.checkpoint import Checkpoint, get_record_id
+from youtube_insight.sink import JsonlSink, list_shards, iter_records
+from youtube_insight.keypool import KeyPool, DAILY_QUOTA
+
+
+def get_shard(obj_id, num_shards):
+    """ Get the shard index of an id, stable across processes and runs.
+    """
+    return zlib.crc32(obj_id.encode('utf-8')) % num_shards
+
+
+def get_worker_path(output_path, index):
+    """ Get the output path of worker index.
+    """
+    return '{0}.worker{1:03d}'.format(output_path, index)
+
+
+def list_worker_paths(output_path):
+    """ List the output paths of all workers of previous and current runs, found by their checkpoint index.
+    """
+    worker_paths = []
+    re_worker = re.compile(re.escape(output_path) + r'\.worker(\d+)\.done$')
+    for done_path in glob.glob(glob.escape(output_path) + '.worker*.done'):
+        match = re_worker.match(done_path)
+        if match is not None:
+            worker_paths.append((int(match.group(1)), done_path[:-len('.done')]))
+    return [worker_path for _, worker_path in sorted(worker_paths)]
+
+
+def _remove_worker_files(worker_path):
+    """ Remove the output shards, checkpoint index and id file of a worker.
+    """
+    for path in list_shards(worker_path) + [worker_path + suffix for suffix in ('.done', '.failed', '.ids')]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def split_ids(input_path, output_path, num_workers, retry_failed=False):
+    """ Split ids that are not crawled yet into one id file per worker, return the number of ids of each worker.
+    An id is crawled if it is in the checkpoint index of merged output, or can be read back from the output of any
+    worker, whose checkpoint index is rebuilt. Ids that failed before are skipped unless retry_failed is True.
+    """
+    done_ids = set()
+    failed_ids = set()
+    for path in [output_path] + list_worker_paths(output_path):
+        if path != output_path:
+            Checkpoint(path).rebuild()
+        with Checkpoint(path) as checkpoint:
+            done_ids.update(checkpoint.done_ids)
+            failed_ids.update(checkpoint.failed_ids)
+    skip_ids = done_ids if retry_failed else done_ids | failed_ids
+
+    num_ids = [0] * num_workers
+    id_files = [open(get_worker_path(output_path, i) + '.ids', 'w') for i in range(num_workers)]
+    try:
+        with open(input_path, 'r') as input_data:
+            for line in input_data:
+                obj_id = line.rstrip()
+                if obj_id == '' or obj_id in skip_ids:
+                    continue
+                # an id is written once even if it repeats in input file
+                skip_ids.add(obj_id)
+                shard = get_shard(obj_id, num_workers)
+                id_files[shard].write(obj_id + '\n')
+                num_ids[shard] += 1
+    finally:
+        for id_file in id_files:
+            id_file.close()
+    for i in range(num_workers):
+        if num_ids[i] == 0:
+            os.remove(get_worker_path(output_path, i) + '.ids')
+    return num_ids
+
+
+def run_worker(worker_path, config):
+    """ Crawl the ids in worker_path.ids, and write records to worker_path with its own checkpoint index.
+    It runs in a worker process, config is a dict of crawler options, see parse_args.
+    """
+    logging.basicConfig(filename=config['log_path'], level=logging.WARNING,
+                        format='%(asctime)s [' + os.path.basename(worker_path) + '] %(message)s')
+    key_pool = KeyPool(config['keys'], daily_quota=config['daily_quota'])
+
+    def build_crawler():
+        insight_crawler = Crawler()
+        insight_crawler.set_key_pool(key_pool)
+        insight_crawler.set_parts(PARTS)
+        insight_crawler.set_fields(FIELDS)
+        insight_crawler.set_session_cache(config['session_cache'])
+        return insight_crawler
+
+    rate_limits = {endpoint: rate for endpoint, rate in [(DATA_API, config['api_rate']),
+                                                         (INSIGHT, config['insight_rate'])] if rate is not None}
+    crawl_engine = CrawlEngine(build_crawler, workers=config['threads'], rate_limits=rate_limits)
+
+    checkpoint = Checkpoint(worker_path).open()
+    output_data = JsonlSink(worker_path, compression=config['compression'], checkpoint=checkpoint).open()
+    with open(worker_path + '.ids', 'r') as input_data:
+        target_ids = (line.rstrip() for line in input_data if not checkpoint.is_done(line.rstrip()))
+        if config['channel']:
+            results = crawl_engine.crawl_channel_vids(target_ids)
+        elif config['batch']:
+            results = crawl_engine.crawl_insight_data_batch(target_ids, config['relevant'], batch_size=MAX_RESULTS)
+        else:
+            results = crawl_engine.crawl_insight_data(target_ids, config['relevant'])
+
+        for target_id, target_data in results:
+            if target_data is not None:
+                output_data.write(target_data, target_id)
+            else:
+                checkpoint.mark_failed(target_id)
+                logging.error('--- Crawler failed for {0}'.format(target_id))
+    output_data.close()
+    checkpoint.close()
+    logging.warning('>>> Worker finished, developer key stats: {0}'.format(key_pool.stats()))
+
+
+def merge_workers(output_path, compression=None, keep_workers=False):
+    """ Merge the output shards of all workers into output_path, skip records that are already in it.
+    Failed ids are merged into the failed index of output_path.
+    Worker files are removed after merge unless keep_workers is True, or some records marked done in their checkpoint
+    index can not be read back, those are crawled again by next run. Return the number of merged records.
+    """
+    num_merged = 0
+    checkpoint = Checkpoint(output_path).open()
+    output_data = JsonlSink(output_path, compression=compression, checkpoint=checkpoint).open()
+    worker_paths = list_worker_paths(output_path)
+    failed_ids = set()
+    lost_workers = set()
+    for worker_path in worker_paths:
+        read_ids = set()
+        for obj_json in iter_records(worker_path):
+            obj_id = get_record_id(obj_json)
+            read_ids.add(obj_id)
+            if not checkpoint.is_done(obj_id):
+                # a record is marked done once written, so a repeated id is dropped within the merge too
+                output_data.write(obj_json, obj_id)
+                checkpoint.done_ids.add(obj_id)
+                num_merged += 1
+        with Checkpoint(worker_path) as worker_checkpoint:
+            failed_ids.update(worker_checkpoint.failed_ids)
+            if not worker_checkpoint.done_ids <= read_ids:
+                lost_workers.add(worker_path)
+                logging.error('--- Keep worker files of {0}, {1} crawled records can not be read back'.format(
+                    worker_path, len(worker_checkpoint.done_ids - read_ids)))
+    output_data.close()
+    for obj_id in failed_ids - checkpoint.done_ids - checkpoint.failed_ids:
+        checkpoint.mark_failed(obj_id)
+    checkpoint.close()
+
+    if not keep_workers:
+        for worker_path in worker_paths:
+            if worker_path not in lost_workers:
+                _remove_worker_files(worker_path)
+    return num_merged
+
+
+def run(input_path, output_path, num_workers, config, retry_failed=False, keep_workers=False):
+    """ Split ids, crawl them in num_workers processes, then merge worker outputs into output_path.
+    Worker outputs are not merged if any worker exits abnormally, they are picked up by the next run.
+    """
+    num_ids = split_ids(input_path, output_path, num_workers, retry_failed)
+    print('>>> {0} ids to crawl in {1} workers: {2}'.format(sum(num_ids), num_workers, num_ids))
+
+    processes = []
+    for i in range(num_workers):
+        if num_ids[i] == 0:
+            continue
+        process = multiprocessing.Process(target=run_worker, args=(get_worker_path(output_path, i), config))
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
+
+    failed_workers = [process.name for process in processes if process.exitcode != 0]
+    if len(failed_workers) > 0:
+        print('>>> {0} workers exited abnormally, rerun to resume and rebalance their ids'.format(len(failed_workers)))
+        return False
+    num_merged = merge_workers(output_path, config['compression'], keep_workers)
+    print('>>> Merged {0} records into {1}'.format(num_merged, output_path))
+    return True
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help='input file path of video ids or channel ids', required=True)
+    parser.add_argument('-o', '--output', help='output file path of video data or channel video list', required=True)
+    parser.add_argument('-k', '--key-file', dest='key_file', help='file of developer keys, one per line', required=True)
+    parser.add_argument('-p', '--processes', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of worker threads in each process')
+    parser.add_argument('-c', '--channel', dest='channel', action='store_true', default=False)
+    parser.add_argument('-r', '--relevant', dest='relevant', action='store_true', default=False)
+    parser.add_argument('-b', '--batch', dest='batch', action='store_true', default=False,
+                        help='crawl video metadata in batches of 50 ids per API call')
+    parser.add_argument('--daily-quota', dest='daily_quota', type=int, default=DAILY_QUOTA,
+                        help='daily quota units of each developer key, split evenly over processes')
+    parser.add_argument('--api-rate', dest='api_rate', type=float, default=None,
+                        help='maximum data api requests per second over all processes')
+    parser.add_argument('--insight-rate', dest='insight_rate', type=float, default=None,
+                        help='maximum historical data requests per second over all processes')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], default=None, help='compress output file')
+    parser.add_argument('--retry-failed', dest='retry_failed', action='store_true', default=False,
+                        help='also retry the ids that failed in previous runs')
+    parser.add_argument('--keep-workers', dest='keep_workers', action='store_true', default=False,
+                        help='keep worker output shards after merge')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if not os.path.exists(args.input):
+        print('>>> Input file does not exist!')
+        print('>>> Exit...')
+        sys.exit(1)
+
+    with open(args.key_file, 'r') as key_data:
+        keys = [line.strip() for line in key_data if line.strip()]
+    # quota and rate limits are per process, so the totals are split evenly over processes
+    runner_config = {'keys': keys,
+                     'daily_quota': args.daily_quota // args.processes,
+                     'threads': args.workers,
+                     'channel': args.channel,
+                     'relevant': args.relevant,
+                     'batch': args.batch,
+                     'api_rate': args.api_rate / args.processes if args.api_rate is not None else None,
+                     'insight_rate': args.insight_rate / args.processes if args.insight_rate is not None else None,
+                     'compression': args.compression,
+                     'session_cache': args.output + '.session',
+                     'log_path': './youtube_insight_crawler.log'}
+    run(args.input, args.output, args.processes, runner_config, args.retry_failed, args.keep_workers)
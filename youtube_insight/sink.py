@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+This is the output sink of youtube_insight crawler.
+It writes crawled records as json lines in batches, optionally gzip or zstd compressed and rotated into shards,
+and reads them back.
+
+Shards are named <path>[.<index>][.gz|.zst], e.g., video_insights.json.00003.gz,
+the index only exists when rotation is enabled, or when a compressed shard torn by a crash could not be appended to.
+"""
+
+import os, re, glob, gzip, zlib, json, time, logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COMPRESSION_SUFFIX = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# errors raised when reading a truncated or corrupted compressed shard
+CORRUPTED_SHARD_ERRORS = (zlib.error,) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def json_default(obj):
+    """ Serialize numpy arrays and scalars, e.g., array series of historical data, as json lists and numbers,
+    and compact records, see youtube_insight.records, as their json objects.
+    """
+    if hasattr(obj, 'to_json'):
+        return obj.to_json()
+    if np is not None:
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+    raise TypeError('Object of type {0} is not JSON serializable'.format(type(obj).__name__))
+
+
+def list_shards(path):
+    """ List existing output shards of path, in the order they were written.
+    """
+    shards = []
+    re_shard = re.compile(re.escape(path) + r'(\.(\d+))?(\.gz|\.zst)?$')
+    for shard_path in glob.glob(glob.escape(path) + '*'):
+        match = re_shard.match(shard_path)
+        if match is not None:
+            shards.append((int(match.group(2) or -1), shard_path))
+    return [shard_path for _, shard_path in sorted(shards)]
+
+
+def _get_decompressor(shard_path):
+    """ Get a decompressor for one gzip member or zstd frame of an output shard, None if shard is not compressed.
+    """
+    if shard_path.endswith('.gz'):
+        return zlib.decompressobj(zlib.MAX_WBITS | 16)
+    if shard_path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('Reading zstd shards requires zstandard, install it with pip install zstandard')
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+def _iter_chunks(shard_path, chunk_size=1 << 20, step_size=1 << 12):
+    """ Iterate over decompressed byte chunks of an output shard.
+    Compressed data is decompressed step_size bytes at a time, so that it stops at the first truncated or corrupted
+    gzip member or zstd frame after yielding everything before it.
+    """
+    with open(shard_path, 'rb') as fin:
+        decompressor = _get_decompressor(shard_path)
+        while True:
+            data = fin.read(chunk_size)
+            if not data:
+                break
+            if decompressor is None:
+                yield data
+                continue
+            try:
+                for start in range(0, len(data), step_size):
+                    step = data[start:start + step_size]
+                    while step:
+                        yield decompressor.decompress(step)
+                        step = b''
+                        # a shard written in several sessions has several gzip members or zstd frames
+                        if decompressor.eof:
+                            step = decompressor.unused_data
+                            decompressor = _get_decompressor(shard_path)
+            except CORRUPTED_SHARD_ERRORS as e:
+                logging.error('--- Output shard {0} is corrupted: {1}'.format(shard_path, str(e)))
+                return
+
+
+def _is_terminated(shard_path):
+    """ Check whether an output shard ends cleanly, i.e., a plain shard ends with a newline, and the last gzip member
+    or zstd frame of a compressed shard is complete. A shard left by a crash does not, and nothing can be appended
+    to it, as the new data would be glued to its torn tail. A compressed shard is decompressed through to check it.
+    """
+    if os.path.getsize(shard_path) == 0:
+        return True
+    decompressor = _get_decompressor(shard_path)
+    with open(shard_path, 'rb') as fin:
+        if decompressor is None:
+            fin.seek(-1, os.SEEK_END)
+            return fin.read(1) == b'\n'
+        in_frame = False
+        try:
+            for data in iter(lambda: fin.read(1 << 20), b''):
+                while data:
+                    decompressor.decompress(data)
+                    in_frame = True
+                    data = b''
+                    if decompressor.eof:
+                        data = decompressor.unused_data
+                        decompressor = _get_decompressor(shard_path)
+                        in_frame = False
+        except CORRUPTED_SHARD_ERRORS:
+            return False
+        return not in_frame
+
+
+def _truncate_torn_line(shard_path):
+    """ Truncate a plain output shard after its last newline, so that a torn last line left by a crash is dropped.
+    """
+    with open(shard_path, 'r+b') as fout:
+        end = total = fout.seek(0, os.SEEK_END)
+        size = 0
+        while end > 0:
+            start = max(0, end - (1 << 16))
+            fout.seek(start)
+            index = fout.read(end - start).rfind(b'\n')
+            if index != -1:
+                size = start + index + 1
+                break
+            end = start
+        logging.error('--- Drop torn last line of {0} bytes in output shard {1}'.format(total - size, shard_path))
+        fout.truncate(size)
+
+
+def iter_lines(path):
+    """ Iterate over complete json lines in all output shards of path.
+    An incomplete last line or a truncated compressed stream, e.g., left by a crash, is skipped.
+    """
+    for shard_path in list_shards(path):
+        remainder = b''
+        for chunk in _iter_chunks(shard_path):
+            lines = (remainder + chunk).split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                if len(line) > 0:
+                    yield line.decode('utf-8')
+        if len(remainder) > 0:
+            logging.error('--- Skip incomplete last line in output shard {0}'.format(shard_path))
+
+
+def iter_records(path):
+    """ Iterate over records in all output shards of path, skip corrupted lines.
+    """
+    for line in iter_lines(path):
+        try:
+            yield json.loads(line)
+        except ValueError:
+            logging.error('--- Skip corrupted line in output file {0}'.format(path))
+
+
+class JsonlSink(object):
+    def __init__(self, path, compression=None, batch_size=100, fsync_interval=None,
+                 rotate_records=None, rotate_bytes=None, checkpoint=None):
+        """ Set up an output sink.
+        compression is None, 'gzip' or 'zstd'.
+        Records are written in batches of batch_size, file is fsynced at most every fsync_interval seconds.
+        A new shard is started when current one reaches rotate_records records or rotate_bytes uncompressed bytes.
+        If a checkpoint is given, record ids are marked done only after their batch is written,
+        more checkpoints, i.e., any object with mark_done, can be added with add_checkpoint.
+        """
+        if compression not in COMPRESSION_SUFFIX:
+            raise ValueError('Unknown compression {0}, use gzip or zstd'.format(compression))
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstd compression requires zstandard, install it with pip install zstandard')
+        self.path = path
+        self.compression = compression
+        self.batch_size = batch_size
+        self.fsync_interval = fsync_interval
+        self.rotate_records = rotate_records
+        self.rotate_bytes = rotate_bytes
+        self.checkpoint = checkpoint
+        self.checkpoints = [checkpoint] if checkpoint is not None else []
+
+        self.buffer = []
+        self.pending_ids = []
+        self.shard_index = None
+        self.shard_records = 0
+        self.shard_bytes = 0
+        self.last_fsync = time.monotonic()
+        self._raw = None
+        self._writer = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add_checkpoint(self, checkpoint):
+        """ Add a checkpoint whose mark_done is called with record ids once their batch is written,
+        e.g., a crawl frontier.
+        """
+        self.checkpoints.append(checkpoint)
+
+    def _is_rotated(self):
+        return self.rotate_records is not None or self.rotate_bytes is not None
+
+    def _shard_path(self):
+        """ Get the path of current shard.
+        """
+        if self.shard_index is not None:
+            return '{0}.{1:05d}{2}'.format(self.path, self.shard_index, COMPRESSION_SUFFIX[self.compression])
+        return self.path + COMPRESSION_SUFFIX[self.compression]
+
+    def _get_shard_index(self, shard_path):
+        """ Get the index of an existing shard of path, None if it has no index.
+        """
+        match = re.match(r'\.(\d+)', shard_path[len(self.path):])
+        return int(match.group(1)) if match is not None else None
+
+    def open(self):
+        """ Open a shard for appending. With rotation, a new shard is started after the existing ones.
+        Without rotation, the last shard is appended to if it ends cleanly. Otherwise, e.g., after a crash, a torn
+        last line of a plain shard is truncated, and a new shard is started after a torn compressed one.
+        """
+        all_shards = list_shards(self.path)
+        # only a shard of current compression can be appended to
+        shards = [shard_path for shard_path in all_shards
+                  if shard_path.endswith(('.gz', '.zst')) == (self.compression is not None) and
+                  shard_path.endswith(COMPRESSION_SUFFIX[self.compression])]
+        indexes = [self._get_shard_index(shard_path) for shard_path in all_shards]
+        next_index = max([index + 1 for index in indexes if index is not None] + [0])
+        if self._is_rotated():
+            self.shard_index = next_index
+        elif len(shards) > 0:
+            self.shard_index = self._get_shard_index(shards[-1])
+            if not _is_terminated(shards[-1]):
+                if self.compression is None:
+                    _truncate_torn_line(shards[-1])
+                else:
+                    logging.error('--- Output shard {0} is torn, start a new shard'.format(shards[-1]))
+                    self.shard_index = next_index
+        self._open_shard()
+        return self
+
+    def _open_shard(self):
+        """ Open current shard, a compressed shard is appended as a new gzip member or zstd frame.
+        """
+        self._raw = open(self._shard_path(), 'ab')
+        if self.compression == 'gzip':
+            self._writer = gzip.GzipFile(fileobj=self._raw, mode='ab')
+        elif self.compression == 'zstd':
+            self._writer = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        else:
+            self._writer = self._raw
+        self.shard_records = 0
+        self.shard_bytes = 0
+
+    def _close_shard(self):
+        """ Close current shard, and make it durable.
+        """
+        if self._writer is not self._raw:
+            self._writer.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        self._raw = None
+        self._writer = None
+
+    def write(self, obj_json, obj_id=None):
+        """ Buffer a record, and write the buffer once it holds batch_size records.
+        """
+        self.buffer.append('{0}\n'.format(json.dumps(obj_json, default=json_default)))
+        if obj_id is not None:
+            self.pending_ids.append(obj_id)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Write buffered records to current shard, fsync if the interval has passed, then rotate if needed.
+        """
+        if len(self.buffer) > 0:
+            data = ''.join(self.buffer).encode('utf-8')
+            self._writer.write(data)
+            if self.compression == 'zstd':
+                self._writer.flush(zstandard.FLUSH_BLOCK)
+            else:
+                # gzip does a sync flush, so that everything written so far can be decompressed after a crash
+                self._writer.flush()
+            self._raw.flush()
+            self.shard_records += len(self.buffer)
+            self.shard_bytes += len(data)
+            self.buffer = []
+
+        if self.fsync_interval is not None and time.monotonic() - self.last_fsync >= self.fsync_interval:
+            os.fsync(self._raw.fileno())
+            self.last_fsync = time.monotonic()
+
+        for checkpoint in self.checkpoints:
+            for obj_id in self.pending_ids:
+                checkpoint.mark_done(obj_id)
+        self.pending_ids = []
+
+        if (self.rotate_records is not None and self.shard_records >= self.rotate_records) or \
+                (self.rotate_bytes is not None and self.shard_bytes >= self.rotate_bytes):
+            self._close_shard()
+            self.shard_index += 1
+            self._open_shard()
+
+    def close(self):
+        """ Write remaining records and close current shard.
+        """
+        if self._raw is not None:
+            self.flush()
+            self._close_shard()